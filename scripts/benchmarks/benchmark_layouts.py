@@ -0,0 +1,109 @@
+"""
+Benchmark of the storage chunk layouts of interpolated outputs.
+
+Writes the same synthetic (time, lat, lon) field with every layout of
+``utils_chunking.OUTPUT_LAYOUTS`` (the encoding of the interpolation
+outputs: float32, shuffle, zlib level 1) and times the two common reads:
+one map (all grid cells of one time step) and one point series (all time
+steps of one grid cell), at random positions, reopening the file for every
+read. The dual layout is the series layout plus a map copy: each read goes to
+the copy laid out for it, at the cost of both files on disk.
+
+Usage:
+    python benchmark_layouts.py [--ntime 365] [--nlat 251] [--nlon 651] [--reads 20]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../utilities')))
+from logging_utils import setup_logging
+from utils_chunking import OUTPUT_LAYOUTS, output_chunksizes
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_dataset(ntime, nlat, nlon, seed=0):
+    """Smooth field plus noise, so compression behaves like real data."""
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(25, 50, nlat)
+    lon = np.linspace(-20, 45, nlon)
+    seasonal = 10 * np.sin(np.arange(ntime) * 2 * np.pi / 365)[:, None, None]
+    spatial = 30 * np.cos(np.deg2rad(lat))[None, :, None]
+    data = (270 + seasonal + spatial + rng.normal(0, 1, (ntime, nlat, nlon))).astype("float32")
+    return xr.Dataset(
+        {"tas": (("time", "lat", "lon"), data)},
+        coords={"time": pd.date_range("2020-01-01", periods=ntime, freq="D"), "lat": lat, "lon": lon},
+    )
+
+
+def write_layout(ds, path, layout):
+    chunksizes = output_chunksizes(layout, ds["tas"].shape)
+    encoding = {"tas": dict(dtype="float32", shuffle=True, zlib=True, complevel=1, chunksizes=chunksizes)}
+    start = time.perf_counter()
+    ds.to_netcdf(path, encoding=encoding, unlimited_dims=["time"])
+    return time.perf_counter() - start, chunksizes
+
+
+def time_reads(path, selections):
+    """Mean seconds of reading each selection, opening the file every time."""
+    timings = []
+    for selection in selections:
+        start = time.perf_counter()
+        with xr.open_dataset(path, cache=False) as ds:
+            ds["tas"].isel(selection).values
+        timings.append(time.perf_counter() - start)
+    return float(np.mean(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark map and point-series reads of the output chunk layouts.")
+    parser.add_argument("--ntime", type=int, default=365, help="Time steps (a yearly daily file by default)")
+    parser.add_argument("--nlat", type=int, default=251, help="Latitudes (Medcof 0.1 deg by default)")
+    parser.add_argument("--nlon", type=int, default=651, help="Longitudes")
+    parser.add_argument("--reads", type=int, default=20, help="Random reads of each kind")
+    args = parser.parse_args()
+
+    setup_logging(force=True)
+    ds = synthetic_dataset(args.ntime, args.nlat, args.nlon)
+    rng = np.random.default_rng(1)
+    maps = [{"time": int(i)} for i in rng.integers(0, args.ntime, args.reads)]
+    series = [{"lat": int(j), "lon": int(k)} for j, k in zip(rng.integers(0, args.nlat, args.reads), rng.integers(0, args.nlon, args.reads))]
+
+    rows = {}
+    with tempfile.TemporaryDirectory(prefix="layouts-") as tmp:
+        for layout in OUTPUT_LAYOUTS:
+            path = os.path.join(tmp, f"{layout}.nc")
+            write_seconds, chunks = write_layout(ds, path, layout)
+            rows[layout] = {
+                "chunks": str(chunks),
+                "MiB": os.path.getsize(path) / 1024**2,
+                "write s": write_seconds,
+                "map read ms": 1000 * time_reads(path, maps),
+                "series read ms": 1000 * time_reads(path, series),
+            }
+    rows["dual (series + map)"] = {
+        "chunks": "both",
+        "MiB": rows["series"]["MiB"] + rows["map"]["MiB"],
+        "write s": rows["series"]["write s"] + rows["map"]["write s"],
+        "map read ms": rows["map"]["map read ms"],
+        "series read ms": rows["series"]["series read ms"],
+    }
+
+    report = pd.DataFrame.from_dict(rows, orient="index")
+    logger.info(
+        f"{args.ntime} x {args.nlat} x {args.nlon}, mean of {args.reads} random reads:\n"
+        f"{report.to_string(float_format='%.2f')}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
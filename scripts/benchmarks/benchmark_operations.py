@@ -0,0 +1,170 @@
+"""
+Micro-benchmark of the derived-variable operations.
+
+Builds synthetic hourly fields on a regular lat/lon grid, times each operation
+of ``scripts/derived/operations.py`` and reports grid-points per second
+(time steps x grid cells / wall time) and the peak memory allocated during the
+computation, for float32 and/or float64 inputs. The fast kernel variants are
+also checked against the xclim-based operations.
+
+Usage:
+    python benchmark_operations.py [--ntime 48] [--nlat 181] [--nlon 360] [--repeat 3] [--precision both]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../derived')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../utilities')))
+import operations
+from logging_utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Maximum absolute difference allowed between a kernel and its xclim reference
+TOLERANCES = {
+    "mrt": 0.05,   # K
+    "utci": 0.05,  # K
+}
+
+
+def synthetic_inputs(ntime, nlat, nlon, chunks=None, seed=0, precision="float32"):
+    """Return a dict of single-variable datasets with plausible hourly values."""
+    rng = np.random.default_rng(seed)
+    coords = {
+        "time": pd.date_range("2020-06-01", periods=ntime, freq="h"),
+        "latitude": xr.DataArray(np.linspace(80, -80, nlat), dims="latitude", attrs={"units": "degrees_north", "standard_name": "latitude"}),
+        "longitude": xr.DataArray(np.linspace(-180, 180, nlon, endpoint=False), dims="longitude", attrs={"units": "degrees_east", "standard_name": "longitude"}),
+    }
+    dims = ("time", "latitude", "longitude")
+    shape = (ntime, nlat, nlon)
+
+    def field(name, low, high, units):
+        data = rng.uniform(low, high, shape).astype(precision)
+        ds = xr.Dataset({name: xr.DataArray(data, dims=dims, coords=coords, attrs={"units": units})})
+        return ds.chunk(chunks) if chunks else ds
+
+    t2m = field("t2m", 260, 310, "K")
+    d2m = t2m.rename({"t2m": "d2m"}) - 5
+    d2m["d2m"].attrs["units"] = "K"
+    mrt = t2m.rename({"t2m": "mrt"}) + 10
+    mrt["mrt"].attrs["units"] = "K"
+    return {
+        "t2m": t2m,
+        "d2m": d2m,
+        "ps": field("ps", 85000, 103000, "Pa"),
+        "u10": field("u10", -10, 10, "m s-1"),
+        "v10": field("v10", -10, 10, "m s-1"),
+        "rsds": field("rsds", 0, 900, "W m-2"),
+        "rsus": field("rsus", 0, 200, "W m-2"),
+        "rlds": field("rlds", 200, 450, "W m-2"),
+        "rlus": field("rlus", 250, 500, "W m-2"),
+        "sfcwind": field("sfcwind", 0.5, 17, "m s-1"),
+        "hurs": field("hurs", 5, 100, "%"),
+        "mrt": mrt,
+    }
+
+
+BENCHMARKS = [
+    ("rh_from_thermofeel", ["d2m", "t2m"]),
+    ("sh_xclim", ["d2m", "ps"]),
+    ("sfcwind_from_u_v", ["u10", "v10"]),
+    ("mrt_from_rsus_rlus_rsds_rlds", ["rsus", "rlus", "rsds", "rlds"]),
+    ("mrt_fast_from_rsus_rlus_rsds_rlds", ["rsus", "rlus", "rsds", "rlds"]),
+    ("utci_from_t2m_sfcwind_hurs_mrt", ["t2m", "sfcwind", "hurs", "mrt"]),
+    ("utci_fast_from_t2m_sfcwind_hurs_mrt", ["t2m", "sfcwind", "hurs", "mrt"]),
+]
+
+# fast kernel -> xclim-based reference
+VALIDATIONS = {
+    "mrt_fast_from_rsus_rlus_rsds_rlds": ("mrt_from_rsus_rlus_rsds_rlds", "mrt"),
+    "utci_fast_from_t2m_sfcwind_hurs_mrt": ("utci_from_t2m_sfcwind_hurs_mrt", "utci"),
+}
+
+
+def _time_operation(func, inputs, repeat):
+    """Return the output, best wall time and peak traced memory (bytes) of an operation."""
+    timings = []
+    tracemalloc.start()
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        out = func(*inputs).compute()
+        timings.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, min(timings), peak
+
+
+def run(ntime, nlat, nlon, repeat, chunks, precisions=("float32",)):
+    npoints = ntime * nlat * nlon
+    results = {}
+    rows = []
+
+    for precision in precisions:
+        inputs = synthetic_inputs(ntime, nlat, nlon, chunks, precision=precision)
+        for name, deps in BENCHMARKS:
+            func = getattr(operations, name)
+            out, best, peak = _time_operation(func, [inputs[d] for d in deps], repeat)
+            results[(name, precision)] = out
+            var = list(out.data_vars)[0]
+            rows.append({
+                "operation": name,
+                "inputs": precision,
+                "output": str(out[var].dtype),
+                "seconds": best,
+                "Mpoints/s": npoints / best / 1e6,
+                "peak MiB": peak / 1024**2,
+            })
+
+    report = pd.DataFrame(rows).set_index(["operation", "inputs"]).sort_index()
+    logger.info(f"Grid {ntime} x {nlat} x {nlon} ({npoints:,} points), best of {repeat}:\n{report.to_string(float_format='%.3f')}")
+
+    if {"float32", "float64"} <= set(precisions):
+        ratio = (
+            report.xs("float32", level="inputs")[["seconds", "peak MiB"]]
+            / report.xs("float64", level="inputs")[["seconds", "peak MiB"]]
+        )
+        logger.info(f"float32 / float64 ratio:\n{ratio.to_string(float_format='%.2f')}")
+
+    failed = False
+    for precision in precisions:
+        for fast, (reference, var) in VALIDATIONS.items():
+            diff = np.abs(
+                results[(fast, precision)][var].astype(np.float64)
+                - results[(reference, precision)][var].astype(np.float64)
+            )
+            max_diff = float(diff.max())
+            ok = max_diff <= TOLERANCES[var]
+            failed |= not ok
+            logger.info(f"{fast} vs {reference} ({precision} inputs): max |diff| = {max_diff:.4g} (tolerance {TOLERANCES[var]}) {'PASS' if ok else 'FAIL'}")
+
+    return report, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark derived-variable operations.")
+    parser.add_argument("--ntime", type=int, default=48, help="Hourly time steps")
+    parser.add_argument("--nlat", type=int, default=181, help="Latitude points")
+    parser.add_argument("--nlon", type=int, default=360, help="Longitude points")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per operation (best is reported)")
+    parser.add_argument("--chunk-time", type=int, default=24, help="Dask chunk size along time (0 for NumPy inputs)")
+    parser.add_argument("--precision", choices=["float32", "float64", "both"], default="both", help="Precision of the synthetic inputs")
+    args = parser.parse_args()
+
+    setup_logging(force=True)
+    chunks = {"time": args.chunk_time} if args.chunk_time else None
+    precisions = ("float32", "float64") if args.precision == "both" else (args.precision,)
+    _, failed = run(args.ntime, args.nlat, args.nlon, args.repeat, chunks, precisions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
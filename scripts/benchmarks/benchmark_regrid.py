@@ -0,0 +1,261 @@
+"""
+Benchmark of the regridding weights and of the sparse-matrix regridding engine.
+
+Builds synthetic fields on source grids shaped like the interpolation sources
+(ERA5 0.25 deg regular lat/lon, the CERRA Lambert conformal grid with 2-D
+coordinates only, the EASE2 north sea-ice grid with ``xc``/``yc`` in km) and
+regrids them to target grids like the reference grids (Medcof 0.1 deg box,
+0.0625 deg box over the CERRA domain, global 0.25 deg) with the methods of
+``scripts/interpolation`` (``bilinear``, ``conservative_normed``). Every case
+is timed in three phases, as the interpolation driver runs them:
+
+- ``weights (generate)``: source geometry (``utils_grids``) and weights
+  computed from scratch, in an empty cache directory;
+- ``weights (load cache)``: the same weights read back from the cache by a
+  fresh process (in-memory caches cleared);
+- ``apply ...``: the time steps regridded with the loaded weights by
+  ``utils_regrid.SparseRegridder`` (NumPy and dask inputs), and by the xESMF
+  regridder and the current ``c3s_atlas.interpolation.Interpolator`` (which
+  builds its weights on every call) when they are installed.
+
+Each phase reports its best wall time and the peak memory traced by
+``tracemalloc`` during one more run (allocations made inside ESMF are not
+traced; the peak resident size of the whole process is logged at the end).
+Weights and geometries are written to a temporary directory, never to the
+shared caches. Weights that need ESMF (conservative, or bilinear from a 2-D
+source) skip the case without xESMF.
+
+Usage:
+    python benchmark_regrid.py [--ntime 48] [--scale 0.5] [--sources era5 cerra ease2-nh]
+                               [--targets medcof gr006 gr025] [--methods bilinear conservative_normed]
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../utilities')))
+from logging_utils import setup_logging
+import utils_grids
+import utils_regrid
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("bilinear", "conservative_normed")
+
+
+def synthetic_field(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(250, 310, shape).astype("float32")
+
+
+def era5_source(scale, ntime):
+    """Global regular 0.25 deg grid (coarser with ``scale`` < 1), latitudes descending."""
+    step = 0.25 / scale
+    lats, lons = np.arange(90, -90 - step / 2, -step), np.arange(0, 360, step)
+    return xr.Dataset(
+        {"tas": (("time", "latitude", "longitude"), synthetic_field((ntime, lats.size, lons.size)))},
+        coords={"time": pd.date_range("2020-01-01", periods=ntime, freq="D"), "latitude": lats, "longitude": lons},
+    )
+
+
+def _projected_source(grid, x, y, ntime, dims, projected_coords):
+    from pyproj import Transformer
+
+    transformer = Transformer.from_crs(utils_grids.PROJECTED_GRIDS[grid]["crs"], "EPSG:4326", always_xy=True)
+    lon, lat = transformer.transform(*np.meshgrid(x, y))
+    coords = {
+        "time": pd.date_range("2020-01-01", periods=ntime, freq="D"),
+        "latitude": (dims, lat),
+        "longitude": (dims, lon),
+    }
+    if projected_coords:
+        coords[dims[1]] = (dims[1], x / 1000, {"units": "km"})
+        coords[dims[0]] = (dims[0], y / 1000, {"units": "km"})
+    return xr.Dataset({"tas": (("time", *dims), synthetic_field((ntime, y.size, x.size)))}, coords=coords)
+
+
+def cerra_source(scale, ntime):
+    """Lambert conformal grid like CERRA (1069 x 1069 at 5.5 km), with 2-D lat/lon only."""
+    n = int(1069 * scale)
+    x = (np.arange(n) - (n - 1) / 2) * 5500.0 / scale
+    return _projected_source("cerra-lcc", x, x, ntime, ("y", "x"), projected_coords=False)
+
+
+def ease2_source(scale, ntime):
+    """EASE2 north grid of the sea-ice concentration (432 x 432 at 25 km), ``xc``/``yc`` in km, land as NaN."""
+    n = int(432 * scale)
+    x = (np.arange(n) - (n - 1) / 2) * 25000.0 / scale
+    ds = _projected_source("ease2-nh", x, x[::-1], ntime, ("yc", "xc"), projected_coords=True)
+    return ds.assign(tas=ds["tas"].where(ds["latitude"] > 45))
+
+
+# name -> (dataset builder, utils_grids.PROJECTED_GRIDS name)
+SOURCES = {
+    "era5": (era5_source, None),
+    "cerra": (cerra_source, "cerra-lcc"),
+    "ease2-nh": (ease2_source, "ease2-nh"),
+}
+
+
+def regular_grid(lat0, lat1, lon0, lon1, step, scale):
+    step = step / scale
+    return np.arange(lat0, lat1 + step / 2, step), np.arange(lon0, lon1 + step / 2, step)
+
+
+TARGETS = {
+    # Mediterranean 0.1 deg box standing in for ECMWF_Land_Medcof.nc
+    "medcof": lambda s: regular_grid(25, 50, -20, 45, 0.1, s),
+    # 0.0625 deg box covering the CERRA domain
+    "gr006": lambda s: regular_grid(20, 75, -58, 74, 0.0625, s),
+    # Global 0.25 deg grid
+    "gr025": lambda s: regular_grid(-89.875, 89.875, -179.875, 179.875, 0.25, s),
+}
+
+
+def clear_caches():
+    """Forget the weights, regridders and geometries held in memory, as in a new process."""
+    utils_regrid._WEIGHTS.clear()
+    utils_regrid._REGRIDDERS.clear()
+    utils_grids._GEOMETRIES.clear()
+
+
+def fresh_cache(base_dir):
+    """Point the weight cache and the grid registry to a new empty directory."""
+    clear_caches()
+    cache_dir = tempfile.mkdtemp(dir=base_dir)
+    utils_regrid.REGRID_WEIGHTS_DIR = cache_dir
+    utils_grids.GRID_REGISTRY_DIR = cache_dir
+    return cache_dir
+
+
+def _measure(func, repeat, setup=None):
+    """
+    Best wall time of ``func`` and the peak memory traced during one more run.
+
+    ``setup`` runs untimed before every run. Returns the output of the last
+    run, the best time in seconds and the peak in bytes.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    out = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, min(timings), peak
+
+
+def run_case(source, target, method, ntime, scale, repeat, time_block, base_dir):
+    builder, source_grid = SOURCES[source]
+    ds = builder(scale, ntime)
+    dst_lats, dst_lons = TARGETS[target](scale)
+    name = f"{source} -> {target}"
+    int_attr = {
+        "interpolation_method": method, "lats": dst_lats, "lons": dst_lons, "var_name": "tas",
+        "source_grid": source_grid,
+    }
+    logger.info(f"{name}: source {ds['tas'].shape[1:]}, target {len(dst_lats)} x {len(dst_lons)}, {method}")
+
+    interpolator = utils_regrid.CachedInterpolator({**int_attr, "engine": "sparse"})
+    cache_dir = None
+
+    def generate():
+        nonlocal cache_dir
+        cache_dir = fresh_cache(base_dir)
+
+    rows = []
+
+    def add(phase, seconds, peak, steps=None):
+        rows.append({
+            "case": name, "method": method, "phase": phase, "seconds": seconds,
+            "ms/step": 1000 * seconds / steps if steps else np.nan, "peak MiB": peak / 1024**2,
+        })
+
+    try:
+        _, seconds, peak = _measure(lambda: interpolator.regridder(ds), repeat, setup=generate)
+    except (ImportError, ValueError) as e:
+        logger.warning(f"Skipping {name} {method}: the weights need xESMF ({e})")
+        return []
+    add("weights (generate)", seconds, peak)
+    weights_mib = sum(f.stat().st_size for f in Path(cache_dir).glob("*")) / 1024**2
+    logger.info(f"{name} {method}: {weights_mib:.1f} MiB of weights and geometry in the cache")
+
+    regridder, seconds, peak = _measure(lambda: interpolator.regridder(ds), repeat, setup=clear_caches)
+    add("weights (load cache)", seconds, peak)
+
+    regridder.time_block = time_block
+    _, seconds, peak = _measure(lambda: regridder(ds["tas"]), repeat)
+    add("apply sparse (numpy)", seconds, peak, ntime)
+    chunked = ds["tas"].chunk({"time": time_block})
+    _, seconds, peak = _measure(lambda: regridder(chunked).compute(), repeat)
+    add("apply sparse (dask)", seconds, peak, ntime)
+
+    try:
+        import xesmf  # noqa: F401
+        xesmf_regridder = utils_regrid.CachedInterpolator({**int_attr, "engine": "xesmf"}).regridder(ds)
+        _, seconds, peak = _measure(lambda: xesmf_regridder(ds["tas"]).compute(), repeat)
+        add("apply xesmf (cached weights)", seconds, peak, ntime)
+    except ImportError:
+        logger.info("xESMF not installed; skipping the xESMF engine")
+
+    try:
+        import c3s_atlas.interpolation as xesmfCICA
+        ds_ref = ds.rename({"latitude": "lat", "longitude": "lon"}) if source_grid is None else ds
+        _, seconds, peak = _measure(lambda: xesmfCICA.Interpolator(int_attr)(ds_ref), repeat)
+        add("Interpolator (current, with weights)", seconds, peak, ntime)
+    except ImportError:
+        logger.info("c3s_atlas not installed; skipping the current Interpolator")
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark regridding weight generation, loading and application.")
+    parser.add_argument("--ntime", type=int, default=48, help="Time steps of the synthetic fields")
+    parser.add_argument("--scale", type=float, default=0.5, help="Grid resolution relative to the real grids (1 = full size)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per phase (best is reported)")
+    parser.add_argument("--time-block", type=int, default=24, help="Time steps multiplied at once (and dask chunk)")
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCES), default=list(SOURCES), help="Source grids")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS), help="Target grids")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS), help="Regridding methods")
+    args = parser.parse_args()
+
+    setup_logging(force=True)
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="regrid-weights-") as base_dir:
+        for source in args.sources:
+            for target in args.targets:
+                for method in args.methods:
+                    rows.extend(run_case(
+                        source, target, method, args.ntime, args.scale, args.repeat, args.time_block, base_dir
+                    ))
+    if not rows:
+        return 1
+
+    report = pd.DataFrame(rows).set_index(["case", "method", "phase"])
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(
+        f"{args.ntime} time steps, scale {args.scale}, best of {args.repeat}:\n"
+        f"{report.to_string(float_format='%.3f')}\nPeak resident memory of the process: {max_rss:.0f} MiB"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,10 +6,8 @@ constructs status matrices, and generates visualization catalogues.
 """
 
 import os
-import glob
 import logging
 import sys
-import re
 import numpy as np
 import pandas as pd
 import matplotlib as mpl
@@ -22,6 +20,7 @@ from utils import (
     load_derived_dependencies
 )
 from logging_utils import setup_logging
+from utils_inventory import get_inventory, period_bounds
 
 # ------------------------------------------------------------
 # Setup & Constants
@@ -51,36 +50,15 @@ VALUE_MAP = {"downloaded": 0, "partial": 1, "not_downloaded": 2}
 # ------------------------------------------------------------
 
 def check_nc_file_for_year(directory, year):
-    """Check if any NetCDF files matching the given year exist in the directory."""
-    logger.info(f"Checking for files in {directory} matching year {year}")
-    logger.info(f"Looking for pattern: {os.path.join(directory, f'*{year}*.nc')}")
-    return bool(glob.glob(os.path.join(directory, f"*{year}*.nc")))
+    """Check if any NetCDF files covering the given year exist in the directory."""
+    logger.info(f"Checking for files in {directory} covering year {year}")
+    return bool(get_inventory(directory).query(*period_bounds(year)))
 
 
 def get_earliest_and_latest_dates(directory):
-    """Extract and return the minimum and maximum integer date components found in .nc filenames."""
+    """Return the minimum and maximum integer date components found in .nc filenames."""
     logger.info(f"Getting earliest and latest dates from directory: {directory}")
-    files = glob.glob(os.path.join(directory, "*.nc"))
-    dates = []
-
-    date_pattern = re.compile(r'(?:^|_)(\d{4}|\d{6}|\d{8})(?:_|$)')
-    for f in files:
-        base = os.path.basename(f)
-        try:
-            # Check standard location index 2
-            part = base.split("_")[2].replace(".nc", "").replace("-", "")
-            if part.isdigit():
-                dates.append(int(part))
-            else:
-                # Fallback to regex search for 8-digit date
-                match = date_pattern.search(base)
-                if match:
-                    dates.append(int(match.group(1)))
-
-        except Exception:
-            continue
-
-    return (min(dates), max(dates)) if dates else (None, None)
+    return get_inventory(directory).date_range()
 
 
 def check_origin_path(row, data_path,df):
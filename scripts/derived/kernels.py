@@ -0,0 +1,402 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # pragma: no cover - numba ships with xclim
+    numba = None
+
+# Blockwise kernels for the operations in operations.py.
+#
+# They work on plain NumPy blocks (one dask chunk at a time) and reproduce the
+# xclim formulas used by mean_radiant_temperature and
+# universal_thermal_climate_index without unit conversion, metadata handling
+# or float64 promotion: they compute in the precision of their inputs
+# (float32 for float32 inputs, float64 for float64 inputs).
+
+STEFAN_BOLTZMANN = 5.67e-8
+SOLAR_CONSTANT = 1367.0
+CSZA_MIN = np.cos(89.5 / 180 * np.pi)
+
+# UTCI offset polynomial (UTCI - Ta) from the original Fortran code by
+# Peter Bröde (http://www.utci.org/public/UTCI%20Program%20Code/UTCI_a002.f90).
+# Each row is (exp_Ta, exp_va, exp_dTmrt, exp_Pa, coefficient) with
+# Ta in degC, va in m/s, dTmrt = Tmrt - Ta in K and Pa in kPa.
+UTCI_COEFFICIENTS = (
+    (0, 0, 0, 0, 6.07562052e-1),
+    (1, 0, 0, 0, -2.27712343e-2),
+    (2, 0, 0, 0, 8.06470249e-4),
+    (3, 0, 0, 0, -1.54271372e-4),
+    (4, 0, 0, 0, -3.24651735e-6),
+    (5, 0, 0, 0, 7.32602852e-8),
+    (6, 0, 0, 0, 1.35959073e-9),
+    (0, 1, 0, 0, -2.25836520e0),
+    (1, 1, 0, 0, 8.80326035e-2),
+    (2, 1, 0, 0, 2.16844454e-3),
+    (3, 1, 0, 0, -1.53347087e-5),
+    (4, 1, 0, 0, -5.72983704e-7),
+    (5, 1, 0, 0, -2.55090145e-9),
+    (0, 2, 0, 0, -7.51269505e-1),
+    (1, 2, 0, 0, -4.08350271e-3),
+    (2, 2, 0, 0, -5.21670675e-5),
+    (3, 2, 0, 0, 1.94544667e-6),
+    (4, 2, 0, 0, 1.14099531e-8),
+    (0, 3, 0, 0, 1.58137256e-1),
+    (1, 3, 0, 0, -6.57263143e-5),
+    (2, 3, 0, 0, 2.22697524e-7),
+    (3, 3, 0, 0, -4.16117031e-8),
+    (0, 4, 0, 0, -1.27762753e-2),
+    (1, 4, 0, 0, 9.66891875e-6),
+    (2, 4, 0, 0, 2.52785852e-9),
+    (0, 5, 0, 0, 4.56306672e-4),
+    (1, 5, 0, 0, -1.74202546e-7),
+    (0, 6, 0, 0, -5.91491269e-6),
+    (0, 0, 1, 0, 3.98374029e-1),
+    (1, 0, 1, 0, 1.83945314e-4),
+    (2, 0, 1, 0, -1.73754510e-4),
+    (3, 0, 1, 0, -7.60781159e-7),
+    (4, 0, 1, 0, 3.77830287e-8),
+    (5, 0, 1, 0, 5.43079673e-10),
+    (0, 1, 1, 0, -2.00518269e-2),
+    (1, 1, 1, 0, 8.92859837e-4),
+    (2, 1, 1, 0, 3.45433048e-6),
+    (3, 1, 1, 0, -3.77925774e-7),
+    (4, 1, 1, 0, -1.69699377e-9),
+    (0, 2, 1, 0, 1.69992415e-4),
+    (1, 2, 1, 0, -4.99204314e-5),
+    (2, 2, 1, 0, 2.47417178e-7),
+    (3, 2, 1, 0, 1.07596466e-8),
+    (0, 3, 1, 0, 8.49242932e-5),
+    (1, 3, 1, 0, 1.35191328e-6),
+    (2, 3, 1, 0, -6.21531254e-9),
+    (0, 4, 1, 0, -4.99410301e-6),
+    (1, 4, 1, 0, -1.89489258e-8),
+    (0, 5, 1, 0, 8.15300114e-8),
+    (0, 0, 2, 0, 7.55043090e-4),
+    (1, 0, 2, 0, -5.65095215e-5),
+    (2, 0, 2, 0, -4.52166564e-7),
+    (3, 0, 2, 0, 2.46688878e-8),
+    (4, 0, 2, 0, 2.42674348e-10),
+    (0, 1, 2, 0, 1.54547250e-4),
+    (1, 1, 2, 0, 5.24110970e-6),
+    (2, 1, 2, 0, -8.75874982e-8),
+    (3, 1, 2, 0, -1.50743064e-9),
+    (0, 2, 2, 0, -1.56236307e-5),
+    (1, 2, 2, 0, -1.33895614e-7),
+    (2, 2, 2, 0, 2.49709824e-9),
+    (0, 3, 2, 0, 6.51711721e-7),
+    (1, 3, 2, 0, 1.94960053e-9),
+    (0, 4, 2, 0, -1.00361113e-8),
+    (0, 0, 3, 0, -1.21206673e-5),
+    (1, 0, 3, 0, -2.18203660e-7),
+    (2, 0, 3, 0, 7.51269482e-9),
+    (3, 0, 3, 0, 9.79063848e-11),
+    (0, 1, 3, 0, 1.25006734e-6),
+    (1, 1, 3, 0, -1.81584736e-9),
+    (2, 1, 3, 0, -3.52197671e-10),
+    (0, 2, 3, 0, -3.36514630e-8),
+    (1, 2, 3, 0, 1.35908359e-10),
+    (0, 3, 3, 0, 4.17032620e-10),
+    (0, 0, 4, 0, -1.30369025e-9),
+    (1, 0, 4, 0, 4.13908461e-10),
+    (2, 0, 4, 0, 9.22652254e-12),
+    (0, 1, 4, 0, -5.08220384e-9),
+    (1, 1, 4, 0, -2.24730961e-11),
+    (0, 2, 4, 0, 1.17139133e-10),
+    (0, 0, 5, 0, 6.62154879e-10),
+    (1, 0, 5, 0, 4.03863260e-13),
+    (0, 1, 5, 0, 1.95087203e-12),
+    (0, 0, 6, 0, -4.73602469e-12),
+    (0, 0, 0, 1, 5.12733497e0),
+    (1, 0, 0, 1, -3.12788561e-1),
+    (2, 0, 0, 1, -1.96701861e-2),
+    (3, 0, 0, 1, 9.99690870e-4),
+    (4, 0, 0, 1, 9.51738512e-6),
+    (5, 0, 0, 1, -4.66426341e-7),
+    (0, 1, 0, 1, 5.48050612e-1),
+    (1, 1, 0, 1, -3.30552823e-3),
+    (2, 1, 0, 1, -1.64119440e-3),
+    (3, 1, 0, 1, -5.16670694e-6),
+    (4, 1, 0, 1, 9.52692432e-7),
+    (0, 2, 0, 1, -4.29223622e-2),
+    (1, 2, 0, 1, 5.00845667e-3),
+    (2, 2, 0, 1, 1.00601257e-6),
+    (3, 2, 0, 1, -1.81748644e-6),
+    (0, 3, 0, 1, -1.25813502e-3),
+    (1, 3, 0, 1, -1.79330391e-4),
+    (2, 3, 0, 1, 2.34994441e-6),
+    (0, 4, 0, 1, 1.29735808e-4),
+    (1, 4, 0, 1, 1.29064870e-6),
+    (0, 5, 0, 1, -2.28558686e-6),
+    (0, 0, 1, 1, -3.69476348e-2),
+    (1, 0, 1, 1, 1.62325322e-3),
+    (2, 0, 1, 1, -3.14279680e-5),
+    (3, 0, 1, 1, 2.59835559e-6),
+    (4, 0, 1, 1, -4.77136523e-8),
+    (0, 1, 1, 1, 8.64203390e-3),
+    (1, 1, 1, 1, -6.87405181e-4),
+    (2, 1, 1, 1, -9.13863872e-6),
+    (3, 1, 1, 1, 5.15916806e-7),
+    (0, 2, 1, 1, -3.59217476e-5),
+    (1, 2, 1, 1, 3.28696511e-5),
+    (2, 2, 1, 1, -7.10542454e-7),
+    (0, 3, 1, 1, -1.24382300e-5),
+    (1, 3, 1, 1, -7.38584400e-9),
+    (0, 4, 1, 1, 2.20609296e-7),
+    (0, 0, 2, 1, -7.32469180e-4),
+    (1, 0, 2, 1, -1.87381964e-5),
+    (2, 0, 2, 1, 4.80925239e-6),
+    (3, 0, 2, 1, -8.75492040e-8),
+    (0, 1, 2, 1, 2.77862930e-5),
+    (1, 1, 2, 1, -5.06004592e-6),
+    (2, 1, 2, 1, 1.14325367e-7),
+    (0, 2, 2, 1, 2.53016723e-6),
+    (1, 2, 2, 1, -1.72857035e-8),
+    (0, 3, 2, 1, -3.95079398e-8),
+    (0, 0, 3, 1, -3.59413173e-7),
+    (1, 0, 3, 1, 7.04388046e-7),
+    (2, 0, 3, 1, -1.89309167e-8),
+    (0, 1, 3, 1, -4.79768731e-7),
+    (1, 1, 3, 1, 7.96079978e-9),
+    (0, 2, 3, 1, 1.62897058e-9),
+    (0, 0, 4, 1, 3.94367674e-8),
+    (1, 0, 4, 1, -1.18566247e-9),
+    (0, 1, 4, 1, 3.34678041e-10),
+    (0, 0, 5, 1, -1.15606447e-10),
+    (0, 0, 0, 2, -2.80626406e0),
+    (1, 0, 0, 2, 5.48712484e-1),
+    (2, 0, 0, 2, -3.99428410e-3),
+    (3, 0, 0, 2, -9.54009191e-4),
+    (4, 0, 0, 2, 1.93090978e-5),
+    (0, 1, 0, 2, -3.08806365e-1),
+    (1, 1, 0, 2, 1.16952364e-2),
+    (2, 1, 0, 2, 4.95271903e-4),
+    (3, 1, 0, 2, -1.90710882e-5),
+    (0, 2, 0, 2, 2.10787756e-3),
+    (1, 2, 0, 2, -6.98445738e-4),
+    (2, 2, 0, 2, 2.30109073e-5),
+    (0, 3, 0, 2, 4.17856590e-4),
+    (1, 3, 0, 2, -1.27043871e-5),
+    (0, 4, 0, 2, -3.04620472e-6),
+    (0, 0, 1, 2, 5.14507424e-2),
+    (1, 0, 1, 2, -4.32510997e-3),
+    (2, 0, 1, 2, 8.99281156e-5),
+    (3, 0, 1, 2, -7.14663943e-7),
+    (0, 1, 1, 2, -2.66016305e-4),
+    (1, 1, 1, 2, 2.63789586e-4),
+    (2, 1, 1, 2, -7.01199003e-6),
+    (0, 2, 1, 2, -1.06823306e-4),
+    (1, 2, 1, 2, 3.61341136e-6),
+    (0, 3, 1, 2, 2.29748967e-7),
+    (0, 0, 2, 2, 3.04788893e-4),
+    (1, 0, 2, 2, -6.42070836e-5),
+    (2, 0, 2, 2, 1.16257971e-6),
+    (0, 1, 2, 2, 7.68023384e-6),
+    (1, 1, 2, 2, -5.47446896e-7),
+    (0, 2, 2, 2, -3.59937910e-8),
+    (0, 0, 3, 2, -4.36497725e-6),
+    (1, 0, 3, 2, 1.68737969e-7),
+    (0, 1, 3, 2, 2.67489271e-8),
+    (0, 0, 4, 2, 3.23926897e-9),
+    (0, 0, 0, 3, -3.53874123e-2),
+    (1, 0, 0, 3, -2.21201190e-1),
+    (2, 0, 0, 3, 1.55126038e-2),
+    (3, 0, 0, 3, -2.63917279e-4),
+    (0, 1, 0, 3, 4.53433455e-2),
+    (1, 1, 0, 3, -4.32943862e-3),
+    (2, 1, 0, 3, 1.45389826e-4),
+    (0, 2, 0, 3, 2.17508610e-4),
+    (1, 2, 0, 3, -6.66724702e-5),
+    (0, 3, 0, 3, 3.33217140e-5),
+    (0, 0, 1, 3, -2.26921615e-3),
+    (1, 0, 1, 3, 3.80261982e-4),
+    (2, 0, 1, 3, -5.45314314e-9),
+    (0, 1, 1, 3, -7.96355448e-4),
+    (1, 1, 1, 3, 2.53458034e-5),
+    (0, 2, 1, 3, -6.31223658e-6),
+    (0, 0, 2, 3, 3.02122035e-4),
+    (1, 0, 2, 3, -4.77403547e-6),
+    (0, 1, 2, 3, 1.73825715e-6),
+    (0, 0, 3, 3, -4.09087898e-7),
+    (0, 0, 0, 4, 6.14155345e-1),
+    (1, 0, 0, 4, -6.16755931e-2),
+    (2, 0, 0, 4, 1.33374846e-3),
+    (0, 1, 0, 4, 3.55375387e-3),
+    (1, 1, 0, 4, -5.13027851e-4),
+    (0, 2, 0, 4, 1.02449757e-4),
+    (0, 0, 1, 4, -1.48526421e-3),
+    (1, 0, 1, 4, -4.11469183e-5),
+    (0, 1, 1, 4, -6.80434415e-6),
+    (0, 0, 2, 4, -9.77675906e-6),
+    (0, 0, 0, 5, 8.82773108e-2),
+    (1, 0, 0, 5, -3.01859306e-3),
+    (0, 1, 0, 5, 1.04452989e-3),
+    (0, 0, 1, 5, 2.47090539e-4),
+    (0, 0, 0, 6, 1.48348065e-3),
+)
+
+UTCI_DEGREE = 6
+
+
+def _dense_utci_coefficients():
+    dense = np.zeros((UTCI_DEGREE + 1,) * 4)
+    for i, j, k, l, c in UTCI_COEFFICIENTS:
+        dense[i, j, k, l] = c
+    return dense
+
+
+_UTCI_DENSE = _dense_utci_coefficients()
+
+
+def saturation_vapor_pressure_its90(tas):
+    """Saturation vapour pressure over water (Pa) from temperature (K), ITS-90 formula."""
+    return np.exp(
+        -2836.5744 / tas**2
+        + -6028.076559 / tas
+        + 19.54263612
+        + -2.737830188e-2 * tas
+        + 1.6261698e-5 * tas**2
+        + 7.0229056e-10 * tas**3
+        + -1.8680009e-13 * tas**4
+        + 2.7150305 * np.log(tas)
+    )
+
+
+def _utci_offset_numpy(ta, va, dt, pa):
+    """Evaluate the UTCI offset polynomial on arrays, Horner scheme in ``pa``."""
+    out = np.zeros_like(ta)
+    term = np.empty_like(ta)
+    ta_p = np.ones_like(ta)
+    for i in range(UTCI_DEGREE + 1):
+        va_p = np.ones_like(ta)
+        for j in range(UTCI_DEGREE + 1 - i):
+            dt_p = np.ones_like(ta)
+            for k in range(UTCI_DEGREE + 1 - i - j):
+                term.fill(0)
+                for l in range(UTCI_DEGREE - i - j - k, -1, -1):
+                    term *= pa
+                    term += _UTCI_DENSE[i, j, k, l]
+                term *= ta_p
+                term *= va_p
+                term *= dt_p
+                out += term
+                dt_p *= dt
+            va_p *= va
+        ta_p *= ta
+    return out
+
+
+if numba is not None:
+
+    @numba.vectorize(
+        ["float32(float32, float32, float32, float32)", "float64(float64, float64, float64, float64)"],
+        nopython=True,
+    )
+    def _utci_offset(ta, va, dt, pa):
+        out = 0.0
+        ta_p = 1.0
+        for i in range(UTCI_DEGREE + 1):
+            va_p = 1.0
+            for j in range(UTCI_DEGREE + 1 - i):
+                dt_p = 1.0
+                for k in range(UTCI_DEGREE + 1 - i - j):
+                    term = 0.0
+                    for l in range(UTCI_DEGREE - i - j - k, -1, -1):
+                        term = term * pa + _UTCI_DENSE[i, j, k, l]
+                    out += ta_p * va_p * dt_p * term
+                    dt_p *= dt
+                va_p *= va
+            ta_p *= ta
+        return out
+
+else:
+    _utci_offset = _utci_offset_numpy
+
+
+def input_dtype(*arrays):
+    """Floating type of a computation on ``arrays``: their common type, at least float32."""
+    dtypes = [a.dtype if hasattr(a, "dtype") else np.asarray(a).dtype for a in arrays]
+    return np.result_type(*dtypes, np.float32).type
+
+
+def utci_kernel(tas, sfcwind, hurs, mrt, dtype=None):
+    """
+    Universal thermal climate index (K) on NumPy blocks.
+
+    Parameters
+    ----------
+    tas : numpy.ndarray
+        Air temperature (K).
+    sfcwind : numpy.ndarray
+        Wind speed (m/s).
+    hurs : numpy.ndarray
+        Relative humidity (%).
+    mrt : numpy.ndarray
+        Mean radiant temperature (K).
+    dtype : numpy dtype, optional
+        Precision of the computation and of the result, by default that of
+        the inputs (``input_dtype``).
+    """
+    if dtype is None:
+        dtype = input_dtype(tas, sfcwind, hurs, mrt)
+    tas = np.asarray(tas, dtype=dtype)
+    sfcwind = np.asarray(sfcwind, dtype=dtype)
+    hurs = np.asarray(hurs, dtype=dtype)
+    mrt = np.asarray(mrt, dtype=dtype)
+
+    # Water vapour partial pressure (kPa)
+    pa = saturation_vapor_pressure_its90(tas) * (hurs / dtype(1e5))
+    ta = tas - dtype(273.15)
+    dt = mrt - tas
+    # UTCI = Ta + offset, returned in K like the xclim indicator
+    return (tas + _utci_offset(ta, sfcwind, dt, pa.astype(dtype, copy=False))).astype(dtype, copy=False)
+
+
+def mrt_kernel(rsus, rlus, rsds, rlds, csza, sun_distance, dtype=None):
+    """
+    Mean radiant temperature (K) on NumPy blocks.
+
+    Parameters
+    ----------
+    rsus, rlus, rsds, rlds : numpy.ndarray
+        Radiation fluxes (W m-2).
+    csza : numpy.ndarray
+        Cosine of the solar zenith angle (sunlit average or instant).
+    sun_distance : numpy.ndarray
+        Sun-earth distance (astronomical units), broadcastable to ``rsds``.
+    dtype : numpy dtype, optional
+        Precision of the computation and of the result, by default that of
+        the radiation fluxes (``input_dtype``).
+    """
+    if dtype is None:
+        dtype = input_dtype(rsus, rlus, rsds, rlds)
+    rsus, rlus, rsds, rlds, csza, sun_distance = (
+        np.asarray(a, dtype=dtype) for a in (rsus, rlus, rsds, rlds, csza, sun_distance)
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # Ratio of direct solar radiation
+        s_star = rsds / (dtype(SOLAR_CONSTANT) * csza / sun_distance**2)
+        s_star = np.where(s_star > 0.85, dtype(0.85), s_star)
+        fdir_ratio = np.exp(dtype(3) - dtype(1.34) * s_star - dtype(1.65) / s_star)
+        fdir_ratio = np.where(fdir_ratio > 0.9, dtype(0.9), fdir_ratio)
+        fdir_ratio = np.where(
+            (fdir_ratio <= 0) | (csza <= CSZA_MIN) | (rsds <= 0), dtype(0), fdir_ratio
+        )
+
+        rsds_direct = fdir_ratio * rsds
+        rsds_diffuse = rsds - rsds_direct
+
+        gamma = np.arcsin(csza)
+        fp = dtype(0.308) * np.cos(gamma * dtype(0.988) - gamma**2 / dtype(50000))
+        i_star = np.where(csza > 0.001, rsds_direct / csza, dtype(0))
+
+        mrt = (
+            dtype(1 / STEFAN_BOLTZMANN)
+            * (
+                dtype(0.5) * rlds
+                + dtype(0.5) * rlus
+                + dtype(0.7 / 0.97) * (dtype(0.5) * rsds_diffuse + dtype(0.5) * rsus + fp * i_star)
+            )
+        ) ** dtype(0.25)
+
+    return mrt.astype(dtype, copy=False)
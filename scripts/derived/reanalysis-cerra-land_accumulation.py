@@ -1,16 +1,15 @@
 from pathlib import Path
-import operations
+import argparse
 import pandas as pd
 import xarray as xr
-import glob
 import numpy as np
 import logging
 import os
-import calendar
 import sys
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 sys.path.append('../utilities')
 from utils import load_output_path_from_row, require_single_row
+from utils_inventory import get_inventory, parse_filename_period
 from logging_utils import setup_logging
 
 logger = logging.getLogger(__name__)
@@ -48,86 +47,135 @@ def write_to_netcdf(dataset: xr.Dataset, path: Path, var: str, lonlattime_name:
     dataset.to_netcdf(path=path, encoding=encoding)
     dataset.close()
 
-def check_time_gap(file1, file2, expected_timestep='1h'):
+def check_time_gap(last_time, first_time, expected_timestep='1h', label=""):
     """
-    Check for gaps between the times of two files.
+    Check for a gap between the last time of a file and the first time of the next one.
 
     Args:
-        file1 (str): Path to the first file.
-        file2 (str): Path to the second file.
+        last_time (numpy.datetime64): Last valid_time of the first file.
+        first_time (numpy.datetime64): First valid_time of the second file.
         expected_timestep (str): Expected time step between consecutive times (e.g., '1h', '30m').
+        label (str): Files being compared, for the messages.
 
     Raises:
         ValueError: If a gap is detected between the files.
     """
-    # Open the two files individually
-    ds1 = xr.open_dataset(file1)
-    ds2 = xr.open_dataset(file2)
-
-    # Extract the last time of the first file and the first time of the second file
-    last_time_file1 = ds1.valid_time.values[-1]
-    first_time_file2 = ds2.valid_time.values[0]
-
     # Calculate the time difference
-    time_diff = first_time_file2 - last_time_file1
+    time_diff = first_time - last_time
 
     # Convert expected_timestep to a numpy timedelta64
     expected_timedelta = np.timedelta64(int(expected_timestep[:-1]), expected_timestep[-1])
 
     # Check for gaps
     if time_diff > expected_timedelta*1.1:
-        raise ValueError(f"Gap detected between {file1} and {file2}: {time_diff}/{expected_timedelta}. Expected: {expected_timestep}."
-                         f"Time in each dataset is {last_time_file1} and {first_time_file2}")
+        raise ValueError(f"Gap detected between {label}: {time_diff}/{expected_timedelta}. Expected: {expected_timestep}."
+                         f"Time in each dataset is {last_time} and {first_time}")
     else:
-        logger.info(f"No gap detected between {file1} and {file2}. time_diff: {expected_timedelta}")
-    ds1.close()
-    ds2.close()
-    del ds1, ds2
+        logger.info(f"No gap detected between {label}. time_diff: {expected_timedelta}")
 
 
-def get_first_month_accumulated(ds_accumulated):
-    # Get the first year and month from the valid_time dimension
-    first_year = ds_accumulated.valid_time.dt.year[0].values
-    first_month = ds_accumulated.valid_time.dt.month[0].values
+def three_hourly_mask(times):
+    """Boolean mask of the 3-hourly steps (00, 03, ..., 21 h) of a datetime64 array."""
+    minutes = (times - times.astype("datetime64[D]")) // np.timedelta64(1, "m")
+    return minutes % 180 == 0
 
-    # Determine the number of days in the first month
-    last_day = calendar.monthrange(first_year, first_month)[1]
 
-    # Define the start and end of the first month
-    start_date = f'{first_year}-{first_month:02d}-01'
-    end_date = f'{first_year}-{first_month:02d}-{last_day}'
+def accumulation_days(times):
+    """Day each 3-hourly step accumulates into; the 00 h step closes the previous day."""
+    return (times - np.timedelta64(1, "m")).astype("datetime64[D]")
 
-    # Select the first month
-    first_month_data = ds_accumulated.sel(valid_time=slice(start_date, end_date))
 
-    return first_month_data
+def accumulation(da):
+    """Daily sums of the 3-hourly steps of a DataArray."""
+    time_dim = "valid_time"
+    days = accumulation_days(da[time_dim].values)
+    return da.assign_coords({time_dim: days}).groupby(time_dim).sum()
 
 
-def accumulation(ds,var):
-    time_dim="valid_time"
-    # Define the hours of interest
-    h3_list = ['00:00', '03:00', '06:00', '09:00', '12:00', '15:00', '18:00', '21:00']
-    h3_list = ['00', '03', '06', '09','12','15','18', '21']
+def stream_accumulation(var, files, dest_dir, end_year, expected_timestep='1h'):
+    """
+    Write the daily accumulations of a variable walking its monthly files once.
 
-    #select only 3-hourly times (drop others BEFORE shifting)
-    hours = ds[time_dim].dt.strftime("%H")
-    ds_3h = ds[var].where(hours.isin(h3_list), drop=True)
-    # Shift 00 timestamps to previous day
-    shifted_time = ds_3h[time_dim].where(
-        ds_3h[time_dim].dt.strftime("%H") != "00",
-        ds_3h[time_dim] - np.timedelta64(30, "m")
-    )
+    The last day of a month needs the 00 h step of the next month. Daily sums
+    of a month are kept until the next file is opened; only its boundary
+    steps are read to complete them before writing. Months whose output
+    already exists are not read, except for the boundary of the previous one.
 
-    # Add a shifted time coordinate (no drop)
-    ds_shift = ds_3h.assign_coords({time_dim: shifted_time}).sortby(time_dim)
+    Args:
+        var (str): Variable name in the files.
+        files (list): Monthly files (``..._YYYYMM.nc``) sorted in time.
+        dest_dir (str): Output directory.
+        end_year (int): Last year to produce.
+        expected_timestep (str): Time step between consecutive files.
+    """
+    pending = None  # (output_file, daily sums waiting for the next month)
+    last_time = None
+    for file in files:
+        basename = os.path.basename(file)
+        month_start = parse_filename_period(basename)[0]
+        year = month_start // 10000
+        month_start = np.datetime64(f"{year}-{month_start // 100 % 100:02d}-01")
+        output_file = Path(dest_dir) / basename.replace(".nc", "_daily_accumulated.nc")
+
+        compute_month = year <= end_year and not output_file.exists()
+        if not compute_month:
+            logger.info(f"File {output_file} already exists or is after the end year. Skipping...")
+        if not compute_month and pending is None:
+            last_time = None
+            continue
+
+        with xr.open_dataset(file) as ds:
+            times = ds.valid_time.values
+            steps = ds[var].isel(valid_time=three_hourly_mask(times))
+            days = accumulation_days(steps.valid_time.values)
+
+            if pending is not None:
+                prev_file, prev_daily = pending
+                check_time_gap(last_time, times[0], expected_timestep, label=f"{prev_file.name} and {basename}")
+                in_previous = days < month_start
+                if in_previous.any():
+                    boundary = accumulation(steps.isel(valid_time=in_previous).load())
+                    prev_daily = xr.concat([prev_daily, boundary], dim="valid_time").groupby("valid_time").sum()
+                write_to_netcdf(prev_daily, prev_file, var=var)
+                pending = None
+
+            if compute_month and (days >= month_start).any():
+                logger.info(f"Accumulating {basename}")
+                daily = accumulation(steps.isel(valid_time=days >= month_start).load())
+                pending = (output_file, daily)
+                last_time = times[-1]
+            else:
+                last_time = None
 
-    # Daily accumulation via resample
-    daily = ds_shift.resample({time_dim: "1D"}).sum()
+    if pending is not None:
+        logger.warning(f"No next file for {pending[0].name}: its last day misses the 00 h step")
+        write_to_netcdf(pending[1], pending[0], var=var)
 
-    return daily
 
+def process_variable(var, dataset, df_parameters):
+    logger.info(f"Calculating {var}")
+    mask_input = (df_parameters['filename_variable'] == var) & (df_parameters['product_type'] == 'raw')
+    input_row = require_single_row(df_parameters, mask_input, f"{var}/raw")
+
+    mask_var = (df_parameters['filename_variable'] == var) & (df_parameters['product_type'] == 'derived')
+    var_row = require_single_row(df_parameters, mask_var, f"{var}/derived")
+    # Use utility function to load input path
+    var_download_path = load_output_path_from_row(input_row, dataset)
+    var_files = [f for f in get_inventory(var_download_path).files() if parse_filename_period(os.path.basename(f))]
+    logger.info(f"List of file variables in {var_download_path}: {var_files}")
+
+    dest_dir = load_output_path_from_row(var_row, dataset)
+    os.makedirs(dest_dir, exist_ok=True)
+    logger.info(f"Saving calculated {var} to {dest_dir}")
+    stream_accumulation(var, var_files, dest_dir, int(var_row.cds_years_end))
+    return var
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daily accumulations of CERRA-Land accumulated variables.")
+    parser.add_argument("--workers", type=int, default=None, help="Variables processed in parallel (default: one per variable)")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
     setup_logging()
     dataset="reanalysis-cerra-land"
     variables_file_path = f"../../requests/{dataset}.csv"
@@ -136,55 +184,17 @@ if __name__ == "__main__":
     derived_variables_list = derived_variables.tolist()
     logger.info(f"List of derived variables: {derived_variables_list}")
 
-    for var in derived_variables_list:
-        logger.info(f"Calculating {var}")
-        mask_input = (df_parameters['filename_variable'] == var) & (df_parameters['product_type'] == 'raw')
-        input_row = require_single_row(df_parameters, mask_input, f"{var}/raw")
-
-        mask_var = (df_parameters['filename_variable'] == var) & (df_parameters['product_type'] == 'derived')
-        var_row = require_single_row(df_parameters, mask_var, f"{var}/derived")
-        # Use utility function to load input path
-        var_download_path = load_output_path_from_row(input_row, dataset)
-        var_files = np.sort(glob.glob(f"{var_download_path}/*.nc"))
-        logger.info(f"{var_download_path}/*.nc")
-        logger.info(f"List of file variables: {var_files}")
-        # Iterate over files and process accumulation, need two files for last hour accumulation
-        for i,file in enumerate(var_files):
-            basename = os.path.basename(file)
-            logger.info(basename)
-            date_str = basename.split('_')[-1].replace(".nc","")  
-            date_obj = datetime.strptime(date_str, "%Y%m")
-            year = date_obj.year
-            logger.info(f"Processing year: {year} and end year: {var_row.cds_years_end}")
-            if year > var_row.cds_years_end:
-                logger.info("Skipping file as it is after the end year")
-                continue
-            dest_dir = load_output_path_from_row(var_row, dataset)
-            var_file = os.path.basename(file).replace(".nc", "_daily_accumulated.nc")
-            output_file=Path(f"{dest_dir}/{var_file}")
-            logger.info(f"Saving calculated {var} to {dest_dir}")
-            os.makedirs(dest_dir, exist_ok=True)   
-            if output_file.exists():
-                logger.info(f"File {output_file} already exists. Skipping...")
-                continue
-            if i+2 < len(var_files):
-                next_file=var_files[i+1]
-                logger.info(f"Processing file {file} and next file {next_file}")
-                check_time_gap(file, next_file, expected_timestep='1h')
-                file_list=[file,next_file]
-            else:
-                file_list=[file]
-
-            ds_var = xr.open_mfdataset(file_list,concat_dim='valid_time', combine='nested') 
-            ds_accumulated=accumulation(ds_var,var)
-            first_month_data = get_first_month_accumulated(ds_accumulated)
+    workers = min(args.workers or len(derived_variables_list), os.cpu_count() or 1)
+    if workers <= 1:
+        for var in derived_variables_list:
+            process_variable(var, dataset, df_parameters)
+        return
 
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_variable, var, dataset, df_parameters) for var in derived_variables_list]
+        for future in futures:
+            logger.info(f"Finished {future.result()}")
 
-  
-            write_to_netcdf(first_month_data, output_file, var=var)
-            
-            ds_var.close()
-            del ds_var, ds_accumulated, first_month_data
 
-    
-        
\ No newline at end of file
+if __name__ == "__main__":
+    main()
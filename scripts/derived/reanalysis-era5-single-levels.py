@@ -11,7 +11,10 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../util
 from logging_utils import setup_logging
 from utils import load_derived_dependencies, raw_condition, derived_condition, derived_condition_hourly_native
 from utils_dask_slurm import load_slurm_dask_config
-from utils_derived_pipeline import process_derived
+from utils_derived_pipeline import plan_slices, process_derived, slice_status
+from utils_derived_scheduler import run_schedule
+from utils_dataset_cache import YEARLY_DATASET_CACHE
+from utils_prefetch import Prefetcher
 logger = logging.getLogger(__name__)
 
 MONTH_LIST = [f"{i:02d}" for i in range(1, 13)]
@@ -32,6 +35,9 @@ logger.info(f"System parameters for Dask configuration: {PARAMS_SLURM}")
 # Config fields:
 #   func        — The operation function from operations.py that performs the
 #                 computation (e.g. operations.rh_from_thermofeel).
+#   fast_func   — Optional blockwise variant of func (operations.*_fast_*,
+#                 validated against it by benchmarks/benchmark_operations.py),
+#                 used instead of func only with --fast-kernels.
 #   cond        — Condition function(s) used to locate the input data for
 #                 each dependency.  Can be a single callable (applied to all
 #                 dependencies) or a list of callables (one per dependency).
@@ -39,11 +45,37 @@ logger.info(f"System parameters for Dask configuration: {PARAMS_SLURM}")
 #                 derived_condition_hourly_native.
 #   resampling  — Optional dict with "agg_freq" and "agg_func".  When set,
 #                 the result is resampled after computation (e.g. hourly
-#                 instantaneous → daily mean).
+#                 instantaneous → daily mean).  Several statistics are
+#                 declared with "statistics" instead of "agg_func", mapping
+#                 each of mean/min/max/sum/count to the variable (directory)
+#                 it is written as, e.g.
+#                   {"agg_freq": "1D",
+#                    "statistics": {"mean": "t2m", "max": "t2mx", "min": "t2mn"}}
+#                 They are computed in one pass over the input.  "offset",
+#                 "closed" and "label" shift the bins of accumulated fields.
 #   timing        — Optional boolean.  When True the processing time for each
 #                   year is logged.
-#   iterate_monthly — Optional boolean.  When True the work is split per month
-#                   (12 iterations per year).  Defaults to False (yearly).
+#   iterate_monthly — Optional boolean.  When True the outputs are monthly
+#                   files (12 per year).  Defaults to False (yearly files).
+#   slice       — Optional period ("year", "quarter", "month" or "week")
+#                 computed at once.  By default the largest period whose
+#                 working set, projected from the input file headers and
+#                 expansion_factor, fits the worker memory is used; several
+#                 monthly files are then computed together, and "week"
+#                 writes each file chunk by chunk instead of in one piece.
+#   expansion_factor — Optional number.  Peak memory of the operation relative
+#                   to the bytes of its inputs, used to plan the input chunks
+#                   from the worker memory.  Defaults to
+#                   utils_chunking.DEFAULT_EXPANSION_FACTOR.
+#   from_finer  — Optional temporal resolution (e.g. "hourly") of the same
+#                 derived variable.  When that product already covers the
+#                 year it is read instead of the raw dependencies and only
+#                 resampled; otherwise the raw inputs are used.  Entries with
+#                 from_finer are processed after the other resolutions.
+#   precision   — Optional dtype string (e.g. "float32") the inputs,
+#                 intermediates and output of the variable are cast to.
+#                 Without it they keep the dtype the inputs decode to
+#                 (unless the C3S_PRECISION environment variable is set).
 #
 # Example — adding a hypothetical "myvar":
 #
@@ -60,6 +92,7 @@ VAR_CONFIG = {
         "func": operations.sfcwind_from_u_v,
         "cond": raw_condition,
         "resampling": {"agg_freq": "1D", "agg_func": "mean"},
+        "from_finer": "hourly",
     },
     ("sfcwind", "hourly"): {
         "func": operations.sfcwind_from_u_v,
@@ -83,6 +116,7 @@ VAR_CONFIG = {
     },
     ("mrt", "hourly"): {
         "func": operations.mrt_from_rsus_rlus_rsds_rlds,
+        "fast_func": operations.mrt_fast_from_rsus_rlus_rsds_rlds,
         "cond": [
             derived_condition,
             derived_condition,
@@ -91,9 +125,12 @@ VAR_CONFIG = {
         ],
         "timing": True,
         "iterate_monthly": True,
+        "expansion_factor": 6,
+        "precision": "float32",
     },
     ("utci", "hourly"): {
         "func": operations.utci_from_t2m_sfcwind_hurs_mrt,
+        "fast_func": operations.utci_fast_from_t2m_sfcwind_hurs_mrt,
         "cond": [
             raw_condition,
             derived_condition_hourly_native,
@@ -102,6 +139,8 @@ VAR_CONFIG = {
         ],
         "timing": True,
         "iterate_monthly": True,
+        "expansion_factor": 8,
+        "precision": "float32",
     },
 }
 
@@ -113,6 +152,27 @@ def _parse_args():
     parser.add_argument("--year", type=int, default=None, help="Single year to process")
     parser.add_argument("--month", default=None, help="Single month to process (1-12 or 01-12)")
     parser.add_argument("--variable", default=None, help="Single filename_variable to process")
+    parser.add_argument(
+        "--rebuild-stale",
+        action="store_true",
+        help="Recompute completed outputs whose inputs or operation code changed since they were written",
+    )
+    parser.add_argument(
+        "--fast-kernels",
+        action="store_true",
+        help="Use the blockwise fast_func kernels of the variables that have one instead of the xclim operations",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Variable/year chains computed at the same time; they share the worker memory",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report the runnable and blocked slices",
+    )
     return parser.parse_args()
 
 
@@ -154,6 +214,8 @@ def main():
     if args.variable:
         derived_variables_list = [var for var in derived_variables_list if var == args.variable]
         logger.info(f"Applied variable filter: {args.variable}")
+    # Chains of slices: one per (variable, temporal resolution, year)
+    chains, var_rows = [], {}
     for var in derived_variables_list:
         logger.info(f"Calculating {var}")
         mask_var = (df_parameters['filename_variable'] == var) & (native_derived_condition)
@@ -161,55 +223,143 @@ def main():
         if matches.shape[0] == 0:
             raise KeyError(f"No row found: {var}/derived")
 
+        dependencies = derived_dependencies.get(var, [])
+        if not dependencies:
+            logger.warning(f"No dependencies declared for derived variable {var}. Skipping...")
+            continue
+        logger.info(f"Derived variable {var} has dependencies: {dependencies}")
+
         # process each temporal_resolution (e.g., hourly and daily) so both get calculated.
         for _, var_row in matches.iterrows():
+            key = (var, var_row["temporal_resolution"])
+            if VAR_CONFIG.get(key) is None:
+                raise ValueError(
+                    f"Unexpected variable '{var}' with temporal resolution "
+                    f"'{var_row['temporal_resolution']}'. "
+                    f"Add an entry to VAR_CONFIG in this file."
+                )
+            var_rows[key] = var_row
             # Create a list of years from start to end for this specific row
-            # year_list = list(range(var_row["cds_years_start"].squeeze(), var_row["cds_years_end"].squeeze() + 1))
             if args.year is not None:
                 year_list = [args.year]
             else:
                 year_list = list(range(int(var_row["cds_years_start"]), int(var_row["cds_years_end"]) + 1))
-            for year in year_list:
-
-                dependencies = derived_dependencies.get(var, [])
-                if not dependencies:
-                    logger.warning(f"No dependencies declared for derived variable {var}. Skipping...")
-                    continue
-                logger.info(f"Derived variable {var} has dependencies: {dependencies}")
-
-                key = (var, var_row["temporal_resolution"])
-                cfg = VAR_CONFIG.get(key)
-                if cfg is None:
-                    raise ValueError(
-                        f"Unexpected variable '{var}' with temporal resolution "
-                        f"'{var_row['temporal_resolution']}'. "
-                        f"Add an entry to VAR_CONFIG in this file."
-                    )
+            chains.extend((*key, year) for year in year_list)
+
+    def operation(cfg):
+        # The fast kernels replace the xclim operations only when requested
+        return cfg["fast_func"] if args.fast_kernels and "fast_func" in cfg else cfg["func"]
+
+    # Parallel chains share the worker memory
+    memory_limit = PARAMS_SLURM["memory_limit"] // max(args.jobs, 1)
+    # ... and the cache of yearly inputs: each keeps all its dependencies open
+    max_dependencies = max((len(derived_dependencies[var]) for var, _, _ in chains), default=1)
+    YEARLY_DATASET_CACHE.resize(max(args.jobs, 1) * max_dependencies)
+
+    def plan(chain):
+        var, resolution, year = chain
+        cfg = VAR_CONFIG[(var, resolution)]
+        runnable, blocked = [], {}
+        for month in (MONTH_LIST if cfg.get("iterate_monthly") else [None]):
+            pending, missing = slice_status(
+                var,
+                dataset,
+                derived_dependencies[var],
+                df_parameters,
+                var_rows[(var, resolution)],
+                year,
+                operation(cfg),
+                cfg["cond"],
+                month=month,
+                resampling=cfg.get("resampling"),
+                precision=cfg.get("precision"),
+                finer_resolution=cfg.get("from_finer"),
+                rebuild_stale=args.rebuild_stale,
+            )
+            if missing:
+                blocked[month] = missing
+            elif pending:
+                runnable.append(month)
+        return runnable, blocked
 
-                month_iter = MONTH_LIST if cfg.get("iterate_monthly") else [None]
-
-                for month in month_iter:
-                    if cfg.get("timing"):
-                        start_time = time.time()
-
-                    process_derived(
-                        var,
-                        dataset,
-                        dependencies,
-                        df_parameters,
-                        var_row,
-                        year,
-                        cfg["func"],
-                        cfg["cond"],
-                        month=month,
-                        resampling=cfg.get("resampling"),
+    def run(chain, months):
+        var, resolution, year = chain
+        cfg = VAR_CONFIG[(var, resolution)]
+        dependencies = derived_dependencies[var]
+
+        # The next slice's inputs are persisted on the worker while one
+        # computes: that buffer is taken from the worker memory
+        prefetch_bytes = memory_limit // 4 if cfg.get("iterate_monthly") and len(months) > 1 else 0
+        compute_limit = memory_limit - prefetch_bytes
+
+        # Largest period (year, quarter, month, week) fitting the worker memory
+        slices = plan_slices(
+            dataset,
+            dependencies,
+            df_parameters,
+            cfg["cond"],
+            year,
+            months if cfg.get("iterate_monthly") else None,
+            compute_limit,
+            expansion_factor=cfg.get("expansion_factor"),
+            period=cfg.get("slice"),
+        )
+
+        # Buffer for the next slice's inputs, read while the current one computes
+        prefetcher = Prefetcher(max_bytes=prefetch_bytes) if prefetch_bytes and len(slices) > 1 else None
+
+        try:
+            for i, (month, stream) in enumerate(slices):
+                if cfg.get("timing"):
+                    start_time = time.time()
+
+                process_derived(
+                    var,
+                    dataset,
+                    dependencies,
+                    df_parameters,
+                    var_rows[(var, resolution)],
+                    year,
+                    operation(cfg),
+                    cfg["cond"],
+                    month=month,
+                    resampling=cfg.get("resampling"),
+                    memory_limit=compute_limit,
+                    threads=PARAMS_SLURM["threads"],
+                    expansion_factor=cfg.get("expansion_factor"),
+                    precision=cfg.get("precision"),
+                    finer_resolution=cfg.get("from_finer"),
+                    rebuild_stale=args.rebuild_stale,
+                    prefetcher=prefetcher,
+                    prefetch_month=slices[i + 1][0] if i + 1 < len(slices) else None,
+                    stream=stream,
+                )
+
+                if cfg.get("timing"):
+                    end_time = time.time()
+                    logger.info(
+                        f"Processing time for {var} in year {year}: "
+                        f"{end_time - start_time:.2f} seconds"
                     )
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
 
-                    if cfg.get("timing"):
-                        end_time = time.time()
-                        logger.info(
-                            f"Processing time for {var} in year {year}: "
-                            f"{end_time - start_time:.2f} seconds"
-                        )
+    def waits_for(chain):
+        # Resolutions built from a finer product wait until it is materialized
+        var, resolution, year = chain
+        finer = VAR_CONFIG[(var, resolution)].get("from_finer")
+        return [(var, finer, year)] if finer else []
+
+    run_schedule(
+        chains,
+        plan,
+        run,
+        jobs=args.jobs,
+        waits_for=waits_for,
+        # Yearly inputs are not reused by the next wave
+        after_wave=YEARLY_DATASET_CACHE.close,
+        dry_run=args.dry_run,
+    )
 if __name__ == "__main__":
     main()
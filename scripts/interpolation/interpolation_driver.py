@@ -0,0 +1,530 @@
+"""
+Interpolation driver for every request CSV.
+
+Reads the rows with a non-native ``interpolation`` and their
+``interpolation_file`` reference grid from one or more request CSVs, resolves
+the native source files of each row and groups the work by source file: when
+several targets are requested for the same source (e.g. ``gr006`` and
+``gr025``), the file is read once and every target is produced from it.
+Weights are generated once per (source grid, target grid, method) in the
+parent process and cached on disk (``utils_regrid``), then the files are
+regridded across a process pool that loads them from the cache.
+
+Outputs are written with an unlimited time dimension. When a source file is
+modified after its output (e.g. a yearly file of the current year gaining
+new months), only the time steps missing from the output are interpolated
+and appended to it (``utils_time_append``).
+
+Files are regridded in blocks of time steps sized from the memory available
+to each worker (``--memory-gb``, ``C3S_INTERPOLATION_MEMORY_GB`` or the SLURM
+allocation): every block is read once, regridded to each target and written
+after the steps already in the output, so peak memory does not depend on the
+length of the file.
+
+Usage:
+    python interpolation_driver.py reanalysis-cerra-single-levels [...] [--workers 4] [--memory-gb 64] [--variable t2m] [--dry-run]
+"""
+import argparse
+import logging
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../utilities')))
+from logging_utils import setup_logging
+from utils import load_output_path_from_row, require_single_row, is_valid_netcdf, VARIABLE_DEPENDENCIES
+from utils_chunking import BALANCED_TIME_CHUNK, output_chunksizes
+from utils_conservation import AreaIntegrals, ConservationRecorder, write_sidecar
+from utils_derived_pipeline import get_original_var
+from utils_inventory import get_inventory, parse_filename_period
+from utils_regrid import CachedInterpolator, make_grid
+from utils_staging import stage_inputs, staged_output
+from utils_time_append import append_time_steps, missing_times
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_DIR = Path(__file__).resolve().parents[2] / "requests"
+
+# Directories searched, in order, for the interpolation_file reference grids;
+# other copies (e.g. a working directory) are listed in C3S_REFERENCE_GRID_DIRS
+REFERENCE_GRID_DIRS = os.getenv(
+    "C3S_REFERENCE_GRID_DIRS", "/lustre/gmeteo/PTICLIMA/Auxiliary-material/Masks"
+).split(os.pathsep)
+
+# Memory of the node shared by the workers; see default_memory_limit
+INTERPOLATION_MEMORY_GB = os.getenv("C3S_INTERPOLATION_MEMORY_GB")
+# Share of the SLURM allocation used, as in utils_dask_slurm.load_slurm_dask_config
+SLURM_MEMORY_FRACTION = 0.7
+
+# Per request CSV settings; datasets not listed use DEFAULT_CONFIG. Sources on
+# projected grids name their utils_grids.PROJECTED_GRIDS entry in source_grid.
+# layout is the storage chunk layout of the outputs (utils_chunking.OUTPUT_LAYOUTS);
+# dual_layout maps heavily read variables to a second layout written to a
+# "{variable}_{layout}" directory next to the output, e.g. {"t2m": "map"};
+# conservation writes the utils_conservation sidecar of every output
+DEFAULT_CONFIG = {"method": "conservative_normed", "spatial_chunk": 50, "layout": "series", "conservation": True}
+INTERPOLATION_CONFIG = {
+    "reanalysis-era5-single-levels": {"method": "bilinear", "spatial_chunk": 40},
+    "derived-era5-single-levels-daily-statistics": {"method": "bilinear", "spatial_chunk": 40},
+    "reanalysis-cerra-single-levels": {"source_grid": "cerra-lcc"},
+    "satellite-sea-ice-concentration_nh": {
+        "rename": {"xc": "x", "yc": "y"}, "temporal_resolutions": ["monthly"], "source_grid": "ease2-nh",
+    },
+    "satellite-sea-ice-concentration_sh": {
+        "rename": {"xc": "x", "yc": "y"}, "temporal_resolutions": ["monthly"], "source_grid": "ease2-sh",
+    },
+}
+
+
+# Time encoding of the outputs. It is fixed rather than inferred from the
+# first block written: a block of one hourly step could get integer "days
+# since" units, in which the steps appended later cannot be encoded.
+TIME_ENCODING = {"units": "hours since 1900-01-01 00:00:00", "dtype": "float64"}
+
+
+def write_to_netcdf(
+    dataset: xr.Dataset, path: str, var: str, spatial_chunk: int = 50, layout: str = "series", n_time: int = None
+):
+    """
+    Save a xarray.Dataset as a netCDF file.
+
+    Each file will be saved with a specific encoding where we can define
+    the chunk strategy, the compress level etc. The time coordinate is
+    encoded with ``TIME_ENCODING`` so later time steps can be appended.
+
+    Parameters
+    ----------
+    dataset (xarray.Dataset): data stored by dimension
+    layout (str): storage chunk layout, see utils_chunking.output_chunksizes
+    n_time (int): length of the whole time axis when ``dataset`` is the first
+        block of a streamed output, so the chunks fit the whole output
+    """
+    shape = dataset[var].shape
+    if n_time is not None:
+        shape = (n_time, *shape[1:])
+    chunksizes = output_chunksizes(layout, shape, 4, spatial_chunk)
+    encoding_var = dict(
+        dtype="float32",
+        shuffle=True,
+        zlib=True,
+        complevel=1,
+        chunksizes=chunksizes
+    )
+    encoding = {var: encoding_var}
+    if "time" in dataset.variables:
+        calendar = dataset["time"].encoding.get("calendar")
+        encoding["time"] = dict(TIME_ENCODING, **({"calendar": calendar} if calendar else {}))
+    dataset.to_netcdf(path=path, encoding=encoding, unlimited_dims=["time"])
+
+
+def default_memory_limit():
+    """
+    Memory for the interpolation: ``C3S_INTERPOLATION_MEMORY_GB``, 70% of the
+    SLURM allocation (headroom for the interpreter and libraries) or half the node.
+    """
+    if INTERPOLATION_MEMORY_GB:
+        return int(float(INTERPOLATION_MEMORY_GB) * 1024**3)
+    if os.getenv("SLURM_MEM_PER_NODE"):
+        return int(int(os.getenv("SLURM_MEM_PER_NODE")) * 1024**2 * SLURM_MEMORY_FRACTION)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+
+
+def reference_grid(interpolation_file):
+    """Return the target ``(lats, lons)`` of a reference grid file."""
+    for directory in REFERENCE_GRID_DIRS:
+        path = Path(directory) / interpolation_file
+        if path.exists():
+            with xr.open_dataset(path) as ds:
+                lat = "lat" if "lat" in ds.variables else "latitude"
+                lon = "lon" if "lon" in ds.variables else "longitude"
+                return ds[lat].values, ds[lon].values
+    raise FileNotFoundError(f"Reference grid {interpolation_file} not found in {REFERENCE_GRID_DIRS}")
+
+
+def source_row(df_parameters, row):
+    """
+    Return the native row an interpolated row is computed from.
+
+    Derived variables are read from their native derived product, the others
+    from the raw download, at the same temporal resolution (and CDR type)
+    when such a row exists.
+    """
+    product_type = "derived" if row["filename_variable"] in VARIABLE_DEPENDENCIES else "raw"
+    mask = (
+        (df_parameters["filename_variable"] == row["filename_variable"])
+        & (df_parameters["product_type"] == product_type)
+        & (df_parameters["interpolation"] == "native")
+    )
+    if "cds_cdr_type" in df_parameters.columns:
+        mask &= df_parameters["cds_cdr_type"] == row["cds_cdr_type"]
+    same_resolution = mask & (df_parameters["temporal_resolution"] == row["temporal_resolution"])
+    if same_resolution.any():
+        mask = same_resolution
+    return require_single_row(df_parameters, mask, f"{row['filename_variable']}/{product_type}")
+
+
+def output_dir_from_row(row, dataset):
+    # Some rows point output_path to the final variable directory already
+    if Path(row["output_path"]).name == row["filename_variable"]:
+        return load_output_path_from_row(row, dataset, raw=True)
+    return load_output_path_from_row(row, dataset)
+
+
+def pending_times(source_file, output_file):
+    """
+    Return the time steps an existing output misses, or None if it is complete.
+
+    Only sources modified after their output are opened. Returns a dict with
+    the missing ``times`` and the ``mode`` used to add them: ``"append"`` in
+    place, or ``"rewrite"`` when they do not follow the written steps or the
+    output predates the unlimited time dimension.
+    """
+    if os.path.getmtime(source_file) <= os.path.getmtime(output_file):
+        return None
+    with xr.open_dataset(source_file) as ds:
+        source = ds["valid_time" if "valid_time" in ds.variables else "time"].values
+    times, mode = missing_times(source, output_file)
+    if len(times) == 0:
+        return None
+    logger.info(f"{output_file}: {len(times)} new time steps to {mode}")
+    return {"times": times, "mode": mode}
+
+
+def plan_interpolation(datasets, variables=None):
+    """
+    Group the pending interpolations by source file.
+
+    Returns
+    -------
+    list of dict
+        One task per source file: ``source_file``, ``rename`` and ``targets``,
+        a list of dicts with ``output_file``, ``var_name``, ``method``,
+        ``lats``, ``lons``, ``spatial_chunk``, ``layout``, ``source_grid``, ``target`` (the
+        interpolation label, e.g. ``gr006``) and, for outputs that only miss
+        some time steps, ``times`` and ``mode`` (see ``pending_times``).
+    """
+    tasks = defaultdict(lambda: {"targets": []})
+    grids = {}
+    for dataset in datasets:
+        config = {**DEFAULT_CONFIG, **INTERPOLATION_CONFIG.get(dataset, {})}
+        df_parameters = pd.read_csv(REQUESTS_DIR / f"{dataset}.csv")
+        rows = df_parameters[
+            (df_parameters["interpolation"] != "native") & (df_parameters["product_type"] == "derived")
+        ]
+        for _, row in rows.iterrows():
+            if variables and row["filename_variable"] not in variables:
+                continue
+            if "temporal_resolutions" in config and row["temporal_resolution"] not in config["temporal_resolutions"]:
+                continue
+            orig_dir = load_output_path_from_row(source_row(df_parameters, row), dataset)
+            output_dir = output_dir_from_row(row, dataset)
+            if row["interpolation_file"] not in grids:
+                grids[row["interpolation_file"]] = reference_grid(row["interpolation_file"])
+            lats, lons = grids[row["interpolation_file"]]
+
+            layouts = [(output_dir, config["layout"])]
+            dual_layout = config.get("dual_layout", {}).get(row["filename_variable"])
+            if dual_layout:
+                layouts.append((output_dir.parent / f"{output_dir.name}_{dual_layout}", dual_layout))
+
+            for file in get_inventory(orig_dir).files():
+                for layout_dir, layout in layouts:
+                    output_file = layout_dir / os.path.basename(file)
+                    update = {}
+                    if output_file.exists() and is_valid_netcdf(Path(str(output_file).replace("zip", "nc"))):
+                        update = pending_times(file, output_file)
+                        if update is None:
+                            continue
+                    task = tasks[file]
+                    task.update(source_file=file, rename=config.get("rename", {}))
+                    task["targets"].append({
+                        "output_file": str(output_file),
+                        "var_name": get_original_var(dataset, row["filename_variable"]),
+                        "method": config["method"],
+                        "lats": lats,
+                        "lons": lons,
+                        "spatial_chunk": config["spatial_chunk"],
+                        "layout": layout,
+                        "conservation": config["conservation"],
+                        "target": row["interpolation"],
+                        "source_grid": config.get("source_grid"),
+                        **update,
+                    })
+    return list(tasks.values())
+
+
+def open_source(source_file, rename):
+    ds = xr.open_dataset(stage_inputs([source_file])[0])
+    if "valid_time" in ds.dims:
+        ds = ds.rename({"valid_time": "time"})
+    return ds.rename(rename) if rename else ds
+
+
+def _interpolator(target):
+    return CachedInterpolator({
+        "interpolation_method": target["method"],
+        "lats": target["lats"],
+        "lons": target["lons"],
+        "var_name": target["var_name"],
+        "source_grid": target.get("source_grid"),
+    })
+
+
+def prepare_weights(tasks):
+    """Generate the weights of every (source grid, target) once, before the pool reads them."""
+    seen = set()
+    for task in tasks:
+        for target in task["targets"]:
+            key = (os.path.dirname(task["source_file"]), target["target"], target["method"])
+            if key in seen:
+                continue
+            seen.add(key)
+            with open_source(task["source_file"], task["rename"]) as ds:
+                _interpolator(target).regridder(ds)
+
+
+def batch_tasks(tasks):
+    """
+    Group the tasks whose sources can be regridded in one pass.
+
+    Files of different variables of the same product, period (date token of
+    the name) and targets share their grid and time axis: they are stacked
+    and regridded together. Tasks that only append time steps are not batched.
+    """
+    batches = defaultdict(list)
+    for task in tasks:
+        period = parse_filename_period(os.path.basename(task["source_file"]))
+        if period is None or any("times" in target for target in task["targets"]):
+            key = (task["source_file"],)
+        else:
+            key = (
+                os.path.dirname(os.path.dirname(task["source_file"])),
+                period[3],
+                tuple(sorted(task["rename"].items())),
+                tuple(sorted(
+                    (t["target"], t["method"], str(t.get("source_grid")), t["layout"]) for t in task["targets"]
+                )),
+            )
+        batches[key].append(task)
+    return list(batches.values())
+
+
+def _regrid_groups(ds, targets):
+    """Targets sharing weights, with the fields they need and their interpolator and regridder."""
+    groups = defaultdict(list)
+    for target in targets:
+        groups[(target["target"], target["method"], target.get("source_grid"))].append(target)
+    plans = []
+    for group in groups.values():
+        fields = list(dict.fromkeys(target.get("field", target["var_name"]) for target in group))
+        interpolator = _interpolator({**group[0], "var_name": fields[0]})
+        plans.append((group, fields, interpolator, interpolator.regridder(ds)))
+    return plans
+
+
+def conservation_recorders(ds, plans):
+    """``ConservationRecorder`` of every target that records its integrals, keyed by output file."""
+    recorders = {}
+    for group, _, interpolator, _ in plans:
+        group = [target for target in group if target.get("conservation")]
+        if not group:
+            continue
+        dst_grid = make_grid(group[0]["lats"], group[0]["lons"], bounds=True)
+        source = AreaIntegrals(interpolator.src_grid(ds, bounds=True), domain=dst_grid)
+        target_integrals = AreaIntegrals(dst_grid)
+        for target in group:
+            recorders[target["output_file"]] = ConservationRecorder(
+                source, target_integrals, target["var_name"], target["method"]
+            )
+    return recorders
+
+
+def time_block_steps(ds, plans, memory_limit):
+    """
+    Time steps regridded at once so that a block fits ``memory_limit``.
+
+    A block holds the source steps of every field and the output of one
+    target grid at a time, plus the fixed working memory of the regridders.
+    """
+    fields = {field for _, group_fields, _, _ in plans for field in group_fields}
+    itemsize = max(max(ds[field].dtype.itemsize for field in fields), 4)
+    step_src = sum(int(np.prod(ds[field].shape[-2:])) for field in fields) * itemsize
+    step_dst = max(
+        len(group_fields) * np.size(group[0]["lats"]) * np.size(group[0]["lons"]) * 4
+        for group, group_fields, _, _ in plans
+    )
+    overhead = max(
+        regridder.block_bytes(itemsize) if hasattr(regridder, "block_bytes") else 4 * step_src
+        for _, _, _, regridder in plans
+    )
+    steps = (memory_limit - overhead) // (step_src + step_dst)
+    return int(np.clip(steps, 1, ds.sizes["time"]))
+
+
+def stream_targets(ds, targets, memory_limit, append=False):
+    """
+    Regrid ``ds`` to every target block by block of time steps.
+
+    The fields of the targets sharing a target grid are regridded together
+    (see ``CachedInterpolator``). The first block creates each output (in a
+    staged file committed when all the blocks are written) and the next ones
+    are appended to it; with ``append`` every block is appended to the
+    existing outputs. The area-weighted integrals of the source and target
+    fields are recorded on the way (``utils_conservation``).
+    """
+    plans = _regrid_groups(ds, targets)
+    recorders = conservation_recorders(ds, plans)
+    steps = time_block_steps(ds, plans, memory_limit)
+    n_time = ds.sizes["time"]
+    if steps < n_time and steps > BALANCED_TIME_CHUNK and any(t["layout"] == "balanced" for t in targets):
+        # Whole balanced chunks per block, so no chunk is written twice
+        steps -= steps % BALANCED_TIME_CHUNK
+    if steps < n_time:
+        logger.info(f"Regridding {n_time} time steps in blocks of {steps}")
+
+    with ExitStack() as stack:
+        if append:
+            paths = {target["output_file"]: target["output_file"] for target in targets}
+        else:
+            for target in targets:
+                Path(target["output_file"]).parent.mkdir(parents=True, exist_ok=True)
+            paths = {target["output_file"]: stack.enter_context(staged_output(target["output_file"])) for target in targets}
+
+        for start in range(0, n_time, steps):
+            block = ds.isel(time=slice(start, start + steps)).load()
+            for group, fields, interpolator, regridder in plans:
+                ds_fields = interpolator(block, regridder, fields)
+                for target in group:
+                    field = target.get("field", target["var_name"])
+                    ds_i = ds_fields[[field]]
+                    if field != target["var_name"]:
+                        ds_i = ds_i.rename({field: target["var_name"]})
+                    path = paths[target["output_file"]]
+                    if target["output_file"] in recorders:
+                        recorders[target["output_file"]].add(
+                            block["time"].values, block[field].values, ds_i[target["var_name"]].values
+                        )
+                    if start == 0 and not append:
+                        write_to_netcdf(
+                            ds_i, str(path), target["var_name"], target["spatial_chunk"], target["layout"], n_time
+                        )
+                    else:
+                        append_time_steps(path, ds_i)
+            block.close()
+
+    for output_file, recorder in recorders.items():
+        write_sidecar(output_file, recorder, append)
+
+
+def _same_axes(sources, batch):
+    first = sources[0]
+    shape = first[batch[0]["targets"][0]["var_name"]].shape
+    return all(
+        np.array_equal(source["time"].values, first["time"].values)
+        and source[task["targets"][0]["var_name"]].shape == shape
+        for source, task in zip(sources[1:], batch[1:])
+    )
+
+
+def interpolate_batch(batch, memory_limit):
+    """
+    Regrid the source files of a batch (``batch_tasks``) in one pass and write every target.
+
+    Each block of time steps is read once; the variables of the batch are
+    stacked and regridded together, then written to their own outputs. Time
+    steps missing from existing outputs are appended per file; outputs that
+    must be rewritten are streamed again from the whole source, like new ones.
+    """
+    sources = [open_source(task["source_file"], task["rename"]) for task in batch]
+    try:
+        if len(batch) > 1 and not _same_axes(sources, batch):
+            logger.warning(f"Time axes or grids differ in {[t['source_file'] for t in batch]}; regridding them one by one")
+            return [f for task in batch for f in interpolate_batch([task], memory_limit)]
+
+        if len(batch) == 1:
+            ds = sources[0]
+            new = [target for target in batch[0]["targets"] if target.get("mode", "rewrite") == "rewrite"]
+        else:
+            ds = xr.Dataset({
+                f"field{i}": source[task["targets"][0]["var_name"]] for i, (task, source) in enumerate(zip(batch, sources))
+            })
+            new = [{**target, "field": f"field{i}"} for i, task in enumerate(batch) for target in task["targets"]]
+            logger.info(f"Regridding {len(batch)} variables together: {[t['source_file'] for t in batch]}")
+        if new:
+            stream_targets(ds, new, memory_limit)
+
+        for task, source in zip(batch, sources):
+            for target in task["targets"]:
+                if target.get("mode") == "append":
+                    stream_targets(source.sel(time=target["times"]), [target], memory_limit, append=True)
+        return [target["output_file"] for task in batch for target in task["targets"]]
+    finally:
+        for source in sources:
+            source.close()
+
+
+def run(datasets, workers=1, variables=None, dry_run=False, memory_limit=None, batch=True):
+    """
+    Interpolate every pending file of ``datasets``; returns the files that failed.
+
+    ``memory_limit`` (bytes, ``default_memory_limit()`` if None) is shared by
+    the ``workers``. With ``batch`` the variables sharing a grid and time axis
+    are regridded together (``batch_tasks``).
+    """
+    tasks = plan_interpolation(datasets, variables)
+    batches = batch_tasks(tasks) if batch else [[task] for task in tasks]
+    n_targets = sum(len(task["targets"]) for task in tasks)
+    logger.info(f"{len(tasks)} source files to read in {len(batches)} passes for {n_targets} interpolated outputs")
+    if dry_run:
+        for tasks_batch in batches:
+            logger.info(" + ".join(
+                f"{task['source_file']} -> {[t['target'] for t in task['targets']]}" for task in tasks_batch
+            ))
+        return []
+    if not tasks:
+        return []
+
+    prepare_weights(tasks)
+    worker_memory = (memory_limit or default_memory_limit()) // workers
+    logger.info(f"{workers} worker(s) with {worker_memory / 1024**3:.2f} GiB each")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(interpolate_batch, tasks_batch, worker_memory): tasks_batch for tasks_batch in batches}
+        for future in as_completed(futures):
+            source_files = [task["source_file"] for task in futures[future]]
+            try:
+                for output_file in future.result():
+                    logger.info(f"Interpolated {output_file}")
+            except Exception as e:
+                logger.exception(f"Interpolation of {source_files} failed: {e}")
+                failed.extend(source_files)
+    logger.info(f"Interpolation finished: {len(tasks) - len(failed)} source files done, {len(failed)} failed")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Interpolate the non-native rows of request CSVs.")
+    parser.add_argument("datasets", nargs="+", help="Request CSV names (without .csv)")
+    parser.add_argument("--workers", type=int, default=1, help="Source files regridded in parallel")
+    parser.add_argument("--variable", action="append", help="Only interpolate this variable (repeatable)")
+    parser.add_argument("--memory-gb", type=float, help="Memory shared by the workers (default: C3S_INTERPOLATION_MEMORY_GB, the SLURM allocation or half the node)")
+    parser.add_argument("--no-batch", action="store_true", help="Regrid every variable separately")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the pending source files and targets")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    memory_limit = int(args.memory_gb * 1024**3) if args.memory_gb else None
+    failed = run(args.datasets, args.workers, args.variable, args.dry_run, memory_limit, not args.no_batch)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
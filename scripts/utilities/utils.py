@@ -319,3 +319,19 @@ def derived_condition_hourly_native(df, orig_var, dep):
     label = f"{orig_var}/derived"
     return condition, label
 
+
+def derived_condition_native(temporal_resolution):
+    """
+    Build a condition function selecting the native derived row of a variable
+    at a given temporal resolution (e.g. an hourly product reused for daily values).
+    """
+    def condition_func(df, orig_var, dep):
+        condition = (
+            (df['filename_variable'] == orig_var) &
+            (df['product_type'] == 'derived') &
+            (df['interpolation'] == 'native') &
+            (df['temporal_resolution'] == temporal_resolution)
+        )
+        label = f"{orig_var}/derived/{temporal_resolution}"
+        return condition, label
+    return condition_func
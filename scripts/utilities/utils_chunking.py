@@ -0,0 +1,275 @@
+import logging
+import math
+import os
+from datetime import date
+
+import numpy as np
+import xarray as xr
+
+from utils_inventory import parse_filename_period
+
+logger = logging.getLogger(__name__)
+
+# Default ratio between the peak memory of a kernel and the bytes of its
+# inputs (temporaries created by the operation, decoded copies, output).
+DEFAULT_EXPANSION_FACTOR = 3
+
+TIME_DIMS = ("time", "valid_time")
+
+
+def read_storage_layout(path):
+    """
+    Read the on-disk layout of the main data variable of a NetCDF file.
+
+    Only the file header is read: dimension names, array shape, decoded dtype
+    and HDF5 storage chunk shape.
+
+    Parameters
+    ----------
+    path : str or Path
+        NetCDF file to inspect.
+
+    Returns
+    -------
+    dict
+        ``var``, ``dims``, ``shape``, ``itemsize`` and ``storage_chunks``.
+        Contiguous variables report ``storage_chunks`` of ones, so any chunk
+        size is aligned with them.
+    """
+    with xr.open_dataset(path, decode_times=False) as ds:
+        if not ds.data_vars:
+            raise ValueError(f"No data variables found in {path}")
+        # The main variable is the largest one (skip expver, bounds, ...)
+        var = max(ds.data_vars, key=lambda v: ds[v].size)
+        da = ds[var]
+        chunksizes = da.encoding.get("chunksizes")
+        if chunksizes is None or da.encoding.get("contiguous"):
+            chunksizes = (1,) * da.ndim
+
+        return {
+            "var": var,
+            "dims": tuple(da.dims),
+            "shape": tuple(da.shape),
+            "itemsize": da.dtype.itemsize,
+            "storage_chunks": tuple(int(c) for c in chunksizes),
+        }
+
+
+def _time_dim(dims):
+    for dim in dims:
+        if dim in TIME_DIMS:
+            return dim
+    return None
+
+
+def plan_chunks(lists_files, memory_limit, threads=1, expansion_factor=None):
+    """
+    Select dask chunks for the dependencies of a derived variable.
+
+    The per-thread budget (``memory_limit / threads``) must hold
+    ``n_dependencies * chunk_bytes * expansion_factor``. The chunk grows along
+    time first, in multiples of the storage chunk, covering the full spatial
+    domain. When a single storage chunk in time already exceeds the budget,
+    the spatial dimensions are split instead, again in multiples of the
+    storage chunk.
+
+    Parameters
+    ----------
+    lists_files : list of list of str
+        Files resolved for each dependency (as returned by ``load_files``).
+    memory_limit : int
+        Memory of the dask worker in bytes (``load_slurm_dask_config``).
+    threads : int, optional
+        Threads of the worker; each one holds a chunk at the same time.
+    expansion_factor : float, optional
+        Peak memory of the kernel relative to its input bytes.
+
+    Returns
+    -------
+    dict
+        Chunk sizes keyed by the dimension names found in the files.
+    """
+    if expansion_factor is None:
+        expansion_factor = DEFAULT_EXPANSION_FACTOR
+
+    layouts = [read_storage_layout(files[0]) for files in lists_files]
+    n_deps = len(layouts)
+
+    # All dependencies share the grid; plan on the widest dtype
+    ref = max(layouts, key=lambda layout: layout["itemsize"])
+    dims, shape, storage = ref["dims"], ref["shape"], ref["storage_chunks"]
+
+    budget = memory_limit / max(threads, 1)
+    chunk_budget = budget / (n_deps * expansion_factor)
+
+    time_dim = _time_dim(dims)
+    chunks = dict(zip(dims, shape))
+
+    def chunk_bytes():
+        return int(np.prod(list(chunks.values()))) * ref["itemsize"]
+
+    if time_dim is not None:
+        t_axis = dims.index(time_dim)
+        t_storage = storage[t_axis]
+        chunks[time_dim] = t_storage
+        if chunk_bytes() <= chunk_budget:
+            n_blocks = max(1, int(chunk_budget // chunk_bytes()))
+            chunks[time_dim] = min(n_blocks * t_storage, shape[t_axis])
+
+    # Split the spatial dimensions when a single time block does not fit
+    spatial = [(i, d) for i, d in enumerate(dims) if d != time_dim]
+    while chunk_bytes() > chunk_budget:
+        candidates = [
+            (i, d) for i, d in spatial if chunks[d] > storage[i]
+        ]
+        if not candidates:
+            logger.warning(
+                "Storage chunks exceed the memory budget; using the smallest aligned chunks"
+            )
+            break
+        i, d = max(candidates, key=lambda item: chunks[item[1]] // storage[item[0]])
+        n_blocks = math.ceil(chunks[d] / storage[i])
+        chunks[d] = max(1, n_blocks // 2) * storage[i]
+
+    logger.info(
+        "Chunk plan: "
+        f"{n_deps} dependencies, grid {dict(zip(dims, shape))}, "
+        f"itemsize {ref['itemsize']} B, storage chunks {dict(zip(dims, storage))}, "
+        f"budget {budget / 1024**2:.0f} MiB/thread, expansion {expansion_factor}, "
+        f"chunks {chunks} ({chunk_bytes() / 1024**2:.1f} MiB/chunk, "
+        f"estimated peak {n_deps * chunk_bytes() * expansion_factor / 1024**2:.1f} MiB/thread)"
+    )
+
+    return chunks
+
+
+# Slice periods tried by ``choose_slice_period``, largest first, with the
+# number of days they span at most
+SLICE_PERIODS = {"year": 366, "quarter": 92, "month": 31, "week": 7}
+
+
+def estimate_slice_bytes(lists_files, days, expansion_factor=None):
+    """
+    Estimate the working set of computing a derived variable over ``days`` days.
+
+    The time steps per day of each dependency are read from the header of its
+    first file and the period encoded in the file name, so files of any
+    period (yearly, monthly, daily) give the same estimate.
+
+    Parameters
+    ----------
+    lists_files : list of list of str
+        Files resolved for each dependency (as returned by ``load_files``).
+    days : int
+        Length of the slice.
+    expansion_factor : float, optional
+        Peak memory of the kernel relative to its input bytes.
+
+    Returns
+    -------
+    int
+        Estimated peak bytes.
+    """
+    if expansion_factor is None:
+        expansion_factor = DEFAULT_EXPANSION_FACTOR
+
+    total = 0
+    for files in lists_files:
+        layout = read_storage_layout(files[0])
+        dims, shape = layout["dims"], layout["shape"]
+        time_dim = _time_dim(dims)
+        grid = int(np.prod([n for d, n in zip(dims, shape) if d != time_dim]))
+
+        steps = 1
+        period = parse_filename_period(os.path.basename(files[0]))
+        if time_dim is not None and period is not None:
+            start, end = (date(d // 10000, d // 100 % 100, d % 100) for d in period[:2])
+            steps_per_day = shape[dims.index(time_dim)] / ((end - start).days + 1)
+            steps = math.ceil(steps_per_day * days)
+        elif time_dim is not None:
+            steps = shape[dims.index(time_dim)]
+        total += steps * grid * layout["itemsize"]
+
+    return int(total * expansion_factor)
+
+
+def choose_slice_period(lists_files, memory_limit, expansion_factor=None, periods=None):
+    """
+    Pick the largest slice period whose working set fits the worker memory.
+
+    Parameters
+    ----------
+    lists_files : list of list of str
+        Files resolved for each dependency (as returned by ``load_files``).
+    memory_limit : int
+        Memory of the dask worker in bytes (``load_slurm_dask_config``).
+    expansion_factor : float, optional
+        Peak memory of the kernel relative to its input bytes.
+    periods : list of str, optional
+        Candidate periods (keys of ``SLICE_PERIODS``), largest first.
+
+    Returns
+    -------
+    str
+        The chosen period; the smallest candidate when none fits.
+    """
+    periods = list(periods or SLICE_PERIODS)
+    estimates = {
+        period: estimate_slice_bytes(lists_files, SLICE_PERIODS[period], expansion_factor)
+        for period in periods
+    }
+    chosen = next((p for p in periods if estimates[p] <= memory_limit), periods[-1])
+
+    summary = ", ".join(f"{p} {b / 1024**2:.0f} MiB" for p, b in estimates.items())
+    if estimates[chosen] > memory_limit:
+        logger.warning(
+            f"No slice period fits {memory_limit / 1024**2:.0f} MiB ({summary}); "
+            f"using {chosen} slices written incrementally"
+        )
+    else:
+        logger.info(f"Slice period {chosen} for {memory_limit / 1024**2:.0f} MiB workers ({summary})")
+    return chosen
+
+
+# Storage chunk layouts of gridded (time, y, x) outputs:
+# - "series": full time axis (of the written block) over small tiles; one point
+#   series reads a single chunk, one map reads every chunk of the file.
+# - "map": whole maps (split along y above OUTPUT_CHUNK_BYTES) per time step;
+#   one map reads a single chunk, one point series reads one chunk per step.
+# - "balanced": BALANCED_TIME_CHUNK steps over tiles of about OUTPUT_CHUNK_BYTES.
+OUTPUT_LAYOUTS = ("series", "map", "balanced")
+OUTPUT_CHUNK_BYTES = 1024**2
+BALANCED_TIME_CHUNK = 32
+
+
+def output_chunksizes(layout, shape, itemsize=4, spatial_chunk=50):
+    """
+    Storage chunk shape of a ``(time, y, x)`` output for an access pattern.
+
+    Parameters
+    ----------
+    layout : str
+        One of ``OUTPUT_LAYOUTS``.
+    shape : tuple of int
+        Shape of the variable, with the length of the whole time axis for
+        outputs streamed in blocks.
+    itemsize : int, optional
+        Bytes per value on disk.
+    spatial_chunk : int, optional
+        Tile side of the ``series`` layout.
+
+    Returns
+    -------
+    tuple of int
+    """
+    n_time, ny, nx = shape
+    if layout == "series":
+        return (n_time, min(ny, spatial_chunk), min(nx, spatial_chunk))
+    if layout == "map":
+        rows = max(1, OUTPUT_CHUNK_BYTES // (nx * itemsize))
+        return (1, min(ny, rows), nx)
+    if layout == "balanced":
+        steps = min(n_time, BALANCED_TIME_CHUNK)
+        side = max(1, int(math.sqrt(OUTPUT_CHUNK_BYTES / (steps * itemsize))))
+        return (steps, min(ny, side), min(nx, side))
+    raise ValueError(f"Unknown output layout {layout!r}; expected one of {OUTPUT_LAYOUTS}")
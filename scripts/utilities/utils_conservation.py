@@ -0,0 +1,253 @@
+"""
+Area-weighted integrals of regridded fields, recorded as they are streamed.
+
+While a file is regridded block by block, the source and target fields of
+every block are integrated over the cells of the target domain, globally and
+in latitude bands, with the cell areas of both grids (computed once from
+their bounds, on the unit sphere like ESMF). The per-step integrals and
+area-weighted means are stored in a small JSON sidecar next to each output
+(``{name}.conservation.json``), so the conservation of the conservative
+methods, and the bias of the others, can be checked without reading the
+data again. A sidecar is not written for outputs that fail. ``read_sidecar``
+and ``band_bias`` read them back as a table of the relative bias per band.
+"""
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from utils_staging import staged_output
+
+logger = logging.getLogger(__name__)
+
+# Edges of the latitude bands, in degrees
+CONSERVATION_BANDS = np.arange(-90, 91, 15)
+
+
+def _unit_vectors(lat, lon):
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _triangle_area(a, b, c):
+    """Spherical excess of great-circle triangles given as unit vectors."""
+    numerator = np.abs(np.einsum("...i,...i", a, np.cross(b, c)))
+    denominator = 1 + np.einsum("...i,...i", a, b) + np.einsum("...i,...i", b, c) + np.einsum("...i,...i", c, a)
+    return 2 * np.arctan2(numerator, denominator)
+
+
+def cell_area(grid):
+    """
+    Cell areas on the unit sphere of a grid built by ``utils_regrid.make_grid`` with bounds.
+
+    Returns
+    -------
+    numpy.ndarray
+        Areas of shape ``(y, x)``, in steradians.
+    """
+    lat_b, lon_b = grid["lat_b"].values, grid["lon_b"].values
+    if lat_b.ndim == 1:
+        sin_lat = np.sin(np.deg2rad(np.clip(lat_b, -90, 90)))
+        return np.abs(np.diff(sin_lat))[:, np.newaxis] * np.abs(np.deg2rad(np.diff(lon_b)))[np.newaxis, :]
+    xyz = _unit_vectors(lat_b, lon_b)
+    sw, se, ne, nw = xyz[:-1, :-1], xyz[:-1, 1:], xyz[1:, 1:], xyz[1:, :-1]
+    return _triangle_area(sw, se, ne) + _triangle_area(sw, ne, nw)
+
+
+def _centres(grid):
+    lat, lon = grid["lat"].values, grid["lon"].values
+    if lat.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+    return lat, lon
+
+
+class AreaIntegrals:
+    """
+    Area-weighted integrals of fields over a domain and its latitude bands.
+
+    Parameters
+    ----------
+    grid : xarray.Dataset
+        Grid with bounds (``utils_regrid.make_grid``).
+    domain : xarray.Dataset, optional
+        Grid whose extent (of its bounds) restricts the cells integrated,
+        e.g. the target grid when integrating the source.
+    bands : array-like, optional
+        Latitude band edges, ``CONSERVATION_BANDS`` by default.
+    """
+
+    def __init__(self, grid, domain=None, bands=None):
+        self.bands = np.asarray(CONSERVATION_BANDS if bands is None else bands)
+        lat, lon = _centres(grid)
+        area = cell_area(grid).ravel()
+        inside = np.ones(area.shape, dtype=bool)
+        if domain is not None:
+            lat_b, lon_b = domain["lat_b"].values, domain["lon_b"].values
+            inside &= (lat.ravel() >= lat_b.min()) & (lat.ravel() <= lat_b.max())
+            width = lon_b.max() - lon_b.min()
+            if width < 360:
+                inside &= np.mod(lon.ravel() - lon_b.min(), 360) <= width
+        band = np.digitize(lat.ravel(), self.bands[1:-1])
+        cells = np.flatnonzero(inside)
+        # Column 0 is the whole domain, column 1 + k the band k
+        rows = np.concatenate([cells, cells])
+        cols = np.concatenate([np.zeros(cells.size, dtype=int), 1 + band[cells]])
+        self.weights = scipy.sparse.csr_matrix(
+            (np.concatenate([area[cells], area[cells]]), (rows, cols)), shape=(area.size, len(self.bands))
+        )
+
+    def __call__(self, values):
+        """
+        Integrals and valid areas of a ``(..., y, x)`` array.
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            Integral and area of the non-missing cells, of shape
+            ``(steps, 1 + bands)``: the whole domain first, then every band.
+        """
+        x = values.reshape(-1, self.weights.shape[0])
+        valid = ~np.isnan(x)
+        integral = (self.weights.T @ np.where(valid, x, 0).astype("float64").T).T
+        area = (self.weights.T @ valid.T.astype("float64")).T
+        return integral, area
+
+
+def _relative_bias(source_mean, target_mean):
+    """Time mean of the relative difference of the domain means, or None."""
+    source_mean, target_mean = np.asarray(source_mean, dtype=float), np.asarray(target_mean, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        relative = (target_mean - source_mean) / np.abs(source_mean)
+    relative = relative[np.isfinite(relative)]
+    return float(relative.mean()) if relative.size else None
+
+
+def _json_values(array):
+    return [[None if np.isnan(v) else float(v) for v in row] for row in np.atleast_2d(array)]
+
+
+class ConservationRecorder:
+    """
+    Accumulate the source and target integrals of one output, block by block.
+
+    Parameters
+    ----------
+    source, target : AreaIntegrals
+        Integrals over the source and the target grid (same domain and bands).
+    variable : str
+        Variable of the output.
+    method : str
+        Regridding method.
+    """
+
+    def __init__(self, source, target, variable, method):
+        self.source, self.target = source, target
+        self.variable, self.method = variable, method
+        self.times, self.blocks = [], {"source": [], "target": []}
+
+    def add(self, times, source_values, target_values):
+        """Integrate one block of source values and the regridded values."""
+        self.times.extend(pd.to_datetime(times).strftime("%Y-%m-%dT%H:%M:%S"))
+        self.blocks["source"].append(self.source(source_values))
+        self.blocks["target"].append(self.target(target_values))
+
+    def summary(self):
+        """Time steps, per-step integrals and means, and the mean relative bias of the domain mean."""
+        result = {
+            "variable": self.variable,
+            "method": self.method,
+            "band_edges": [float(edge) for edge in self.source.bands],
+            "time": self.times,
+        }
+        means = {}
+        for side, blocks in self.blocks.items():
+            integral = np.concatenate([b[0] for b in blocks])
+            area = np.concatenate([b[1] for b in blocks])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[side] = np.where(area > 0, integral / area, np.nan)
+            result[side] = {"integral": _json_values(integral), "mean": _json_values(means[side]), "area": _json_values(area)}
+        result["relative_bias"] = _relative_bias(means["source"][:, 0], means["target"][:, 0])
+        return result
+
+
+def sidecar_path(output_file):
+    output_file = Path(output_file)
+    return output_file.with_name(f"{output_file.stem}.conservation.json")
+
+
+def write_sidecar(output_file, recorder, append=False):
+    """
+    Write the integrals of ``recorder`` next to ``output_file``.
+
+    With ``append`` the steps are added to those of an existing sidecar.
+    """
+    summary = recorder.summary()
+    path = sidecar_path(output_file)
+    if append and path.exists():
+        with open(path) as f:
+            previous = json.load(f)
+        summary["time"] = previous["time"] + summary["time"]
+        for side in ("source", "target"):
+            for key in summary[side]:
+                summary[side][key] = previous[side][key] + summary[side][key]
+        summary["relative_bias"] = _relative_bias(
+            *(np.array(summary[side]["mean"], dtype=float)[:, 0] for side in ("source", "target"))
+        )
+    with staged_output(path) as tmp:
+        with open(tmp, "w") as f:
+            json.dump(summary, f)
+    bias = summary["relative_bias"]
+    if bias is not None:
+        logger.info(f"Conservation of {Path(output_file).name}: relative bias of the domain mean {bias:.2e}")
+
+
+def read_sidecar(output_file):
+    """Return the sidecar summary of ``output_file``, or None if it has none."""
+    path = sidecar_path(output_file)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def band_bias(*summaries):
+    """
+    Source and target means and relative bias of the domain and of every band.
+
+    Parameters
+    ----------
+    *summaries : dict
+        Sidecars (``read_sidecar``) or ``ConservationRecorder.summary()`` with
+        the same bands, e.g. the monthly files of one variable; their time
+        steps are pooled.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by region (``domain``, then the bands as ``"lat0 to lat1"``),
+        with the time means of the ``source`` and ``target`` means, the mean
+        ``relative_bias`` of the target mean and the number of ``steps`` it
+        is computed from (NaN for bands without valid cells).
+    """
+    edges = summaries[0]["band_edges"]
+    regions = ["domain"] + [f"{south:g} to {north:g}" for south, north in zip(edges[:-1], edges[1:])]
+    means = {
+        side: np.concatenate([np.array(summary[side]["mean"], dtype=float) for summary in summaries])
+        for side in ("source", "target")
+    }
+    rows = []
+    for i, region in enumerate(regions):
+        source, target = means["source"][:, i], means["target"][:, i]
+        valid = np.isfinite(source) & np.isfinite(target)
+        bias = _relative_bias(source[valid], target[valid])
+        rows.append({
+            "region": region,
+            "source": source[valid].mean() if valid.any() else np.nan,
+            "target": target[valid].mean() if valid.any() else np.nan,
+            "relative_bias": np.nan if bias is None else bias,
+            "steps": int(valid.sum()),
+        })
+    return pd.DataFrame(rows).set_index("region")
@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from utils_staging import pin_inputs, release_inputs
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetCache:
+    """
+    Per-process LRU cache of opened xarray datasets.
+
+    Entries are keyed by the paths and modification times of the files they
+    were opened from, plus any extra hashable values that change the result
+    (dataset name, year, chunks...). A file rewritten on disk therefore gets a
+    new entry instead of serving stale data. Evicted entries are closed.
+    Files staged on scratch (``utils_staging``) are pinned while their
+    dataset is cached, since it reads them lazily for every slice.
+    Access is serialized so a prefetch thread can share the cache.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Maximum number of datasets kept open at the same time.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(files, extra):
+        return tuple((str(f), os.path.getmtime(f)) for f in files) + tuple(extra)
+
+    def get(self, files, opener, *extra):
+        """
+        Return the dataset opened from ``files``, opening it with ``opener`` on a miss.
+
+        Parameters
+        ----------
+        files : list of str
+            Files the dataset is opened from.
+        opener : callable
+            Zero-argument callable returning the opened dataset.
+        *extra : hashable
+            Additional values identifying the entry.
+        """
+        with self._lock:
+            key = self._key(files, extra)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                logger.info(f"Dataset cache hit for {[os.path.basename(f) for f in files]}")
+                return self._entries[key][0]
+
+            ds = opener()
+            pin_inputs(list(files))
+            self._entries[key] = (ds, list(files))
+            logger.info(f"Dataset cache miss for {[os.path.basename(f) for f in files]} ({len(self._entries)} open)")
+
+            self._evict()
+            return ds
+
+    def resize(self, max_entries):
+        """
+        Set the number of datasets kept open, closing the least recently used beyond it.
+
+        Callers running several chains at the same time size the cache so every
+        chain keeps its inputs open, e.g. ``jobs x`` the most dependencies of a variable.
+        """
+        with self._lock:
+            self.max_entries = max(int(max_entries), 1)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._release(evicted)
+
+    @staticmethod
+    def _release(entry):
+        ds, files = entry
+        ds.close()
+        release_inputs(files)
+
+    def close(self):
+        """Close every cached dataset and empty the cache."""
+        with self._lock:
+            for entry in self._entries.values():
+                self._release(entry)
+            if self._entries:
+                logger.info(f"Closed {len(self._entries)} cached dataset(s)")
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Yearly inputs opened by the derived pipeline when iterating months; shared by
+# the chains of a run, so the scripts resize it for the chains run at once
+YEARLY_DATASET_CACHE = DatasetCache()
@@ -1,21 +1,84 @@
 import warnings
+from contextlib import ExitStack
 from functools import partial
+from itertools import product
 import numpy as np
-import glob
 from pathlib import Path
 import xarray as xr
 import logging
 import os
+import sys
 from derived_variable_dependencies import dataset_variable_mapping
 from utils_fixes import fix_dataset
-from utils import load_output_path_from_row, require_single_row, is_valid_netcdf
+from utils import load_output_path_from_row, require_single_row, is_valid_netcdf, derived_condition_native
+from utils_chunking import choose_slice_period, plan_chunks
+from utils_dataset_cache import YEARLY_DATASET_CACHE
+from utils_inventory import get_inventory, period_bounds, parse_filename_period
+from utils_profiling import StageProfiler
+from utils_staging import release_inputs, stage_inputs, staged_output
+from utils_manifest import atomic_to_netcdf, code_version, completed_entry, describe_inputs, record_completion, stale_reason
+import dask
 import dask.array as da
 logger = logging.getLogger(__name__)
 
-
+# Floating-point precision of decoded inputs, kernel intermediates and outputs.
+# None keeps the dtype the inputs decode to; variables opt in to float32
+# through process_derived(precision=...).
+DEFAULT_PRECISION = os.getenv("C3S_PRECISION") or None
 
 warnings.filterwarnings("ignore")
 
+# Statistics computed by aggregate_statistics; count is the number of valid values
+AGGREGATIONS = ("mean", "min", "max", "sum", "count")
+
+
+def aggregate_statistics(ds, statistics, time_dim='time', agg_freq='1D', offset=None, closed=None, label=None):
+    """
+    Compute several temporal statistics of a dataset from a single resampling.
+
+    The time groups are built once and every statistic is reduced from them.
+    The results are lazy; computing them together (``dask.compute``) reads
+    each input time block once for all statistics.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset to aggregate.
+    statistics : list of str
+        Statistics from ``AGGREGATIONS``.
+    time_dim : str, optional
+        Time dimension.
+    agg_freq : str, optional
+        Target frequency (e.g. ``'1D'``, ``'MS'``).
+    offset : str, optional
+        Offset of the time bins (e.g. ``'1h'`` for accumulated fields valid at
+        the end of the step).
+    closed, label : {'left', 'right'}, optional
+        Closed side and label of the time bins, as in ``xarray.Dataset.resample``.
+
+    Returns
+    -------
+    dict
+        Aggregated dataset for each statistic.
+    """
+    invalid = [s for s in statistics if s not in AGGREGATIONS]
+    if invalid:
+        raise ValueError(f"Invalid aggregation function {invalid}. Choose from {AGGREGATIONS}.")
+
+    resample_kwargs = {k: v for k, v in {"offset": offset, "closed": closed, "label": label}.items() if v is not None}
+    resampler = ds.resample({time_dim: agg_freq}, **resample_kwargs)
+
+    aggregated = {}
+    for stat in statistics:
+        if stat == 'count':
+            aggregated[stat] = resampler.count(dim=time_dim)
+        else:
+            aggregated[stat] = getattr(resampler, stat)(dim=time_dim)
+    logger.info(f"Aggregated dataset using {list(statistics)} with frequency {agg_freq} {resample_kwargs or ''}")
+
+    return aggregated
+
+
 def resample_dataset(ds, time_dim='time', agg_freq='1D', agg_func='mean'):
     """
     Resample the dataset to daily values.
@@ -23,26 +86,40 @@ def resample_dataset(ds, time_dim='time', agg_freq='1D', agg_func='mean'):
     Parameters:
     - ds: xarray DataFrame containing the time series data.
     - agg_freq: The frequency for resampling (default is '1D' for daily).
-    - agg_func: The aggregation function to apply ('mean', 'sum', 'max', 'min').
+    - agg_func: The aggregation function to apply ('mean', 'sum', 'max', 'min', 'count').
 
     Returns:
     - A resampled xarray DataFrame.
     """
+    return aggregate_statistics(ds, [agg_func], time_dim=time_dim, agg_freq=agg_freq)[agg_func]
 
-    # Choose the aggregation function
-    if agg_func == 'mean':
-         resampled = ds.resample({time_dim: agg_freq}).mean(dim=time_dim)
-    elif agg_func == 'sum':
-        resampled = ds.resample({time_dim: agg_freq}).sum(dim=time_dim)
-    elif agg_func == 'max':
-        resampled = ds.resample({time_dim: agg_freq}).max(dim=time_dim)
-    elif agg_func == 'min':
-        resampled = ds.resample({time_dim: agg_freq}).min(dim=time_dim)
-    else:
-        raise ValueError("Invalid aggregation function. Choose 'mean', 'sum', 'max', or 'min'.")
-    logger.info(f"Resampled dataset using {agg_func} with frequency {agg_freq}")
 
-    return resampled
+def resampling_targets(var, resampling):
+    """
+    Map each statistic of a ``resampling`` configuration to its output variable.
+
+    ``resampling`` holds either ``agg_func`` (one statistic written as ``var``)
+    or ``statistics``, a dict ``{statistic: output variable}``. Without
+    resampling the output is ``{None: var}``.
+    """
+    if not resampling:
+        return {None: var}
+    if "statistics" in resampling:
+        return dict(resampling["statistics"])
+    return {resampling["agg_func"]: var}
+
+
+def _target_row(df_parameters, target_var, var_row):
+    """Return the parameters row of an output variable, sharing the layout of ``var_row``."""
+    if target_var == var_row["filename_variable"]:
+        return var_row
+    mask = (
+        (df_parameters['filename_variable'] == target_var) &
+        (df_parameters['product_type'] == var_row['product_type']) &
+        (df_parameters['interpolation'] == var_row['interpolation']) &
+        (df_parameters['temporal_resolution'] == var_row['temporal_resolution'])
+    )
+    return require_single_row(df_parameters, mask, f"{target_var}/{var_row['product_type']}/{var_row['temporal_resolution']}")
 
 
 def get_original_var(dataset_name, var_name):
@@ -78,13 +155,60 @@ def normalize_var_names(ds, dataset_name):
 
     return ds.rename(rename_dict)
 
+def cast_floating(ds, precision):
+    """
+    Cast the floating-point data variables of a dataset to ``precision``.
+
+    Coordinates and non-floating variables are left untouched. With dask
+    arrays the cast is lazy and applied chunk by chunk.
+    """
+    if precision is None:
+        return ds
+    dtype = np.dtype(precision)
+    casts = {
+        v: ds[v].astype(dtype)
+        for v in ds.data_vars
+        if np.issubdtype(ds[v].dtype, np.floating) and ds[v].dtype != dtype
+    }
+    return ds.assign(casts) if casts else ds
+
+def slice_months(month):
+    """Months of a slice: None for a whole year, else a list of "MM" strings."""
+    if month is None:
+        return None
+    return [month] if isinstance(month, str) else list(month)
+
+def _slice_label(year, month):
+    months = slice_months(month)
+    if months is None:
+        return str(year)
+    return f"{year}{months[0]}" + (f"-{year}{months[-1]}" if len(months) > 1 else "")
+
+def _slice_bounds(year, month):
+    """First and last day (YYYYMMDD integers) of a year or of a (list of) month(s)."""
+    months = slice_months(month)
+    if months is None:
+        return period_bounds(year)
+    return period_bounds(year, months[0])[0], period_bounds(year, months[-1])[1]
+
+def _time_slice(year, month):
+    months = slice_months(month)
+    if months is None:
+        return slice(str(year), str(year))
+    return slice(f"{year}-{months[0]}", f"{year}-{months[-1]}")
+
+def _has_monthly_files(files, year, month):
+    months = slice_months(month)
+    return any(f"{year}{m}" in os.path.basename(f) for f in files for m in months)
+
 def load_files(
     dataset_name,
     dependencies,
     df_parameters,
     condition_funcs,
     year,
-    month
+    month,
+    require_complete=False,
 ):
     """
     Resolve and load file paths for the required dependency variables.
@@ -92,6 +216,8 @@ def load_files(
     This function maps standardized dependency names to dataset-specific
     variable names, retrieves parameter rows, and resolves corresponding
     NetCDF file paths for a given year (and optionally month) based n the df conditon function in input.
+    ``month`` may also be a list of consecutive months (see ``slice_months``).
+    With ``require_complete`` the files must cover the whole period without gaps.
     """
     # Resolve original variable names
     original_vars = [
@@ -120,19 +246,25 @@ def load_files(
     for path in download_paths:
         logger.info(f"Resolving files in {path} for year {year}")
 
-        matches = glob.glob(f"{path}/*{year}*.nc")
-        matches = np.sort(matches).tolist()
+        # Files whose parsed period overlaps the year (or month): the
+        # month-specific file for monthly datasets, the yearly file otherwise
+        inventory = get_inventory(path)
+        matches = inventory.query(*_slice_bounds(year, month))
 
         if not matches:
             raise FileNotFoundError(
-                f"No files found in {path} for {year}"
+                f"No files found in {path} for {_slice_label(year, month)}"
+            )
+        if require_complete and not inventory.covers(*_slice_bounds(year, month)):
+            raise FileNotFoundError(
+                f"Files in {path} do not cover {_slice_label(year, month)} completely"
             )
 
         # Monthly filtering only when needed
         if month:
             monthly_matches = [
                 f for f in matches
-                if f"{year}{month}" in os.path.basename(f)
+                if _has_monthly_files([f], year, month)
             ]
 
             if monthly_matches:
@@ -161,7 +293,8 @@ def _preprocess_dataset(
     ds: xr.Dataset,
     dataset_name: str,
     year: int,
-    month: int | None = None,
+    month: str | list | None = None,
+    precision: str | None = None,
 ) -> xr.Dataset:
     """
     Standard preprocessing applied during dataset opening.
@@ -170,21 +303,21 @@ def _preprocess_dataset(
     - structure fixing
     - temporal selection
     - variable normalization
+    - cast of the decoded variables to ``precision``
     """
     logger.info(f"PREPROCESSING:{ds.encoding.get('source', 'unknown source')}")
     # Fix structure
     ds = fix_dataset(ds)
 
     # Time selection
-    time_sel = f"{year}-{month}" if month else str(year)
-    start = f"{time_sel}"
-    end = f"{time_sel}"
-
-    ds = ds.sel(time=slice(start, end))
+    ds = ds.sel(time=_time_slice(year, month))
 
     # Normalize variable names
     ds = normalize_var_names(ds, dataset_name)
 
+    # Packed int16 fields decode to float64 (scale_factor dtype)
+    ds = cast_floating(ds, precision)
+
     return ds
 
 
@@ -194,6 +327,7 @@ def load_and_fix_datasets(
     year,
     month=None,
     chunks=None,
+    precision=None,
 ):
     """
     Load NetCDF files into xarray datasets with preprocessing.
@@ -202,6 +336,11 @@ def load_and_fix_datasets(
     - structure fixes
     - temporal filtering
     - variable normalization
+
+    When a month is requested from yearly files, the whole year is opened and
+    preprocessed once through ``YEARLY_DATASET_CACHE`` and the month is sliced
+    from it, so the twelve monthly iterations reuse the same open dataset.
+    The returned slices do not own the file handles; the cache does.
     """
 
     if chunks is None:
@@ -212,18 +351,42 @@ def load_and_fix_datasets(
         dataset_name=dataset_name,
         year=year,
         month=month,
-        
+        precision=precision,
+    )
+    preprocess_year = partial(
+        _preprocess_dataset,
+        dataset_name=dataset_name,
+        year=year,
+        precision=precision,
     )
 
-    datasets = [
-        xr.open_mfdataset(
-            single_list_of_files,
-            chunks=chunks,
-            preprocess=preprocess,
-            combine="by_coords",
-        )
-        for single_list_of_files in lists_files
-    ]
+    datasets = []
+    for single_list_of_files in lists_files:
+        if month and not _has_monthly_files(single_list_of_files, year, month):
+            ds_year = YEARLY_DATASET_CACHE.get(
+                single_list_of_files,
+                partial(
+                    xr.open_mfdataset,
+                    single_list_of_files,
+                    chunks=chunks,
+                    preprocess=preprocess_year,
+                    combine="by_coords",
+                ),
+                dataset_name,
+                year,
+                tuple(sorted(chunks.items())),
+                precision,
+            )
+            ds = ds_year.sel(time=_time_slice(year, month))
+            ds.set_close(None)
+        else:
+            ds = xr.open_mfdataset(
+                single_list_of_files,
+                chunks=chunks,
+                preprocess=preprocess,
+                combine="by_coords",
+            )
+        datasets.append(ds)
 
     return datasets
 
@@ -278,12 +441,14 @@ def build_output_path(
     base_file = os.path.basename(files[0])
     var_file = base_file.replace(original_vars[0], var)
 
+    # Name the output after its own period: the template may be a yearly
+    # file for a monthly output, or another month of the slice
+    token = f"{year}{month}" if month else str(year)
+    period = parse_filename_period(var_file)
+    if period is not None and period[3] != token:
+        var_file = var_file.replace(f"_{period[3]}", f"_{token}")
+
     output_file = Path(dest_dir) / var_file
-    
-    if month and f"{year}{month}" not   in str(output_file):
-        output_file = Path(
-            str(output_file).replace(str(year), f"{year}{month}")
-        )
 
     return output_file, dest_dir
 def resolve_output_file(output_file):
@@ -294,6 +459,178 @@ def resolve_output_file(output_file):
             return True
 
     return False
+def plan_slices(
+    dataset_name,
+    dependencies,
+    df_parameters,
+    condition_func,
+    year,
+    months,
+    memory_limit,
+    expansion_factor=None,
+    period=None,
+):
+    """
+    Split the year of a derived variable into slices that fit the worker memory.
+
+    The working set of a year, quarter, month and week is projected from the
+    headers of the input files (``utils_chunking.choose_slice_period``) and
+    the largest period that fits ``memory_limit`` is used. Outputs keep
+    their monthly or yearly files whatever the period: a quarter computes
+    three monthly outputs together, and a week writes its month (or year)
+    chunk by chunk (``stream``) instead of computing it in memory.
+
+    Parameters
+    ----------
+    dataset_name, dependencies, df_parameters, condition_func, year
+        As in ``process_derived``.
+    months : list of str or None
+        Months of the monthly outputs, or None for one yearly output.
+    memory_limit : int
+        Worker memory in bytes.
+    expansion_factor : float, optional
+        Peak memory of the operation relative to its input bytes.
+    period : str, optional
+        Period to use instead of the projected one (key of ``SLICE_PERIODS``).
+
+    Returns
+    -------
+    list of tuple
+        ``(month, stream)`` arguments of successive ``process_derived`` calls.
+    """
+    if callable(condition_func):
+        condition_funcs = [condition_func] * len(dependencies)
+    else:
+        condition_funcs = condition_func
+
+    def complete(group):
+        try:
+            load_files(dataset_name, dependencies, df_parameters, condition_funcs, year, group, require_complete=True)
+        except FileNotFoundError:
+            return False
+        return True
+
+    if period is None:
+        try:
+            files, _ = load_files(dataset_name, dependencies, df_parameters, condition_funcs, year, months)
+            period = choose_slice_period(files, memory_limit, expansion_factor)
+        except FileNotFoundError as e:
+            logger.info(f"Cannot project the slice memory of {year}: {e}")
+            period = "month"
+
+    if months is None:
+        return [(None, period != "year")]
+
+    if period == "year":
+        groups = [months]
+    elif period == "quarter":
+        groups = [
+            [m for m in months if (int(m) - 1) // 3 == q]
+            for q in range(4)
+        ]
+    else:
+        groups = [[m] for m in months]
+
+    slices = []
+    for group in filter(None, groups):
+        if len(group) > 1 and not complete(group):
+            # Months without inputs fail on their own, as monthly slices
+            slices.extend((m, False) for m in group)
+        elif len(group) > 1:
+            slices.append((group, False))
+        else:
+            slices.append((group[0], period == "week"))
+    logger.info(f"Slices of {year} ({period}): {[m for m, _ in slices]}")
+    return slices
+
+def _passthrough(ds):
+    """Kernel of products read from a finer derived product: the values are already computed."""
+    return ds
+
+def _resolve_finer_product(var, dataset_name, df_parameters, finer_resolution, year, month):
+    """
+    Resolve the files of the native derived product of ``var`` at ``finer_resolution``.
+
+    Returns ``(files, original_vars)`` as ``load_files``, or None when the
+    product is not configured or does not cover the period completely.
+    """
+    try:
+        return load_files(
+            dataset_name,
+            [var],
+            df_parameters,
+            [derived_condition_native(finer_resolution)],
+            year,
+            month,
+            require_complete=True,
+        )
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        logger.info(f"Not using the {finer_resolution} {var} product: {e}")
+        return None
+
+def missing_inputs(dataset_name, dependencies, df_parameters, condition_funcs, year, month):
+    """
+    Return why each dependency cannot be read for a slice, or [] when all are present.
+
+    Unlike ``load_files``, every dependency is checked (not only up to the
+    first missing one) and each must cover the period completely.
+    """
+    missing = []
+    for dep, cond_func in zip(dependencies, condition_funcs):
+        try:
+            load_files(dataset_name, [dep], df_parameters, [cond_func], year, month, require_complete=True)
+        except (FileNotFoundError, KeyError) as e:
+            missing.append(f"{dep}: {e}")
+    return missing
+
+def slice_status(
+    var,
+    dataset_name,
+    dependencies,
+    df_parameters,
+    var_row,
+    year,
+    function,
+    condition_func,
+    month=None,
+    resampling=None,
+    precision=None,
+    finer_resolution=None,
+    rebuild_stale=False,
+):
+    """
+    Check a slice of ``process_derived`` without computing it.
+
+    Parameters are those of ``process_derived``.
+
+    Returns
+    -------
+    tuple
+        ``(pending, missing)``: the output files to compute (missing, or
+        stale with ``rebuild_stale``) and the unavailable inputs. A slice is
+        runnable when ``pending`` is not empty and ``missing`` is.
+    """
+    if callable(condition_func):
+        condition_funcs = [condition_func] * len(dependencies)
+    else:
+        condition_funcs = condition_func
+
+    missing = missing_inputs(dataset_name, dependencies, df_parameters, condition_funcs, year, month)
+    if missing and not (
+        finer_resolution
+        and _resolve_finer_product(var, dataset_name, df_parameters, finer_resolution, year, month) is not None
+    ):
+        return [], missing
+
+    try:
+        outputs = _resolve_slice(
+            var, dataset_name, dependencies, df_parameters, var_row, year, month,
+            function, condition_funcs, resampling, precision, finer_resolution, rebuild_stale,
+        )[5]
+    except FileNotFoundError as e:
+        return [], [str(e)]
+    return [output_file for _, output_file in outputs.values()], []
+
 def process_derived(
     var,
     dataset_name,
@@ -306,6 +643,15 @@ def process_derived(
     month=None,
     parallel=False,
     resampling=None,
+    memory_limit=None,
+    threads=1,
+    expansion_factor=None,
+    precision=None,
+    finer_resolution=None,
+    rebuild_stale=False,
+    prefetcher=None,
+    prefetch_month=None,
+    stream=False,
 ):
     """
     Execute a full derived climate variable computation pipeline.
@@ -316,7 +662,10 @@ def process_derived(
     - Normalizes variable names to standard dependency names
     - Validates and orders inputs according to dependency specification
     - Computes the derived variable using the provided function
-    - Saves the result to disk if not already computed
+    - Saves the result to disk if not already computed, through a temporary
+      file renamed atomically, and records it in the completion manifest
+      of the destination directory (``utils_manifest``)
+    - Profiles each stage (see ``utils_profiling.StageProfiler``)
 
     Parameters
     ----------
@@ -336,96 +685,354 @@ def process_derived(
         Function that computes the derived variable from input datasets.
     condition_func : callable
         Function used to filter parameter rows for dependency resolution.
-    month : int, optional
-        If provided, restricts processing to a specific month.
+    month : str or list of str, optional
+        If provided, restricts processing to a specific month ("MM"), or to
+        consecutive months computed together and written as one monthly
+        output each (see ``plan_slices``).
     parallel : bool, optional
         Reserved for future parallel execution support.
     resampling : dict, optional
-        If provided, resample the time dimension of the result (e.g., {"time": "1ME"} for monthly mean).
+        If provided, resample the time dimension of the result with
+        ``agg_freq`` and either ``agg_func`` (e.g. ``{"agg_freq": "1D",
+        "agg_func": "mean"}``) or ``statistics``, a dict mapping each statistic
+        to the variable it is written as (e.g. ``{"mean": "t2m", "max": "t2mx",
+        "min": "t2mn"}``). Optional ``offset``, ``closed`` and ``label`` shift
+        the time bins (accumulated fields). Every statistic is computed from a
+        single pass over the result and written to its own variable directory.
+    memory_limit : int, optional
+        Worker memory in bytes. When provided, input chunks are planned from
+        the file headers with ``plan_chunks`` instead of the default chunks.
+    threads : int, optional
+        Threads per worker, used to split ``memory_limit`` between chunks.
+    expansion_factor : float, optional
+        Peak memory of ``function`` relative to its input bytes.
+    precision : str, optional
+        Floating-point dtype of inputs, intermediates and output
+        (e.g. ``"float32"`` to halve the memory of a variable). Defaults to
+        ``DEFAULT_PRECISION`` (``C3S_PRECISION`` environment variable); when
+        neither is set nothing is cast and the inputs keep their dtype.
+    finer_resolution : str, optional
+        Temporal resolution (e.g. ``"hourly"``) of a native derived product of
+        ``var`` to read instead of the dependencies when it already covers the
+        period. It is passed through ``resampling`` unchanged by ``function``.
+        Falls back to ``dependencies`` when the finer product is missing.
+    rebuild_stale : bool, optional
+        Recompute completed outputs whose input files (paths, sizes, mtimes)
+        or operation code/configuration differ from those recorded in the
+        completion manifest. By default completed outputs are always skipped.
+    prefetcher : utils_prefetch.Prefetcher, optional
+        Inputs read ahead in the background (see ``_prefetch_slice``). The
+        inputs of this slice are taken from it when they were prefetched, and
+        with ``prefetch_month`` the inputs of that month start loading while
+        this one computes. Its buffer lives in the worker memory: pass a
+        ``memory_limit`` that leaves room for it.
+    prefetch_month : str or list of str, optional
+        Month(s) (same year) to prefetch, usually the next slice of the loop.
+    stream : bool, optional
+        Write the outputs chunk by chunk as they are computed instead of
+        computing the whole slice in memory first, for slices whose working
+        set exceeds the worker memory.
 
     Returns
     -------
     bool
         True if computation was completed or skipped due to existing valid output.
     """
+    dependencies_requested, function_requested = dependencies, function
+
     # Support per-dependency condition functions (list) or single (broadcast)
     if callable(condition_func):
         condition_funcs = [condition_func] * len(dependencies)
     else:
         condition_funcs = condition_func
 
-    # Load files
-    files, original_vars = load_files(
-        dataset_name,
-        dependencies,
-        df_parameters,
-        condition_funcs,
-        year,
-        month
-    )
+    profile_month = month if month is None or isinstance(month, str) else f"{month[0]}-{month[-1]}"
+    with StageProfiler(dataset=dataset_name, var=var, year=year, month=profile_month) as profiler:
+        with profiler.stage("resolve"):
+            files, dependencies, function, input_description, code, outputs, adopted = _resolve_slice(
+                var, dataset_name, dependencies, df_parameters, var_row, year, month,
+                function, condition_funcs, resampling, precision, finer_resolution, rebuild_stale,
+            )
+            for output_file in adopted:
+                # Written before completions were recorded
+                record_completion(output_file, input_description, code=code)
 
-    # ------------------------------------------------------------
-    # Output (single call)
-    # ------------------------------------------------------------
-    output_file, dest_dir = build_output_path(
-        var,
-        dataset_name,
-        var_row,
-        files,
-        original_vars,
-        year,
-        month
-    )
+        if not outputs:
+            profiler.status = "skipped"
+            return True
 
-    logging.info(f"output_file: {output_file}")
+        prefetched = None
+        if prefetcher is not None:
+            with profiler.stage("prefetch_wait"):
+                prefetched = prefetcher.take((var, var_row["temporal_resolution"], _slice_label(year, month)))
+            if prefetch_month:
+                # Read the next month while this one computes and writes
+                prefetcher.submit(
+                    (var, var_row["temporal_resolution"], _slice_label(year, prefetch_month)),
+                    partial(
+                        _prefetch_slice,
+                        (var, dataset_name, dependencies_requested, df_parameters, var_row, year, prefetch_month,
+                         function_requested, condition_funcs, resampling, precision, finer_resolution, rebuild_stale),
+                        memory_limit, threads, expansion_factor,
+                    ),
+                )
 
-    if resolve_output_file(output_file):
-        logging.info(f"{output_file} already exists and is valid, skipping")
-        return True
+        return _compute_and_write(
+            profiler, var, dataset_name, dependencies, files, input_description, code, outputs, year, month,
+            function, resampling, memory_limit, threads, expansion_factor, precision, prefetched, stream,
+        )
 
-    logging.info(f"Calculating {var} from {files}")
 
-    # Load + fix datasets
-    datasets = load_and_fix_datasets(
-        files,
-        dataset_name,
-        year,
-        month
-    )
+def _resolve_slice(
+    var, dataset_name, dependencies, df_parameters, var_row, year, month,
+    function, condition_funcs, resampling, precision, finer_resolution, rebuild_stale,
+):
+    """
+    Resolve the inputs and the pending outputs of a (variable, year, month) slice.
+
+    Returns ``(files, dependencies, function, input_description, code, outputs, adopted)``;
+    ``dependencies`` and ``function`` change when a finer product is reused.
+    ``outputs`` maps each ``(statistic, month)`` to ``(variable, output file)``
+    for the outputs that are missing (or stale with ``rebuild_stale``); a
+    slice of several months has one monthly output per month. ``adopted``
+    lists the valid outputs written before completions were recorded; they
+    are not pending, and ``process_derived`` records them. Nothing is written
+    here, so planning and dry runs leave the manifests untouched.
+    """
+    finer = None
+    if finer_resolution:
+        finer = _resolve_finer_product(var, dataset_name, df_parameters, finer_resolution, year, month)
+
+    if finer is not None:
+        files, original_vars = finer
+        dependencies = [var]
+        function = _passthrough
+    else:
+        # Load files
+        files, original_vars = load_files(
+            dataset_name,
+            dependencies,
+            df_parameters,
+            condition_funcs,
+            year,
+            month
+        )
 
-    # Validate + prepare inputs
-    inputs = validate_and_build_inputs(
-        datasets,
-        dependencies
+    # ------------------------------------------------------------
+    # Outputs: one per statistic and month, each statistic in its own
+    # variable directory
+    # ------------------------------------------------------------
+    targets = resampling_targets(var, resampling)
+    input_description = describe_inputs(files)
+    code = code_version(
+        function, modules=[sys.modules[__name__]], precision=precision or DEFAULT_PRECISION, resampling=resampling
     )
-    #inputs = [ds.persist() for ds in inputs]
-
-    # Compute
-    logger.info(f"Launching function: {function.__name__} for variable {var}")
-    result = function(*inputs)
-    # Resample if needed
-    if resampling:
-        result = resample_dataset(result, time_dim="time", agg_freq=resampling["agg_freq"], agg_func=resampling["agg_func"])
-    result = result.compute()
-
-    # Save
-    logging.info(f"Saving calculated {var} to {dest_dir}")
-
-    n_tasks = 0
-
-    for v in result.data_vars:
-        arr = result[v].data
+    outputs, adopted = {}, []
+    for (stat, target_var), output_month in product(targets.items(), slice_months(month) or [None]):
+        output_file, dest_dir = build_output_path(
+            target_var,
+            dataset_name,
+            _target_row(df_parameters, target_var, var_row),
+            files,
+            original_vars,
+            year,
+            output_month
+        )
+        logging.info(f"output_file: {output_file}")
+        entry = completed_entry(output_file)
+        if entry:
+            reason = stale_reason(entry, input_description, code) if rebuild_stale else None
+            if reason is None:
+                logging.info(f"{output_file} is recorded as complete, skipping")
+                continue
+            logging.info(f"Rebuilding stale {output_file}: {reason}")
+        elif resolve_output_file(output_file):
+            adopted.append(output_file)
+            logging.info(f"{output_file} already exists and is valid, skipping")
+            continue
+        outputs[stat, output_month] = (target_var, output_file)
+
+    return files, dependencies, function, input_description, code, outputs, adopted
+
+
+def _distributed_client():
+    """The dask distributed client of this process, or None."""
+    try:
+        from distributed import get_client
+        return get_client()
+    except (ImportError, ValueError):
+        return None
+
+
+def _prefetch_slice(resolve_args, memory_limit, threads, expansion_factor, max_bytes):
+    """
+    Read the inputs of a slice ahead for ``Prefetcher``.
 
-        if isinstance(arr, da.Array):
-            n_tasks += len(arr.__dask_graph__())
+    The input files are staged to scratch (``utils_staging``, when enabled)
+    and, with a distributed client, the inputs are opened lazily and
+    persisted on the workers: they are read there while the current slice
+    computes, without passing through this process. ``max_bytes`` bounds the
+    decoded size persisted, a part of the worker memory set aside by the caller.
 
-    logging.info(f"Dask graph size: {n_tasks:,} tasks")
-    logging.info(f"Output chunks: {result.chunks}")
-    result.to_netcdf(output_file)
+    Returns
+    -------
+    tuple or None
+        ``(files, datasets)``, with ``datasets`` None when they were not
+        persisted (no client, or larger than ``max_bytes``), or None when the
+        slice has nothing to compute.
+    """
+    files, _, _, _, _, outputs, _ = _resolve_slice(*resolve_args)
+    if not outputs:
+        return None
+
+    dataset_name, year, month, precision = resolve_args[1], resolve_args[5], resolve_args[6], resolve_args[10]
+    read_files = stage_inputs(files)
+    client = _distributed_client()
+    if client is None:
+        return files, None
+
+    chunks = plan_chunks(read_files, memory_limit, threads, expansion_factor) if memory_limit else None
+    datasets = load_and_fix_datasets(read_files, dataset_name, year, month, chunks=chunks, precision=precision or DEFAULT_PRECISION)
+    nbytes = sum(ds.nbytes for ds in datasets)
+    if nbytes > max_bytes:
+        logger.info(f"Not persisting {_slice_label(year, month)}: {nbytes / 1024**2:.0f} MiB exceeds the {max_bytes / 1024**2:.0f} MiB buffer")
+        return files, None
+
+    from distributed import wait
+    datasets = client.persist(datasets)
+    wait(datasets)
+    return files, datasets
+
+
+def _compute_and_write(
+    profiler, var, dataset_name, dependencies, files, input_description, code, outputs, year, month,
+    function, resampling, memory_limit, threads, expansion_factor, precision, prefetched=None, stream=False,
+):
+    """Open the inputs, compute ``function`` and write the pending ``outputs`` of ``process_derived``."""
+    logging.info(f"Calculating {[os.path.basename(f) for _, f in outputs.values()]} from {files}")
+
+    if precision is None:
+        precision = DEFAULT_PRECISION
+    logger.info(f"Compute precision for {var}: {precision or 'dtype of the inputs'}")
+
+    if prefetched is not None and prefetched[0] != files:
+        prefetched = None
+    with profiler.stage("stage_in"):
+        # Node-local copies when C3S_SCRATCH_DIR is set (already there when prefetched)
+        read_files = stage_inputs(files, pin=True)
+
+    # The staged files stay on scratch until the slice is written
+    try:
+        with profiler.stage("open"):
+            chunks = None
+            if memory_limit:
+                chunks = plan_chunks(read_files, memory_limit, threads, expansion_factor)
+
+            if prefetched is not None and prefetched[1] is not None:
+                # Inputs persisted on the workers, with the same planned chunks
+                datasets = prefetched[1]
+            else:
+                # Load + fix datasets
+                datasets = load_and_fix_datasets(
+                    read_files,
+                    dataset_name,
+                    year,
+                    month,
+                    chunks=chunks,
+                    precision=precision,
+                )
 
-    # Cleanup
-    for ds in datasets:
-        ds.close()
-    result.close()
+            # Validate + prepare inputs
+            inputs = validate_and_build_inputs(
+                datasets,
+                dependencies
+            )
+        # Input files on disk, and the decoded size of the selection (the files
+        # may hold more than the month)
+        profiler.add(
+            input_file_bytes=sum(os.path.getsize(f) for group in read_files for f in group),
+            decoded_bytes=sum(ds.nbytes for ds in inputs),
+        )
+        #inputs = [ds.persist() for ds in inputs]
+
+        # Build the (lazy) computation
+        with profiler.stage("build"):
+            logger.info(f"Launching function: {function.__name__} for variable {var}")
+            result = function(*inputs)
+            result = cast_floating(result, precision)
+            results = {}
+            for output_month in dict.fromkeys(m for _, m in outputs):
+                # Each month of a multi-month slice is aggregated on its own, as
+                # a monthly slice would be; the months share the input reads
+                part = result
+                if output_month is not None and len(slice_months(month)) > 1:
+                    part = result.sel(time=_time_slice(year, output_month))
+                statistics = [stat for stat, m in outputs if m == output_month]
+                # Aggregate every pending statistic from the same time groups
+                if resampling:
+                    aggregated = aggregate_statistics(
+                        part,
+                        statistics,
+                        time_dim="time",
+                        agg_freq=resampling["agg_freq"],
+                        offset=resampling.get("offset"),
+                        closed=resampling.get("closed"),
+                        label=resampling.get("label"),
+                    )
+                else:
+                    aggregated = {None: part}
+                results.update(((stat, output_month), ds) for stat, ds in aggregated.items())
+
+        results = {
+            key: ds.rename({list(ds.data_vars)[0]: outputs[key][0]})
+            for key, ds in results.items()
+        }
+
+        n_tasks = 0
+        for ds in results.values():
+            for v in ds.data_vars:
+                arr = ds[v].data
+
+                if isinstance(arr, da.Array):
+                    n_tasks += len(arr.__dask_graph__())
+        logging.info(f"Dask graph size: {n_tasks:,} tasks")
+        profiler.add(dask_tasks=n_tasks)
+
+        with profiler.performance_report():
+            if stream:
+                # The slice does not fit in memory: every output is written block
+                # by block as its chunks are computed, in a single pass over the inputs
+                with profiler.stage("write"), ExitStack() as stack:
+                    writes = []
+                    for key, ds_out in results.items():
+                        target_var, output_file = outputs[key]
+                        logging.info(f"Streaming calculated {target_var} to {output_file.parent}")
+                        tmp_file = stack.enter_context(staged_output(output_file))
+                        writes.append(ds_out.to_netcdf(tmp_file, compute=False))
+                    dask.compute(*writes)
+                computed = {}
+            else:
+                # Single compute so the inputs are read once for all statistics
+                with profiler.stage("compute"):
+                    computed = dict(zip(results, dask.compute(*results.values())))
+
+            with profiler.stage("write"):
+                for key, ds_out in computed.items():
+                    target_var, output_file = outputs[key]
+                    logging.info(f"Saving calculated {target_var} to {output_file.parent}")
+                    logging.info(f"Output chunks: {ds_out.chunks}")
+                    # Temporary file + atomic rename: a killed job never leaves a partial output
+                    atomic_to_netcdf(ds_out, output_file)
+                    ds_out.close()
+                for target_var, output_file in outputs.values():
+                    record_completion(output_file, input_description, code=code)
+                    profiler.add(bytes_written=os.path.getsize(output_file))
+
+        # Cleanup
+        for ds in datasets:
+            ds.close()
+        result.close()
 
-    return True
+        return True
+    finally:
+        release_inputs(read_files)
@@ -0,0 +1,119 @@
+"""
+Dependency-aware scheduling of derived computations.
+
+Work is grouped in chains (e.g. the slices of one variable, temporal
+resolution and year, computed in order). Before anything is computed, every
+chain is planned from the file inventories: the slices whose outputs are
+missing (or stale) and whose inputs are all present are runnable, the others
+are blocked with the inputs they miss. The runnable chains are computed in
+parallel, then the chains with blocked slices are planned again, since the
+outputs just written may be the inputs they were missing (e.g. ``mrt`` for
+``utci``). Scheduling stops when a wave has nothing left to run; the slices
+still blocked and the chains that failed are reported instead of aborting
+the whole run.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def run_schedule(chains, plan, run, jobs=1, waits_for=None, after_wave=None, dry_run=False):
+    """
+    Run the runnable slices of every chain, in waves, and report the rest.
+
+    Parameters
+    ----------
+    chains : list of hashable
+        Chains of slices, in their preferred order.
+    plan : callable
+        ``plan(chain)`` returns ``(runnable, blocked)``: the list of slices to
+        compute and a dict mapping each blocked slice to its missing inputs.
+    run : callable
+        ``run(chain, runnable)`` computes the slices of a chain.
+    jobs : int, optional
+        Chains computed at the same time.
+    waits_for : callable, optional
+        ``waits_for(chain)`` returns chains whose outputs it prefers to read
+        (e.g. a finer product); it is deferred while they are runnable.
+    after_wave : callable, optional
+        Called after every wave (e.g. to close cached datasets).
+    dry_run : bool, optional
+        Only log the runnable and blocked slices of the first plan.
+
+    Returns
+    -------
+    dict
+        ``completed``: list of ``(chain, slice)`` computed; ``blocked``: dict
+        ``(chain, slice) -> missing inputs``; ``failed``: dict ``chain -> error``.
+    """
+    completed, failed, blocked = [], {}, {}
+    attempted = set()
+    pending = list(chains)
+    wave = 0
+
+    while pending:
+        plans = {}
+        for chain in pending:
+            runnable, chain_blocked = plan(chain)
+            plans[chain] = ([s for s in runnable if (chain, s) not in attempted], chain_blocked)
+        # Blocked slices of the chains planned again are replaced by the new plan
+        blocked = {key: missing for key, missing in blocked.items() if key[0] not in plans}
+        for chain in pending:
+            blocked.update(((chain, s), missing) for s, missing in plans[chain][1].items())
+
+        candidates = {chain for chain in pending if plans[chain][0]}
+        to_run = [
+            chain for chain in pending
+            if chain in candidates and not candidates.intersection(waits_for(chain) if waits_for else ())
+        ]
+        if not to_run:
+            break
+        if dry_run:
+            for chain in pending:
+                if plans[chain][0]:
+                    logger.info(f"Runnable {chain}: {plans[chain][0]}")
+            break
+
+        wave += 1
+        logger.info(
+            f"Wave {wave}: {sum(len(plans[c][0]) for c in to_run)} runnable slice(s) in {len(to_run)} chain(s), "
+            f"{len(blocked)} blocked"
+        )
+
+        def run_chain(chain):
+            run(chain, plans[chain][0])
+            return chain
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix="derived") as executor:
+            futures = {executor.submit(run_chain, chain): chain for chain in to_run}
+            for future, chain in futures.items():
+                attempted.update((chain, s) for s in plans[chain][0])
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.exception(f"Chain {chain} failed: {e}")
+                    failed[chain] = e
+                else:
+                    completed.extend((chain, s) for s in plans[chain][0])
+
+        if after_wave is not None:
+            after_wave()
+
+        # Plan again the chains that may have been unblocked or deferred
+        pending = [
+            chain for chain in pending
+            if chain not in failed and (plans[chain][1] or chain not in to_run)
+        ]
+
+    report_schedule(completed, blocked, failed)
+    return {"completed": completed, "blocked": blocked, "failed": failed}
+
+
+def report_schedule(completed, blocked, failed):
+    """Log the computed, blocked and failed work of ``run_schedule``."""
+    logger.info(f"Schedule summary: {len(completed)} slice(s) computed, {len(blocked)} blocked, {len(failed)} chain(s) failed")
+    for (chain, s), missing in blocked.items():
+        logger.warning(f"Blocked {chain} {s if s is not None else ''}: missing {'; '.join(missing)}")
+    for chain, error in failed.items():
+        logger.error(f"Failed {chain}: {error}")
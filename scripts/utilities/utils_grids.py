@@ -0,0 +1,161 @@
+"""
+Registry of projected source grids and their cached geometry.
+
+Sources on projected grids (the EASE2/LAEA sea-ice grids, the CERRA Lambert
+conformal grid) are regridded from 2-D cell centres and, for the conservative
+methods, cell corners. Instead of estimating the corners from the centres of
+every file, the geometry is computed once per grid from its CRS: the
+projected ``x``/``y`` coordinates (read from the file, or recovered from its
+2-D latitudes and longitudes when it has none) are transformed to 2-D
+centres, corners and cell areas with vectorized ``pyproj`` transforms. The
+result is stored as a small NetCDF file in ``C3S_GRID_REGISTRY_DIR`` keyed by
+a digest of the CRS and the coordinates, and shared by the interpolation
+(``utils_regrid.CachedInterpolator``) and the validation code.
+"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from utils_staging import staged_output
+
+logger = logging.getLogger(__name__)
+
+GRID_REGISTRY_DIR = os.getenv(
+    "C3S_GRID_REGISTRY_DIR", str(Path.home() / ".cache" / "c3s-atlas" / "grids")
+)
+
+# Projected source grids: CRS and the names of their projected coordinates
+PROJECTED_GRIDS = {
+    # EASE2 grids of the sea-ice concentration CDR/ICDR (xc/yc in km)
+    "ease2-nh": {"crs": "+proj=laea +lat_0=90 +lon_0=0 +datum=WGS84 +ellps=WGS84", "x": ("x", "xc"), "y": ("y", "yc")},
+    "ease2-sh": {"crs": "+proj=laea +lat_0=-90 +lon_0=0 +datum=WGS84 +ellps=WGS84", "x": ("x", "xc"), "y": ("y", "yc")},
+    # CERRA 5.5 km Lambert conformal grid; the files only carry 2-D lat/lon
+    "cerra-lcc": {"crs": "+proj=lcc +lat_0=50 +lon_0=8 +lat_1=50 +lat_2=50 +R=6371229", "x": ("x",), "y": ("y",)},
+}
+
+# (grid name, digest) -> geometry dataset
+_GEOMETRIES = {}
+
+
+def _edges(centres):
+    """Cell edges of a regular projected axis."""
+    step = centres[1] - centres[0]
+    return np.concatenate([centres - step / 2, [centres[-1] + step / 2]])
+
+
+def _projected_axis(ds, names):
+    for name in names:
+        if name in ds.coords or name in ds.variables:
+            values = ds[name].values.astype("float64")
+            return values * 1000 if ds[name].attrs.get("units") == "km" else values
+    return None
+
+
+def _recover_axes(ds, transformer):
+    """
+    Projected ``x``/``y`` of a regular grid from its 2-D latitudes and longitudes.
+
+    The first row and column are projected and fitted with a regular spacing,
+    rounded to the millimetre so every file of the grid gives the same axes.
+    """
+    lat = next(ds[name].values for name in ("latitude", "lat") if name in ds.variables)
+    lon = next(ds[name].values for name in ("longitude", "lon") if name in ds.variables)
+    x, _ = transformer.transform(lon[0, :], lat[0, :], direction="INVERSE")
+    _, y = transformer.transform(lon[:, 0], lat[:, 0], direction="INVERSE")
+    return _regular(x), _regular(y)
+
+
+def _regular(projected):
+    step = np.median(np.diff(projected))
+    fitted = np.round(projected[0] + step * np.arange(projected.size), 3)
+    if np.abs(fitted - projected).max() > 0.01 * abs(step):
+        raise ValueError("The 2-D coordinates are not a regular grid of the registered projection")
+    return fitted
+
+
+def projected_geometry(x, y, crs):
+    """
+    Geometry of a regular projected grid.
+
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        Projected cell centres, in metres.
+    crs : str
+        PROJ definition of the projection.
+
+    Returns
+    -------
+    xarray.Dataset
+        ``lat``/``lon`` centres ``(y, x)``, ``lat_b``/``lon_b`` corners
+        ``(y_b, x_b)`` and ``cell_area`` in m2 ``(y, x)``.
+    """
+    from pyproj import Proj, Transformer
+
+    transformer = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+    lon, lat = transformer.transform(*np.meshgrid(x, y))
+    lon_b, lat_b = transformer.transform(*np.meshgrid(_edges(x), _edges(y)))
+    # True cell areas: projected area divided by the areal scale factor
+    areal_scale = Proj(crs).get_factors(lon, lat).areal_scale
+    cell_area = np.abs((x[1] - x[0]) * (y[1] - y[0])) / np.asarray(areal_scale)
+    return xr.Dataset(
+        {
+            "lat": (("y", "x"), lat),
+            "lon": (("y", "x"), lon),
+            "lat_b": (("y_b", "x_b"), lat_b),
+            "lon_b": (("y_b", "x_b"), lon_b),
+            "cell_area": (("y", "x"), cell_area, {"units": "m2"}),
+        },
+        coords={"x": ("x", x, {"units": "m"}), "y": ("y", y, {"units": "m"})},
+        attrs={"crs": crs},
+    )
+
+
+def grid_geometry(ds, grid, registry_dir=None):
+    """
+    Return the geometry of the projected grid of ``ds``, computing it at most once.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        A file on the grid; its projected coordinates (or 2-D latitudes and
+        longitudes) identify the grid.
+    grid : str
+        Name of the grid in ``PROJECTED_GRIDS``.
+    registry_dir : str, optional
+        Directory of the stored geometries, defaulting to ``C3S_GRID_REGISTRY_DIR``.
+
+    Returns
+    -------
+    xarray.Dataset
+        See ``projected_geometry``.
+    """
+    from pyproj import Transformer
+
+    spec = PROJECTED_GRIDS[grid]
+    x, y = _projected_axis(ds, spec["x"]), _projected_axis(ds, spec["y"])
+    if x is None or y is None:
+        x, y = _recover_axes(ds, Transformer.from_crs(spec["crs"], "EPSG:4326", always_xy=True))
+
+    digest = hashlib.sha1(f"{spec['crs']}{x.size}{y.size}".encode() + x.tobytes() + y.tobytes()).hexdigest()[:16]
+    key = (grid, digest)
+    if key in _GEOMETRIES:
+        return _GEOMETRIES[key]
+
+    path = Path(registry_dir or GRID_REGISTRY_DIR) / f"{grid}_{digest}.nc"
+    if path.exists():
+        with xr.open_dataset(path) as stored:
+            geometry = stored.load()
+    else:
+        geometry = projected_geometry(x, y, spec["crs"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        encoding = {name: {"zlib": True, "shuffle": True, "complevel": 4} for name in geometry.data_vars}
+        with staged_output(path) as tmp:
+            geometry.to_netcdf(tmp, encoding=encoding)
+        logger.info(f"Stored the geometry of grid {grid} ({y.size} x {x.size}) in {path}")
+    _GEOMETRIES[key] = geometry
+    return geometry
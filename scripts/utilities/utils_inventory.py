@@ -0,0 +1,258 @@
+import bisect
+import calendar
+import json
+import logging
+import os
+import re
+from datetime import date, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Date token of "{var}_{dataset}_{date}[_suffix].nc": YYYY, YYYYMM or YYYYMMDD,
+# optionally followed by "-{date}" for files spanning a range.
+FILE_DATE_PATTERN = re.compile(r"_(\d{4}|\d{6}|\d{8})(?:-(\d{4}|\d{6}|\d{8}))?(?=[_.])")
+
+FREQUENCY_BY_LENGTH = {4: "yearly", 6: "monthly", 8: "daily"}
+
+INVENTORY_VERSION = 1
+
+# directory -> FileInventory, revalidated against the directory mtime
+_INVENTORIES = {}
+
+
+def _token_bounds(token):
+    """Return the first and last day (YYYYMMDD integers) covered by a date token."""
+    year = int(token[:4])
+    if len(token) == 4:
+        return year * 10000 + 101, year * 10000 + 1231
+    month = int(token[4:6])
+    if len(token) == 6:
+        last_day = calendar.monthrange(year, month)[1]
+        return year * 10000 + month * 100 + 1, year * 10000 + month * 100 + last_day
+    return int(token), int(token)
+
+
+def parse_filename_period(filename):
+    """
+    Parse the period covered by a file from its name.
+
+    Parameters
+    ----------
+    filename : str
+        Base name of the file (e.g. ``u10_reanalysis-era5-single-levels_2023.nc``).
+
+    Returns
+    -------
+    tuple or None
+        ``(start, end, frequency, token)`` with ``start``/``end`` as YYYYMMDD
+        integers, or None if the name has no date token.
+    """
+    matches = list(FILE_DATE_PATTERN.finditer(filename))
+    if not matches:
+        return None
+
+    match = matches[-1]
+    token, end_token = match.group(1), match.group(2)
+    start, end = _token_bounds(token)
+    if end_token:
+        end = _token_bounds(end_token)[1]
+    return start, end, FREQUENCY_BY_LENGTH[len(token)], token
+
+
+def _next_day(day):
+    d = date(day // 10000, day // 100 % 100, day % 100) + timedelta(days=1)
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def period_bounds(year, month=None):
+    """Return the first and last day (YYYYMMDD integers) of a year or month."""
+    if month:
+        return _token_bounds(f"{int(year):04d}{int(month):02d}")
+    return _token_bounds(f"{int(year):04d}")
+
+
+def _sidecar_path(directory):
+    # Stored next to the directory so writing it does not change the
+    # directory mtime used to invalidate it.
+    directory = Path(directory)
+    return directory.parent / f".{directory.name}.inventory.json"
+
+
+class FileInventory:
+    """
+    Index of the NetCDF files of a variable directory.
+
+    Each file name is parsed once into the period it covers. Entries are
+    sorted by start date so the files overlapping a period are found with a
+    binary search.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory holding the files.
+    mtime : float or None
+        Modification time of the directory when it was scanned.
+    entries : list of tuple
+        ``(filename, start, end, frequency, token)`` sorted by ``start``.
+    undated : list of str
+        NetCDF files without a date token in their name.
+    """
+
+    def __init__(self, directory, mtime, entries, undated=()):
+        self.directory = Path(directory)
+        self.mtime = mtime
+        self.entries = sorted(entries, key=lambda e: (e[1], e[2], e[0]))
+        self.undated = sorted(undated)
+        self._starts = [e[1] for e in self.entries]
+        # Running maximum of end dates, to stop the backwards search early
+        self._max_ends = []
+        max_end = 0
+        for e in self.entries:
+            max_end = max(max_end, e[2])
+            self._max_ends.append(max_end)
+
+    @classmethod
+    def scan(cls, directory):
+        """Build the inventory by listing the directory."""
+        directory = Path(directory)
+        if not directory.is_dir():
+            return cls(directory, None, [])
+
+        mtime = directory.stat().st_mtime
+        entries, undated = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".nc"):
+                    continue
+                period = parse_filename_period(entry.name)
+                if period is None:
+                    undated.append(entry.name)
+                else:
+                    entries.append((entry.name, *period))
+        logger.info(f"Scanned {directory}: {len(entries)} dated and {len(undated)} undated files")
+        return cls(directory, mtime, entries, undated)
+
+    @classmethod
+    def from_sidecar(cls, directory):
+        """Load the inventory stored next to the directory, or None if missing or invalid."""
+        sidecar = _sidecar_path(directory)
+        try:
+            with open(sidecar) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if content.get("version") != INVENTORY_VERSION:
+            return None
+        return cls(
+            directory,
+            content["mtime"],
+            [tuple(e) for e in content["entries"]],
+            content.get("undated", []),
+        )
+
+    def save(self):
+        """Store the inventory next to the directory; skipped if not writable."""
+        if self.mtime is None:
+            return
+        sidecar = _sidecar_path(self.directory)
+        content = {
+            "version": INVENTORY_VERSION,
+            "directory": str(self.directory),
+            "mtime": self.mtime,
+            "entries": [list(e) for e in self.entries],
+            "undated": self.undated,
+        }
+        tmp = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump(content, f)
+            os.replace(tmp, sidecar)
+        except OSError as e:
+            logger.warning(f"Could not write inventory {sidecar}: {e}")
+
+    def files(self):
+        """Return the paths of every NetCDF file in the directory."""
+        names = sorted([e[0] for e in self.entries] + self.undated)
+        return [str(self.directory / name) for name in names]
+
+    def query(self, start, end):
+        """
+        Return the files whose period overlaps ``[start, end]``.
+
+        Parameters
+        ----------
+        start, end : int
+            First and last day as YYYYMMDD integers (see ``period_bounds``).
+
+        Returns
+        -------
+        list of str
+            Sorted file paths.
+        """
+        idx = bisect.bisect_right(self._starts, end) - 1
+        names = []
+        while idx >= 0 and self._max_ends[idx] >= start:
+            name, _, entry_end, _, _ = self.entries[idx]
+            if entry_end >= start:
+                names.append(name)
+            idx -= 1
+        return [str(self.directory / name) for name in sorted(names)]
+
+    def covers(self, start, end):
+        """Return True if the files of the directory cover ``[start, end]`` without gaps."""
+        periods = sorted(
+            (e[1], e[2]) for e in self.entries if e[1] <= end and e[2] >= start
+        )
+        cursor = start
+        for entry_start, entry_end in periods:
+            if entry_start > cursor:
+                return False
+            if entry_end >= cursor:
+                cursor = _next_day(entry_end)
+            if cursor > end:
+                return True
+        return cursor > end
+
+    def date_range(self):
+        """Return the smallest and largest date tokens as integers, or (None, None)."""
+        if not self.entries:
+            return None, None
+        tokens = [int(e[4]) for e in self.entries]
+        return min(tokens), max(tokens)
+
+
+def get_inventory(directory):
+    """
+    Return the file inventory of a directory.
+
+    The inventory is kept in memory for the process and persisted as a JSON
+    sidecar; both are reused while the directory modification time is
+    unchanged (files added, removed or renamed update it).
+
+    Parameters
+    ----------
+    directory : str or Path
+        Variable directory.
+
+    Returns
+    -------
+    FileInventory
+    """
+    key = str(directory)
+    try:
+        mtime = os.stat(directory).st_mtime
+    except OSError:
+        return FileInventory(directory, None, [])
+
+    inventory = _INVENTORIES.get(key)
+    if inventory is not None and inventory.mtime == mtime:
+        return inventory
+
+    inventory = FileInventory.from_sidecar(directory)
+    if inventory is None or inventory.mtime != mtime:
+        inventory = FileInventory.scan(directory)
+        inventory.save()
+
+    _INVENTORIES[key] = inventory
+    return inventory
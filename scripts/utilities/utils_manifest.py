@@ -0,0 +1,199 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from utils_staging import staged_output
+
+logger = logging.getLogger(__name__)
+
+# manifest path -> ((mtime_ns, size), {output name: entry})
+_MANIFESTS = {}
+
+
+def _manifest_path(directory):
+    # Stored next to the directory, like the file inventory, so recording a
+    # completion does not change the directory mtime.
+    directory = Path(directory)
+    return directory.parent / f".{directory.name}.manifest.jsonl"
+
+
+def describe_inputs(files):
+    """
+    Return ``[path, size, mtime_ns]`` for every input file.
+
+    Parameters
+    ----------
+    files : list of str or list of list of str
+        Input files, flat or grouped per dependency (as returned by ``load_files``).
+    """
+    described = []
+    for f in files:
+        if isinstance(f, (list, tuple)):
+            described.extend(describe_inputs(f))
+        else:
+            stat = os.stat(f)
+            described.append([str(f), stat.st_size, stat.st_mtime_ns])
+    return described
+
+
+def fingerprint(inputs):
+    """Digest of the ``describe_inputs`` entries (and any other JSON-serializable values)."""
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return getattr(obj, "__qualname__", getattr(obj, "__name__", repr(obj)))
+
+
+def _local_modules(module):
+    """``module`` and the modules it imports from its own directory (e.g. ``operations`` and ``kernels``)."""
+    directory = os.path.dirname(getattr(module, "__file__", None) or "")
+    found = [module]
+    for value in vars(module).values():
+        path = getattr(value, "__file__", None) if inspect.ismodule(value) else None
+        if directory and path and os.path.dirname(path) == directory and value not in found:
+            found.append(value)
+    return found
+
+
+def code_version(function, modules=(), **config):
+    """
+    Digest identifying the code and configuration an output is computed with.
+
+    Uses the source of the module defining ``function`` and of the modules it
+    imports from its directory, so changes to the helpers and kernels it calls
+    count too, the source of ``modules`` (e.g. the pipeline casting and
+    aggregating the result) and the JSON-serializable ``config`` (precision,
+    resampling...). A function without a module (or source) contributes its
+    qualified name.
+    """
+    module = inspect.getmodule(function)
+    sources = [_source(m) for m in _local_modules(module)] if module is not None else [_source(function)]
+    sources += [_source(m) for m in modules]
+    return fingerprint([sources, config])
+
+
+def stale_reason(entry, inputs, code=None):
+    """
+    Return why a completed output is stale, or None if it is up to date.
+
+    Parameters
+    ----------
+    entry : dict
+        Manifest entry of the output (``completed_entry``).
+    inputs : list
+        Current ``describe_inputs`` of its input files.
+    code : str, optional
+        Current ``code_version``; not compared when None.
+    """
+    if entry.get("fingerprint") != fingerprint(inputs):
+        recorded = {path: (size, mtime) for path, size, mtime in entry.get("inputs", [])}
+        changed = [
+            os.path.basename(path) for path, size, mtime in inputs
+            if recorded.get(path) != (size, mtime)
+        ]
+        return f"inputs changed: {changed or 'input set'}"
+    if code is not None and entry.get("code") != code:
+        return "operation code or configuration changed"
+    return None
+
+
+def load_manifest(directory):
+    """
+    Return the completion entries of a directory keyed by output file name.
+
+    The manifest is a JSON-lines file appended to by every completed write;
+    the last entry of a file wins. The parsed manifest is cached until its
+    mtime or size changes (the size catches appends within the coarse mtime
+    resolution of some file systems).
+    """
+    path = _manifest_path(directory)
+    try:
+        stat = path.stat()
+    except OSError:
+        return {}
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _MANIFESTS.get(str(path))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut by a killed job; the output is recomputed
+                continue
+            entries[entry["output"]] = entry
+    _MANIFESTS[str(path)] = (key, entries)
+    return entries
+
+
+def completed_entry(output_file):
+    """
+    Return the manifest entry of an output, or None if it is not complete.
+
+    An output is complete when the manifest records it and the file on disk
+    still has the recorded size.
+    """
+    output_file = Path(output_file)
+    entry = load_manifest(output_file.parent).get(output_file.name)
+    if entry is None:
+        return None
+    try:
+        if output_file.stat().st_size != entry["size"]:
+            return None
+    except OSError:
+        return None
+    return entry
+
+
+def record_completion(output_file, inputs, **extra):
+    """
+    Append the completion of ``output_file`` to the manifest of its directory.
+
+    Parameters
+    ----------
+    output_file : str or Path
+        Committed output.
+    inputs : list
+        ``describe_inputs`` of the files it was computed from.
+    **extra
+        Additional JSON-serializable values stored in the entry.
+    """
+    output_file = Path(output_file)
+    entry = {
+        "output": output_file.name,
+        "size": output_file.stat().st_size,
+        "inputs": inputs,
+        "fingerprint": fingerprint(inputs),
+        "completed": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **extra,
+    }
+    # One write per line keeps concurrent jobs from interleaving entries
+    with open(_manifest_path(output_file.parent), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def atomic_to_netcdf(ds, output_file, **kwargs):
+    """
+    Write a dataset to a temporary file and rename it to ``output_file``.
+
+    The temporary file is next to ``output_file`` (its name does not end in
+    ``.nc`` and is ignored by the file inventory), or on node-local scratch
+    when ``C3S_SCRATCH_DIR`` is set (see ``utils_staging``). ``output_file``
+    is either absent or complete; the temporary file is removed if the write
+    fails.
+    """
+    with staged_output(output_file) as tmp:
+        ds.to_netcdf(tmp, **kwargs)
@@ -0,0 +1,94 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Read the inputs of the next slice ahead in a background thread.
+
+    While a slice computes and writes, ``submit`` starts a loader that reads
+    the inputs of the following slice ahead (for derived variables,
+    ``utils_derived_pipeline._prefetch_slice`` stages the files to scratch and
+    persists the decoded inputs on the dask workers). ``take`` then returns
+    what it loaded, waiting only for the part of the read that did not
+    overlap with the previous slice. At most one slice is buffered, and
+    loaders skip slices larger than ``max_bytes``.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum decoded size of the buffered inputs. They are held by the
+        workers, so this is part of the worker memory, not on top of it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._pending = {}
+        self.stats = {"slices": 0, "load_seconds": 0.0, "wait_seconds": 0.0}
+
+    def submit(self, key, loader):
+        """
+        Start loading a slice.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the slice in ``take``.
+        loader : callable
+            Called with ``max_bytes``; returns the loaded value or None to skip.
+        """
+        # Only one slice is buffered; drop any that was never taken
+        for stale in [k for k in self._pending if k != key]:
+            self._pending.pop(stale).cancel()
+        if key not in self._pending:
+            self._pending[key] = self._executor.submit(self._run, loader)
+
+    def _run(self, loader):
+        start = time.perf_counter()
+        value = loader(self.max_bytes)
+        return value, time.perf_counter() - start
+
+    def take(self, key):
+        """Return the value loaded for ``key``, or None if it was not prefetched or failed."""
+        future = self._pending.pop(key, None)
+        if future is None:
+            return None
+
+        start = time.perf_counter()
+        try:
+            value, load_seconds = future.result()
+        except Exception as e:
+            logger.warning(f"Prefetch of {key} failed, loading it again: {e}")
+            return None
+        wait_seconds = time.perf_counter() - start
+        if value is None:
+            return None
+
+        overlapped = max(load_seconds - wait_seconds, 0.0)
+        self.stats["slices"] += 1
+        self.stats["load_seconds"] += load_seconds
+        self.stats["wait_seconds"] += wait_seconds
+        logger.info(
+            f"Prefetched {key}: read {load_seconds:.1f} s, waited {wait_seconds:.1f} s, "
+            f"overlapped {overlapped:.1f} s ({100 * overlapped / max(load_seconds, 1e-9):.0f}%)"
+        )
+        return value
+
+    def close(self):
+        """Drop pending loads and log the overall overlap."""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+        load, wait = self.stats["load_seconds"], self.stats["wait_seconds"]
+        if self.stats["slices"]:
+            overlapped = max(load - wait, 0.0)
+            logger.info(
+                f"Prefetch summary: {self.stats['slices']} slices, read {load:.1f} s, "
+                f"overlapped {overlapped:.1f} s ({100 * overlapped / max(load, 1e-9):.0f}%)"
+            )
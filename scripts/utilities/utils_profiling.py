@@ -0,0 +1,255 @@
+"""
+Per-stage profiling of derived computations.
+
+Every ``process_derived`` call is profiled with a ``StageProfiler``: wall time
+of each stage, size of the input files and of their decoded selection, bytes
+written, memory and dask task counts. Memory is the resident size of the
+client and of the largest dask worker (``/proc/self/statm``), sampled by a
+background thread every ``C3S_PROFILE_SAMPLE_SECONDS`` (default 1) while a
+stage runs: the record holds the peak and the change of each stage and the
+peak of the run, so runs can be ranked by memory. The
+record is logged and, when ``C3S_PROFILE_FILE`` is set, appended to that file
+as one JSON line. When ``C3S_PROFILE_REPORT_DIR`` is set, a dask performance
+report (HTML) of the compute and write stages is saved in that directory.
+
+Rank the recorded runs by cost with:
+    python utils_profiling.py profile.jsonl [--top 20] [--by total_seconds]
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = os.getenv("C3S_PROFILE_FILE")
+PROFILE_REPORT_DIR = os.getenv("C3S_PROFILE_REPORT_DIR")
+PROFILE_SAMPLE_SECONDS = float(os.getenv("C3S_PROFILE_SAMPLE_SECONDS", "1"))
+
+
+def _rss_bytes():
+    """Current resident memory of this process, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _workers_rss_bytes():
+    """Current resident memory of each dask worker process, or {} without a distributed client."""
+    try:
+        from distributed import get_client
+        client = get_client()
+    except (ImportError, ValueError):
+        return {}
+    try:
+        return {worker: rss for worker, rss in client.run(_rss_bytes).items() if rss is not None}
+    except Exception as e:  # the profile must never fail the computation
+        logger.debug(f"Could not read worker memory: {e}")
+        return {}
+
+
+def _memory_sample():
+    """Resident memory of the client and of the largest worker, now."""
+    return _rss_bytes(), max(_workers_rss_bytes().values(), default=None)
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+class _MemorySampler(threading.Thread):
+    """Sample the client and largest-worker memory every ``interval`` seconds until stopped."""
+
+    def __init__(self, interval):
+        super().__init__(name="memory-sampler", daemon=True)
+        self.interval = interval
+        self.client = None
+        self.workers = None
+        self.peak = 0
+        self._stop_event = threading.Event()
+        self._sample()
+
+    def _sample(self):
+        client, workers = _memory_sample()
+        self.client = _max(self.client, client)
+        self.workers = _max(self.workers, workers)
+        total = (client or 0) + (workers or 0)
+        self.peak = max(self.peak, total)
+        return total
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        """Stop sampling; return the memory at the end (client plus largest worker)."""
+        self._stop_event.set()
+        self.join()
+        return self._sample()
+
+
+class StageProfiler:
+    """
+    Record wall time, I/O volume, memory and dask tasks of the stages of one run.
+
+    Parameters
+    ----------
+    profile_file : str or Path, optional
+        JSON-lines file the record is appended to. Defaults to ``C3S_PROFILE_FILE``.
+    report_dir : str or Path, optional
+        Directory of the dask performance reports. Defaults to ``C3S_PROFILE_REPORT_DIR``.
+    **labels
+        Identify the run in the record (e.g. ``dataset``, ``var``, ``year``, ``month``).
+    """
+
+    def __init__(self, profile_file=None, report_dir=None, **labels):
+        self.profile_file = profile_file or PROFILE_FILE
+        self.report_dir = report_dir or PROFILE_REPORT_DIR
+        self.labels = labels
+        self.stages = {}
+        self.counters = {"input_file_bytes": 0, "decoded_bytes": 0, "bytes_written": 0, "dask_tasks": 0}
+        # Peak and change of the resident memory (client + largest worker) of each stage
+        self.rss_stage_peak = {}
+        self.rss_delta = {}
+        self.rss_peak = {"client": None, "workers": None}
+        self.status = "completed"
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._sample()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = f"failed: {exc_type.__name__}"
+        self.emit()
+        return False
+
+    def _sample(self):
+        """Sample the memory now; return the client plus largest-worker RSS."""
+        client, workers = _memory_sample()
+        self.rss_peak["client"] = _max(self.rss_peak["client"], client)
+        self.rss_peak["workers"] = _max(self.rss_peak["workers"], workers)
+        return (client or 0) + (workers or 0)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage and sample its memory in the background.
+
+        Repeated stages accumulate their time and memory change and keep the
+        largest peak.
+        """
+        sampler = _MemorySampler(PROFILE_SAMPLE_SECONDS)
+        rss = sampler.peak
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            self.rss_delta[name] = self.rss_delta.get(name, 0) + sampler.stop() - rss
+            self.rss_peak["client"] = _max(self.rss_peak["client"], sampler.client)
+            self.rss_peak["workers"] = _max(self.rss_peak["workers"], sampler.workers)
+            self.rss_stage_peak[name] = max(self.rss_stage_peak.get(name, 0), sampler.peak)
+
+    def add(self, **counters):
+        """
+        Add to the counters.
+
+        ``input_file_bytes`` (size of the input files on disk), ``decoded_bytes``
+        (decoded size of the selected inputs), ``bytes_written`` and ``dask_tasks``.
+        """
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def performance_report(self):
+        """Capture a dask performance report when ``report_dir`` is set; failures only warn."""
+        report = None
+        if self.report_dir:
+            try:
+                from distributed import performance_report
+                name = "_".join(str(v) for v in self.labels.values() if v is not None) or "run"
+                Path(self.report_dir).mkdir(parents=True, exist_ok=True)
+                report = performance_report(filename=str(Path(self.report_dir) / f"{name}.html"))
+                report.__enter__()
+            except Exception as e:
+                logger.warning(f"Dask performance report disabled: {e}")
+                report = None
+        try:
+            yield
+        finally:
+            if report is not None:
+                try:
+                    report.__exit__(None, None, None)
+                except Exception as e:
+                    logger.warning(f"Could not write the dask performance report: {e}")
+
+    def record(self):
+        """Return the profile record as a dict."""
+        self._sample()
+        return {
+            **self.labels,
+            "status": self.status,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "host": socket.gethostname(),
+            "total_seconds": round(time.perf_counter() - self._start, 3),
+            "stages": {k: round(v, 3) for k, v in self.stages.items()},
+            **self.counters,
+            "rss_bytes": self.rss_peak["client"],
+            "workers_rss_bytes": self.rss_peak["workers"],
+            "rss_peak_bytes": self.rss_stage_peak,
+            "rss_delta_bytes": self.rss_delta,
+        }
+
+    def emit(self):
+        """Log the record and append it to ``profile_file`` as a JSON line."""
+        record = self.record()
+        logger.info(f"Profile: {json.dumps(record)}")
+        if not self.profile_file:
+            return
+        try:
+            Path(self.profile_file).parent.mkdir(parents=True, exist_ok=True)
+            # One write per line keeps concurrent appends from interleaving
+            with open(self.profile_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write profile to {self.profile_file}: {e}")
+
+
+def load_profile(path):
+    """Load a JSON-lines profile into a DataFrame with one column per stage."""
+    import pandas as pd
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    df = pd.json_normalize(records)
+    df.columns = [c.replace("stages.", "") for c in df.columns]
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank profiled derived runs by cost.")
+    parser.add_argument("profile", help="JSON-lines profile (C3S_PROFILE_FILE)")
+    parser.add_argument("--top", type=int, default=20, help="Number of runs to show")
+    parser.add_argument("--by", default="total_seconds", help="Column to rank by (e.g. compute, write, workers_rss_bytes, rss_peak_bytes.compute)")
+    args = parser.parse_args()
+
+    df = load_profile(args.profile)
+    print(df.sort_values(args.by, ascending=False).head(args.top).to_string(index=False))
+    by_var = df.groupby("var")[[args.by]].sum().sort_values(args.by, ascending=False)
+    print(f"\nTotal {args.by} per variable:\n{by_var.to_string()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+"""
+Regridding with weights cached on disk.
+
+ESMF weights are expensive to generate (``conservative_normed`` on the CERRA
+and LAEA sea-ice grids in particular) and depend only on the source grid,
+the target grid and the method. They are computed once, stored as an ESMF
+weight file (sparse ``row``/``col``/``S`` triplets) in ``C3S_REGRID_WEIGHTS_DIR``
+and reused across files, variables and runs. The file name is a digest of
+the grid coordinates (and bounds) and the method, so a changed grid gets new
+weights instead of stale ones.
+
+``SparseRegridder`` applies the weights as a ``scipy.sparse`` CSR product
+over blocks of time steps, handling missing values and the renormalisation
+of ``conservative_normed`` on the fly. Bilinear and nearest weights can be
+computed in-house when xESMF is not installed.
+"""
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from utils_grids import grid_geometry
+
+logger = logging.getLogger(__name__)
+
+REGRID_WEIGHTS_DIR = os.getenv(
+    "C3S_REGRID_WEIGHTS_DIR", str(Path.home() / ".cache" / "c3s-atlas" / "regrid-weights")
+)
+
+# "sparse" applies the weights with scipy (SparseRegridder), "xesmf" with xESMF
+REGRID_ENGINE = os.getenv("C3S_REGRID_ENGINE", "sparse")
+
+CONSERVATIVE_METHODS = ("conservative", "conservative_normed")
+
+# weights key -> xesmf.Regridder, shared by the files of a run
+_REGRIDDERS = {}
+
+
+def _bounds_1d(centres):
+    """Cell edges of a 1-D coordinate: midpoints, extrapolated at both ends."""
+    centres = np.asarray(centres, dtype="float64")
+    mid = (centres[1:] + centres[:-1]) / 2
+    return np.concatenate([[2 * centres[0] - mid[0]], mid, [2 * centres[-1] - mid[-1]]])
+
+
+def _corners_2d(lat, lon):
+    """
+    Cell corners of a 2-D (curvilinear) grid from its centres.
+
+    Corners are the mean of the four surrounding centres, averaged as unit
+    vectors so the dateline and the poles are handled; the outer corners are
+    extrapolated linearly.
+    """
+    lat_r, lon_r = np.deg2rad(lat), np.deg2rad(lon)
+    xyz = np.stack([np.cos(lat_r) * np.cos(lon_r), np.cos(lat_r) * np.sin(lon_r), np.sin(lat_r)], axis=-1)
+    # Pad by linear extrapolation so every corner has four neighbours
+    xyz = np.concatenate([2 * xyz[:1] - xyz[1:2], xyz, 2 * xyz[-1:] - xyz[-2:-1]], axis=0)
+    xyz = np.concatenate([2 * xyz[:, :1] - xyz[:, 1:2], xyz, 2 * xyz[:, -1:] - xyz[:, -2:-1]], axis=1)
+    corners = (xyz[:-1, :-1] + xyz[1:, :-1] + xyz[:-1, 1:] + xyz[1:, 1:]) / 4
+    x, y, z = corners[..., 0], corners[..., 1], corners[..., 2]
+    lat_b = np.rad2deg(np.arctan2(z, np.hypot(x, y)))
+    lon_b = np.rad2deg(np.arctan2(y, x))
+    return lat_b, lon_b
+
+
+def make_grid(lats, lons, bounds=False, dims=None, corners=None):
+    """
+    Build the grid dataset given to xESMF.
+
+    Parameters
+    ----------
+    lats, lons : array-like
+        Cell centres: 1-D for regular grids, 2-D for curvilinear ones.
+    bounds : bool, optional
+        Add ``lat_b``/``lon_b`` cell edges (required by conservative methods).
+    dims : tuple of str, optional
+        Horizontal dimensions of the data regridded from this grid. Defaults
+        to ``("lat", "lon")`` for 1-D and ``("y", "x")`` for 2-D coordinates.
+    corners : tuple of numpy.ndarray, optional
+        ``(lat_b, lon_b)`` corners of a 2-D grid (e.g. from
+        ``utils_grids.grid_geometry``); estimated from the centres otherwise.
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    lats, lons = np.asarray(lats), np.asarray(lons)
+    if lats.ndim == 1:
+        dim_y, dim_x = dims or ("lat", "lon")
+        grid = xr.Dataset(coords={"lat": (dim_y, lats), "lon": (dim_x, lons)})
+        if bounds:
+            grid = grid.assign_coords(lat_b=("lat_b", _bounds_1d(lats)), lon_b=("lon_b", _bounds_1d(lons)))
+    else:
+        grid = xr.Dataset(coords={"lat": (dims or ("y", "x"), lats), "lon": (dims or ("y", "x"), lons)})
+        if bounds:
+            lat_b, lon_b = corners if corners is not None else _corners_2d(lats, lons)
+            grid = grid.assign_coords(lat_b=(("y_b", "x_b"), lat_b), lon_b=(("y_b", "x_b"), lon_b))
+    return grid
+
+
+def grid_fingerprint(grid):
+    """Digest of the coordinates (and bounds) of a grid built by ``make_grid``."""
+    digest = hashlib.sha1()
+    for name in ("lat", "lon", "lat_b", "lon_b"):
+        if name in grid.coords:
+            values = np.ascontiguousarray(grid[name].values, dtype="float64")
+            digest.update(f"{name}{grid[name].dims}{values.shape}".encode())
+            digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def weights_path(src_grid, dst_grid, method, weights_dir=None):
+    """Path of the cached weights of a (source grid, target grid, method)."""
+    key = hashlib.sha1(
+        f"{grid_fingerprint(src_grid)}-{grid_fingerprint(dst_grid)}-{method}".encode()
+    ).hexdigest()[:20]
+    return Path(weights_dir or REGRID_WEIGHTS_DIR) / f"{method}_{key}.nc"
+
+
+def _is_global(grid):
+    lon = grid["lon"].values
+    if lon.ndim != 1 or lon.size < 2:
+        return False
+    return np.ptp(lon) + abs(lon[1] - lon[0]) >= 359.9
+
+
+def get_regridder(src_grid, dst_grid, method, weights_dir=None):
+    """
+    Return an ``xesmf.Regridder`` from cached weights, generating them on a miss.
+
+    Parameters
+    ----------
+    src_grid, dst_grid : xarray.Dataset
+        Grids built by ``make_grid``.
+    method : str
+        xESMF method (e.g. ``"bilinear"``, ``"conservative_normed"``).
+    weights_dir : str or Path, optional
+        Weight cache directory. Defaults to ``C3S_REGRID_WEIGHTS_DIR``.
+    """
+    import xesmf as xe
+
+    path = weights_path(src_grid, dst_grid, method, weights_dir)
+    regridder = _REGRIDDERS.get(str(path))
+    if regridder is not None:
+        return regridder
+
+    periodic = _is_global(src_grid)
+    start = time.perf_counter()
+    if path.exists():
+        regridder = xe.Regridder(src_grid, dst_grid, method, periodic=periodic, weights=str(path))
+        logger.info(f"Loaded {method} weights {path.name} in {time.perf_counter() - start:.1f} s")
+    else:
+        regridder = xe.Regridder(src_grid, dst_grid, method, periodic=periodic)
+        logger.info(f"Generated {method} weights in {time.perf_counter() - start:.1f} s")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Temporary file + rename: concurrent runs never read partial weights
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            regridder.to_netcdf(str(tmp))
+            os.replace(tmp, path)
+            logger.info(f"Cached weights as {path}")
+        except OSError as e:
+            logger.warning(f"Could not cache weights in {path}: {e}")
+            tmp.unlink(missing_ok=True)
+
+    _REGRIDDERS[str(path)] = regridder
+    return regridder
+
+
+def save_weights(path, weights):
+    """Store a sparse weight matrix as an ESMF weight file (1-based ``row``/``col``/``S``)."""
+    coo = weights.tocoo()
+    ds = xr.Dataset({
+        "row": ("n_s", coo.row.astype("int32") + 1),
+        "col": ("n_s", coo.col.astype("int32") + 1),
+        "S": ("n_s", coo.data.astype("float64")),
+    })
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        ds.to_netcdf(tmp)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not cache weights in {path}: {e}")
+        tmp.unlink(missing_ok=True)
+
+
+def load_weights(path, n_in, n_out):
+    """
+    Read an ESMF weight file as a CSR matrix of shape ``(n_out, n_in)``.
+
+    Columns and rows index the source and target cells flattened in C order
+    of their (y, x) dimensions, as xESMF applies them.
+    """
+    from scipy import sparse
+
+    with xr.open_dataset(path) as ds:
+        row, col, values = ds["row"].values - 1, ds["col"].values - 1, ds["S"].values
+    return sparse.coo_matrix((values, (row, col)), shape=(n_out, n_in)).tocsr()
+
+
+def _target_points(dst_grid):
+    lat, lon = dst_grid["lat"].values, dst_grid["lon"].values
+    if lat.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+    return lat.ravel(), lon.ravel()
+
+
+def _axis_weights(centres, points, periodic=False):
+    """Lower neighbour index and linear weight of ``points`` on a 1-D axis (NaN index outside)."""
+    order = np.argsort(centres)
+    axis = centres[order]
+    if periodic:
+        axis = np.append(axis, axis[0] + 360.0)
+        order = np.append(order, order[0])
+        points = axis[0] + np.mod(points - axis[0], 360.0)
+    i = np.clip(np.searchsorted(axis, points, side="right") - 1, 0, axis.size - 2)
+    t = (points - axis[i]) / (axis[i + 1] - axis[i])
+    inside = (points >= axis[0]) & (points <= axis[-1])
+    return order[i], order[i + 1], t, inside
+
+
+def bilinear_weights(src_grid, dst_grid):
+    """
+    Bilinear weights from a regular (1-D lat/lon) source grid, computed without ESMF.
+
+    Interpolation is linear in latitude and longitude between the four
+    surrounding source centres; target cells outside the source grid get no
+    weights (NaN after regridding).
+    """
+    from scipy import sparse
+
+    src_lat, src_lon = src_grid["lat"].values, src_grid["lon"].values
+    if src_lat.ndim != 1:
+        raise ValueError("In-house bilinear weights need a regular (1-D lat/lon) source grid; use ESMF weights")
+    lat, lon = _target_points(dst_grid)
+    j0, j1, tj, inside_j = _axis_weights(src_lat, lat)
+    i0, i1, ti, inside_i = _axis_weights(src_lon, lon, periodic=_is_global(src_grid))
+    inside = inside_j & inside_i
+
+    nlon = src_lon.size
+    rows = np.repeat(np.flatnonzero(inside), 4)
+    j0, j1, tj, i0, i1, ti = (a[inside] for a in (j0, j1, tj, i0, i1, ti))
+    cols = np.stack([j0 * nlon + i0, j0 * nlon + i1, j1 * nlon + i0, j1 * nlon + i1], axis=1).ravel()
+    values = np.stack([(1 - tj) * (1 - ti), (1 - tj) * ti, tj * (1 - ti), tj * ti], axis=1).ravel()
+    return sparse.csr_matrix((values, (rows, cols)), shape=(lat.size, src_lat.size * nlon))
+
+
+def nearest_weights(src_grid, dst_grid):
+    """Nearest source centre of every target centre (great-circle), for any source grid."""
+    from scipy import sparse
+    from scipy.spatial import cKDTree
+
+    def unit_vectors(lat, lon):
+        lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+        return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+    src_lat, src_lon = src_grid["lat"].values, src_grid["lon"].values
+    if src_lat.ndim == 1:
+        src_lon, src_lat = np.meshgrid(src_lon, src_lat)
+    lat, lon = _target_points(dst_grid)
+    _, cols = cKDTree(unit_vectors(src_lat.ravel(), src_lon.ravel())).query(unit_vectors(lat, lon))
+    return sparse.csr_matrix(
+        (np.ones(lat.size), (np.arange(lat.size), cols)), shape=(lat.size, src_lat.size)
+    )
+
+
+# Weights computed without ESMF
+INHOUSE_METHODS = {"bilinear": bilinear_weights, "nearest_s2d": nearest_weights}
+
+# weights path -> CSR matrix
+_WEIGHTS = {}
+
+
+def get_weights(src_grid, dst_grid, method, weights_dir=None):
+    """
+    Return the regridding weights as a CSR matrix, from the cache when possible.
+
+    ESMF weights (cached by ``get_regridder``) are preferred. Without xESMF,
+    bilinear and nearest weights are computed in-house and cached under their
+    own name, since they differ slightly from the ESMF ones.
+    """
+    n_in, n_out = src_grid["lat"].size, dst_grid["lat"].size
+    if src_grid["lat"].ndim == 1:
+        n_in = src_grid["lat"].size * src_grid["lon"].size
+    if dst_grid["lat"].ndim == 1:
+        n_out = dst_grid["lat"].size * dst_grid["lon"].size
+
+    path = weights_path(src_grid, dst_grid, method, weights_dir)
+    try:
+        import xesmf  # noqa: F401
+    except ImportError:
+        if method not in INHOUSE_METHODS:
+            raise
+        path = path.with_name(path.name.replace(f"{method}_", f"{method}-inhouse_", 1))
+
+    weights = _WEIGHTS.get(str(path))
+    if weights is not None:
+        return weights
+
+    start = time.perf_counter()
+    if path.exists():
+        weights = load_weights(path, n_in, n_out)
+        logger.info(f"Loaded {method} weights {path.name} in {time.perf_counter() - start:.1f} s")
+    elif "-inhouse_" in path.name:
+        weights = INHOUSE_METHODS[method](src_grid, dst_grid)
+        logger.info(f"Computed in-house {method} weights in {time.perf_counter() - start:.1f} s")
+        save_weights(path, weights)
+    else:
+        get_regridder(src_grid, dst_grid, method, weights_dir)
+        weights = load_weights(path, n_in, n_out)
+
+    _WEIGHTS[str(path)] = weights
+    return weights
+
+
+class SparseRegridder:
+    """
+    Apply regridding weights as a sparse matrix product over blocks of time steps.
+
+    Each block of ``time_block`` steps is flattened to ``(steps, source cells)``
+    and multiplied by the CSR weights. Missing source values (NaN, e.g. sea-ice
+    land or a varying mask) are handled on the fly: the weights of the valid
+    cells are summed with a second product and target values whose valid
+    weight is below ``na_thres`` of the full weight are set to NaN; the others
+    are renormalized by the valid weight (``conservative_normed``) or require
+    every contributing cell to be valid (``na_thres=1``, the default for the
+    other methods). Target cells without any weight are NaN.
+
+    Parameters
+    ----------
+    weights : scipy.sparse.csr_matrix
+        Weights of shape ``(target cells, source cells)``.
+    dst_grid : xarray.Dataset
+        Target grid (``make_grid``); gives the output dimensions and coordinates.
+    method : str
+        Regridding method the weights were built with.
+    time_block : int, optional
+        Time steps multiplied at once when the input is not a dask array.
+    na_thres : float, optional
+        Minimum valid fraction of the weight of a target cell.
+    """
+
+    def __init__(self, weights, dst_grid, method, time_block=24, na_thres=None):
+        self.weights = weights.tocsr()
+        self.dst_grid = dst_grid
+        self.method = method
+        self.time_block = time_block
+        if na_thres is None:
+            na_thres = 1e-6 if method == "conservative_normed" else 1.0 - 1e-6
+        self.na_thres = na_thres
+        self.row_sums = np.asarray(self.weights.sum(axis=1)).ravel()
+        self.dst_shape = dst_grid["lat"].shape if dst_grid["lat"].ndim == 2 else (
+            dst_grid["lat"].size, dst_grid["lon"].size
+        )
+        self.dst_dims = dst_grid["lat"].dims if dst_grid["lat"].ndim == 2 else (
+            dst_grid["lat"].dims[0], dst_grid["lon"].dims[0]
+        )
+
+    def block_bytes(self, itemsize=4):
+        """Working memory of ``apply_block`` on ``time_block`` steps (inputs and output excluded)."""
+        n_out, n_in = self.weights.shape
+        # masked copy and float64 valid mask of the input, float64 products
+        return self.time_block * (n_in * (itemsize + 1 + 8) + n_out * 8 * 3)
+
+    def apply_block(self, block):
+        """Regrid a numpy array whose two trailing dimensions are the source grid."""
+        lead = block.shape[:-2]
+        x = block.reshape(-1, block.shape[-2] * block.shape[-1])
+        valid = ~np.isnan(x)
+        if valid.all():
+            out = (self.weights @ x.T).T
+            out[:, self.row_sums == 0] = np.nan
+        else:
+            out = (self.weights @ np.where(valid, x, 0).T).T
+            valid_weight = (self.weights @ valid.T.astype(self.weights.dtype)).T
+            full = self.row_sums[np.newaxis, :]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out = out * full / valid_weight
+            out[(valid_weight < self.na_thres * full) | (full == 0)] = np.nan
+        return out.astype(block.dtype, copy=False).reshape(*lead, *self.dst_shape)
+
+    def __call__(self, da):
+        """Regrid a DataArray whose two trailing dimensions are the source grid."""
+        lead_dims = da.dims[:-2]
+        data = da.data
+        if isinstance(data, np.ndarray):
+            # Leading dimensions (e.g. variable and time) are regridded as one axis of fields
+            fields = data.reshape(-1, *data.shape[-2:])
+            if fields.shape[0] > self.time_block:
+                out = np.concatenate([
+                    self.apply_block(fields[i:i + self.time_block])
+                    for i in range(0, fields.shape[0], self.time_block)
+                ])
+            else:
+                out = self.apply_block(fields)
+            out = out.reshape(*data.shape[:-2], *self.dst_shape)
+        else:
+            # One task per time block: the grid is never split
+            data = data.rechunk({data.ndim - 2: -1, data.ndim - 1: -1})
+            out = data.map_blocks(
+                self.apply_block,
+                dtype=data.dtype,
+                chunks=data.chunks[:-2] + tuple((n,) for n in self.dst_shape),
+            )
+
+        coords = {name: coord for name, coord in da.coords.items() if set(coord.dims) <= set(lead_dims)}
+        coords.update({name: self.dst_grid[name] for name in ("lat", "lon")})
+        return xr.DataArray(out, dims=(*lead_dims, *self.dst_dims), coords=coords, attrs=da.attrs, name=da.name)
+
+
+def _source_coords(ds):
+    for lat, lon in (("lat", "lon"), ("latitude", "longitude")):
+        if lat in ds.coords or lat in ds.variables:
+            return ds[lat].values, ds[lon].values
+    raise ValueError(f"No lat/lon coordinates found in dataset with variables {list(ds.variables)}")
+
+
+class CachedInterpolator:
+    """
+    Drop-in replacement of ``c3s_atlas.interpolation.Interpolator`` with cached weights.
+
+    Parameters
+    ----------
+    int_attr : dict
+        ``interpolation_method``, target ``lats``/``lons`` and ``var_name``;
+        optional ``src_lats``/``src_lons`` for sources whose coordinates are
+        not ``lat``/``lon`` or ``latitude``/``longitude``, ``source_grid``
+        (a ``utils_grids.PROJECTED_GRIDS`` name) to use the cached geometry
+        of a projected source grid (exact corners for the conservative
+        methods), ``weights_dir`` and ``engine``: ``"sparse"`` (``SparseRegridder``) or
+        ``"xesmf"``, defaulting to ``C3S_REGRID_ENGINE``.
+    """
+
+    def __init__(self, int_attr):
+        self.method = int_attr["interpolation_method"]
+        self.var_name = int_attr["var_name"]
+        self.weights_dir = int_attr.get("weights_dir")
+        self.engine = int_attr.get("engine", REGRID_ENGINE)
+        self.src_lats = int_attr.get("src_lats")
+        self.src_lons = int_attr.get("src_lons")
+        self.source_grid = int_attr.get("source_grid")
+        self.dst_grid = make_grid(int_attr["lats"], int_attr["lons"], bounds=self.method in CONSERVATIVE_METHODS)
+
+    def src_grid(self, ds, bounds=None):
+        """
+        Return the source grid of ``ds`` (``make_grid``).
+
+        Cell bounds are added for the conservative methods, or when ``bounds``
+        is True (e.g. to compute cell areas).
+        """
+        if bounds is None:
+            bounds = self.method in CONSERVATIVE_METHODS
+        corners = None
+        if self.source_grid is not None:
+            geometry = grid_geometry(ds, self.source_grid)
+            lats, lons = geometry["lat"].values, geometry["lon"].values
+            corners = geometry["lat_b"].values, geometry["lon_b"].values
+        elif self.src_lats is not None:
+            lats, lons = self.src_lats, self.src_lons
+        else:
+            lats, lons = _source_coords(ds)
+        return make_grid(lats, lons, bounds=bounds, dims=ds[self.var_name].dims[-2:], corners=corners)
+
+    def regridder(self, ds):
+        """Return the regridder of the grid of ``ds``."""
+        src_grid = self.src_grid(ds)
+        if self.engine == "sparse":
+            return SparseRegridder(
+                get_weights(src_grid, self.dst_grid, self.method, self.weights_dir), self.dst_grid, self.method
+            )
+        return get_regridder(src_grid, self.dst_grid, self.method, self.weights_dir)
+
+    def __call__(self, ds, regridder=None, var_names=None):
+        """
+        Regrid ``ds[var_name]`` to the target grid.
+
+        ``regridder`` (from ``self.regridder``) skips looking up the weights,
+        e.g. when the time blocks of a file are regridded one by one.
+        ``var_names`` regrids several variables of the same grid at once: they
+        are stacked along a leading dimension, so the weights are applied in
+        a single pass, and returned as separate variables.
+        """
+        if regridder is None:
+            regridder = self.regridder(ds)
+        if var_names is not None and len(var_names) > 1:
+            da = xr.concat([ds[name].rename(None) for name in var_names], dim="_variable")
+            da_i = regridder(da) if self.engine == "sparse" else regridder(da, keep_attrs=True)
+            return xr.Dataset({
+                name: da_i.isel(_variable=i, drop=True).assign_attrs(ds[name].attrs)
+                for i, name in enumerate(var_names)
+            })
+        da = ds[self.var_name]
+        # Both engines regrid the two trailing (horizontal) dimensions
+        if self.engine == "sparse":
+            da_i = regridder(da)
+        else:
+            da_i = regridder(da, keep_attrs=True)
+        return da_i.to_dataset(name=self.var_name)
@@ -0,0 +1,238 @@
+"""
+Node-local scratch staging of Lustre inputs and outputs.
+
+Set ``C3S_SCRATCH_DIR`` (for example to the job's ``$TMPDIR``) to enable it.
+Input files are copied to node-local disk with large sequential reads before
+they are opened, and kept in a size-bounded LRU cache (``C3S_SCRATCH_MAX_GB``,
+50 by default) so yearly files read by twelve monthly slices are copied once.
+Staged files in use (by a slice being computed, or by a dataset kept open in
+``utils_dataset_cache``) are pinned and never evicted.
+Outputs are written locally and moved to their destination with one
+sequential copy and an atomic rename. Without ``C3S_SCRATCH_DIR`` files are
+read in place and outputs are written to a temporary file next to the
+destination and renamed.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SCRATCH_DIR = os.getenv("C3S_SCRATCH_DIR")
+SCRATCH_MAX_BYTES = int(float(os.getenv("C3S_SCRATCH_MAX_GB", "50")) * 1024**3)
+
+# Large blocks turn the copy into sequential reads on Lustre
+COPY_BLOCK_BYTES = 64 * 1024**2
+
+_STAGE = None
+
+
+def _copy(src, dst):
+    """Copy ``src`` to ``dst`` in large blocks, through a temporary name, keeping the mtime."""
+    dst = Path(dst)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    try:
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            shutil.copyfileobj(fin, fout, COPY_BLOCK_BYTES)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+
+def _flatten(files):
+    if isinstance(files, (list, tuple)):
+        return [f for item in files for f in _flatten(item)]
+    return [files]
+
+
+class ScratchStage:
+    """
+    Size-bounded LRU cache of input files on node-local disk.
+
+    Parameters
+    ----------
+    root : str or Path
+        Node-local directory.
+    max_bytes : int
+        Maximum size of the staged inputs.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root) / "c3s-scratch"
+        self.inputs_dir = self.root / "inputs"
+        self.outputs_dir = self.root / "outputs"
+        self.inputs_dir.mkdir(parents=True, exist_ok=True)
+        self.outputs_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        # local path -> size, least recently used first
+        self._entries = OrderedDict()
+        # local path -> number of users (``pin``) that keep it from eviction
+        self._pins = Counter()
+        for path in sorted(self.inputs_dir.glob("*/*.nc"), key=lambda p: p.stat().st_atime):
+            self._entries[path] = path.stat().st_size
+
+    def _local_path(self, src):
+        # One directory per source path keeps basenames (used to parse dates)
+        digest = hashlib.sha1(str(Path(src).resolve()).encode()).hexdigest()[:16]
+        return self.inputs_dir / digest / Path(src).name
+
+    def _evict(self, needed, pinned):
+        total = sum(self._entries.values())
+        for path in list(self._entries):
+            if total + needed <= self.max_bytes:
+                break
+            if path in pinned or self._pins[path] > 0:
+                continue
+            total -= self._entries.pop(path)
+            path.unlink(missing_ok=True)
+            logger.info(f"Evicted {path.name} from scratch")
+        return total + needed <= self.max_bytes
+
+    def stage_file(self, src, pinned=()):
+        """Return a local copy of ``src``, or ``src`` itself if it does not fit."""
+        src_stat = os.stat(src)
+        local = self._local_path(src)
+        with self._lock:
+            if local in self._entries:
+                try:
+                    local_stat = local.stat()
+                    if (local_stat.st_size, local_stat.st_mtime_ns) == (src_stat.st_size, src_stat.st_mtime_ns):
+                        self._entries.move_to_end(local)
+                        return str(local)
+                except OSError:
+                    pass
+                # Source replaced (or local copy removed) since it was staged
+                self._entries.pop(local)
+
+            if not self._evict(src_stat.st_size, pinned):
+                logger.info(f"{os.path.basename(src)} does not fit in scratch; reading it in place")
+                return str(src)
+
+            local.parent.mkdir(parents=True, exist_ok=True)
+            start = time.perf_counter()
+            _copy(src, local)
+            elapsed = time.perf_counter() - start
+            self._entries[local] = src_stat.st_size
+            logger.info(
+                f"Staged {os.path.basename(src)} ({src_stat.st_size / 1024**2:.0f} MiB, "
+                f"{src_stat.st_size / 1024**2 / max(elapsed, 1e-9):.0f} MiB/s)"
+            )
+            return str(local)
+
+    def stage_inputs(self, files, pin=False):
+        """
+        Stage a flat or per-dependency nested list of files, keeping its structure.
+
+        With ``pin`` the staged files are also pinned (see ``pin``), in the
+        same step so another thread cannot evict them in between.
+        """
+        with self._lock:
+            pinned = set()
+
+            def stage(item):
+                if isinstance(item, (list, tuple)):
+                    return [stage(f) for f in item]
+                local = self.stage_file(item, pinned)
+                pinned.add(Path(local))
+                return local
+
+            staged = stage(files)
+            if pin:
+                self.pin(_flatten(staged))
+            return staged
+
+    def pin(self, paths):
+        """Keep staged ``paths`` from eviction until they are released as many times."""
+        with self._lock:
+            self._pins.update(Path(p) for p in paths)
+
+    def release(self, paths):
+        """Release paths pinned with ``pin``."""
+        with self._lock:
+            self._pins.subtract(Path(p) for p in paths)
+            self._pins = +self._pins
+
+    def output_path(self, output_file):
+        """Local path an output is written to before ``commit_output``."""
+        return self.outputs_dir / f"{os.getpid()}_{Path(output_file).name}"
+
+    @staticmethod
+    def commit_output(local, output_file):
+        """Copy a local output to its destination sequentially and rename it into place."""
+        start = time.perf_counter()
+        _copy(local, output_file)
+        size = Path(output_file).stat().st_size
+        logger.info(
+            f"Moved {Path(output_file).name} from scratch ({size / 1024**2:.0f} MiB, "
+            f"{size / 1024**2 / max(time.perf_counter() - start, 1e-9):.0f} MiB/s)"
+        )
+        Path(local).unlink()
+
+
+def get_scratch_stage():
+    """Return the process-wide ``ScratchStage``, or None when ``C3S_SCRATCH_DIR`` is unset."""
+    global _STAGE
+    if SCRATCH_DIR and _STAGE is None:
+        _STAGE = ScratchStage(SCRATCH_DIR, SCRATCH_MAX_BYTES)
+    return _STAGE
+
+
+def stage_inputs(files, pin=False):
+    """
+    Local copies of ``files`` (same nesting) when staging is enabled, else ``files``.
+
+    With ``pin`` the copies stay on scratch until ``release_inputs``.
+    """
+    stage = get_scratch_stage()
+    return stage.stage_inputs(files, pin) if stage is not None else files
+
+
+def pin_inputs(files):
+    """Keep the staged ``files`` (flat or nested) on scratch until ``release_inputs``."""
+    stage = get_scratch_stage()
+    if stage is not None:
+        stage.pin(_flatten(files))
+
+
+def release_inputs(files):
+    """Release files pinned with ``pin_inputs``."""
+    stage = get_scratch_stage()
+    if stage is not None:
+        stage.release(_flatten(files))
+
+
+@contextmanager
+def staged_output(output_file):
+    """
+    Yield the path to write ``output_file`` to, and commit it atomically on success.
+
+    The path is on scratch when staging is enabled, otherwise a temporary
+    file next to the destination. ``output_file`` is therefore either absent
+    or complete; the temporary file is removed if writing fails.
+    """
+    output_file = Path(output_file)
+    stage = get_scratch_stage()
+    if stage is not None:
+        local = stage.output_path(output_file)
+    else:
+        local = output_file.with_name(f".{output_file.name}.{os.getpid()}.tmp")
+    try:
+        yield local
+        if stage is not None:
+            stage.commit_output(local, output_file)
+        else:
+            os.replace(local, output_file)
+    except BaseException:
+        if local.exists():
+            local.unlink()
+        raise
@@ -0,0 +1,91 @@
+"""
+Append new time steps to existing NetCDF outputs.
+
+Outputs written with an unlimited ``time`` dimension (``unlimited_dims``) can
+grow in place: when their source gains time steps (e.g. the current year of
+ERA5T or an ICDR update), only the new steps are computed and written after
+the last ones, so a refresh costs what the new data costs. The data variables
+are written before the time coordinate; a write cut by a killed job leaves
+unset time values, which ``output_times`` ignores, and the next append
+overwrites those steps.
+"""
+import logging
+
+import netCDF4
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def output_times(path, dim="time"):
+    """
+    Return the time steps written to a NetCDF file and whether it can grow.
+
+    Returns
+    -------
+    (numpy.ndarray, bool)
+        The ``datetime64`` values of the complete time steps, and whether
+        ``dim`` is unlimited (so ``append_time_steps`` can extend it).
+    """
+    with netCDF4.Dataset(path) as nc:
+        unlimited = nc.dimensions[dim].isunlimited()
+        var = nc.variables[dim]
+        values = var[:]
+        unset = np.ma.getmaskarray(values)
+        # Steps after the first unset time value belong to an interrupted append
+        n = int(np.argmax(unset)) if unset.any() else len(values)
+        dates = netCDF4.num2date(
+            np.ma.getdata(values[:n]), var.units, getattr(var, "calendar", "standard"),
+            only_use_cftime_datetimes=False, only_use_python_datetimes=True,
+        )
+    return pd.to_datetime(list(dates)).values.astype("datetime64[ns]"), unlimited
+
+
+def missing_times(source_times, path, dim="time"):
+    """
+    Return the source time steps missing from an output, and how to add them.
+
+    Returns
+    -------
+    (numpy.ndarray, str)
+        The missing steps and ``"append"`` when they all follow the last
+        written step of an unlimited dimension, else ``"rewrite"``.
+    """
+    written, unlimited = output_times(path, dim)
+    missing = np.setdiff1d(np.asarray(source_times, dtype="datetime64[ns]"), written)
+    if unlimited and (len(written) == 0 or len(missing) == 0 or missing.min() > written.max()):
+        return missing, "append"
+    return missing, "rewrite"
+
+
+def append_time_steps(path, ds, dim="time"):
+    """
+    Write the time steps of ``ds`` after the complete steps of ``path``.
+
+    Every variable of ``ds`` along ``dim`` that exists in the file is written,
+    then the time coordinate, encoded with the units and calendar of the file.
+    """
+    written, unlimited = output_times(path, dim)
+    if not unlimited:
+        raise ValueError(f"{path}: dimension {dim} is not unlimited; it cannot be appended to")
+    start, n = len(written), ds.sizes[dim]
+
+    with netCDF4.Dataset(path, "a") as nc:
+        for name, da in ds.variables.items():
+            if name == dim or dim not in da.dims or name not in nc.variables:
+                continue
+            var = nc.variables[name]
+            index = tuple(slice(start, start + n) if d == dim else slice(None) for d in var.dimensions)
+            var[index] = da.transpose(*var.dimensions).values
+
+        time_var = nc.variables[dim]
+        dates = pd.to_datetime(ds[dim].values).to_pydatetime()
+        encoded = netCDF4.date2num(dates, time_var.units, getattr(time_var, "calendar", "standard"))
+        if np.issubdtype(time_var.dtype, np.integer):
+            if not np.allclose(encoded, np.round(encoded)):
+                raise ValueError(f"{path}: time steps cannot be encoded exactly in '{time_var.units}'")
+            encoded = np.round(encoded)
+        time_var[start:start + n] = np.asarray(encoded).astype(time_var.dtype)
+
+    logger.info(f"Appended {n} time steps to {path} (now {start + n})")
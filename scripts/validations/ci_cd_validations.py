@@ -1,12 +1,14 @@
 import os
 import sys
 import argparse
-import glob
 import pandas as pd
 import xarray as xr
 import numpy as np
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utilities'))
+from utils_inventory import get_inventory
+
 logger = logging.getLogger(__name__)
 
 def validate_outliers(catalog_path, z_threshold=3.0, max_outlier_percent=1.0):
@@ -28,8 +30,7 @@ def validate_outliers(catalog_path, z_threshold=3.0, max_outlier_percent=1.0):
             
         logger.info(f"Validating dataset: {dataset_name} | Variable: {expected_var}")
         
-        file_pattern = os.path.join(data_path, "*.nc")
-        files = glob.glob(file_pattern)
+        files = get_inventory(data_path).files()
         
         if not files:
             logger.warning(f"No NetCDF files found in {data_path}")
@@ -1,7 +1,6 @@
 import os
 import argparse
 import xarray as xr
-import glob
 import pandas as pd
 import matplotlib.pyplot as plt
 import sys
@@ -17,6 +16,7 @@ sys.path.append(project_root)
 scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(scripts_dir, 'utilities'))
 from logging_utils import setup_logging
+from utils_inventory import get_inventory
 
 logger = logging.getLogger(__name__)
 
@@ -116,8 +116,7 @@ def generate_timeseries_for_variable(
     output_dir = os.path.join(output_root, dataset_name)
     os.makedirs(output_dir, exist_ok=True)
 
-    file_pattern = os.path.join(input_dir, "*.nc")
-    files = sorted(glob.glob(file_pattern))
+    files = get_inventory(input_dir).files()
 
     if not files:
         logger.info(f"Skipping: No NetCDF files found in {input_dir}")
@@ -1,9 +1,19 @@
 import os
+import sys
+from pathlib import Path
 
 import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
 import glob
+
+UTILITIES_DIR = Path(__file__).resolve().parents[1] / "scripts" / "utilities"
+if str(UTILITIES_DIR) not in sys.path:
+    sys.path.append(str(UTILITIES_DIR))
+
+from utils_conservation import AreaIntegrals, ConservationRecorder, band_bias, read_sidecar
+from utils_grids import grid_geometry
+from utils_regrid import make_grid
 # ----------------------------------
 # INPUT FILES
 # ----------------------------------
@@ -24,38 +34,51 @@ ds_newlatlon = xr.open_mfdataset(files_newlatlon, combine="by_coords").sel(time=
 
 
 native = ds_native[var].where(ds_native[var] != -32767)
-interp = ds_interp[var]
-newlatlon = ds_newlatlon[var]
-
-
 
-# 2D latitude field
-lat2d = ds_native["lat"]
 
-lat_bins = np.arange(-90, 91, 1)
-
-native_binned = native.groupby_bins(ds_native["lat"], lat_bins).mean()
-
-lat_centers = 0.5 * (lat_bins[:-1] + lat_bins[1:])
-
-native_zonal = native_binned.assign_coords(
-    lat=("lat_bins", lat_centers)
-)
-
-# Time mean (optional)
-native_zonal_mean = native_zonal.mean(dim="time")
 
 # ----------------------------------
-# --- INTERPOLATED: zonal mean ---
+# RELATIVE BIAS PER LATITUDE BAND
 # ----------------------------------
-
-weights = np.cos(np.deg2rad(interp["lat"]))
-
-interp_zonal = interp.weighted(weights).mean(dim="lon")
-interp_zonal_mean = interp_zonal.mean(dim="time")
-
-newlatlon_zonal = newlatlon.weighted(weights).mean(dim="lon")
-newlatlon_zonal_mean = newlatlon_zonal.mean(dim="time")
+# The interpolation writes the area-weighted means of the source and
+# interpolated fields per latitude band to a {name}.conservation.json sidecar
+# next to every output. Outputs without sidecars are integrated here the same
+# way: EASE2 cells from the grid registry, target cells from their bounds.
+TOLERANCE = 0.01   # relative bias flagged per band
+
+target_grid = make_grid(ds_interp["lat"].values, ds_interp["lon"].values, bounds=True)
+geometry = grid_geometry(ds_native, "ease2-nh")
+native_grid = make_grid(
+    geometry["lat"].values, geometry["lon"].values, bounds=True,
+    corners=(geometry["lat_b"].values, geometry["lon_b"].values),
+)
+native_integrals = AreaIntegrals(native_grid, domain=target_grid)
+target_integrals = AreaIntegrals(target_grid)
+
+
+def relative_bias_per_band(files, ds):
+    """Relative bias of the domain and band means, from the sidecars when every file has one."""
+    summaries = [read_sidecar(f) for f in sorted(files)]
+    if summaries and all(summaries):
+        table = band_bias(*summaries)
+    else:
+        recorder = ConservationRecorder(native_integrals, target_integrals, var, "unknown")
+        times = np.intersect1d(native["time"].values, ds["time"].values)
+        recorder.add(times, native.sel(time=times).values, ds[var].sel(time=times).values)
+        table = band_bias(recorder.summary())
+    # Bands outside the target domain have no valid steps
+    return table[table["steps"] > 0]
+
+
+results = {
+    "Interpolated_original": relative_bias_per_band(files_interp, ds_interp),
+    "Interpolated_newlatlon": relative_bias_per_band(files_newlatlon, ds_newlatlon),
+}
+for label, table in results.items():
+    print(f"{label}:\n{table.to_string(float_format='%.3e')}")
+    flagged = table[table["relative_bias"].abs() > TOLERANCE]
+    if not flagged.empty:
+        print(f"{label}: relative bias above {TOLERANCE:.0%} in {list(flagged.index)}")
 
 outdir = "figures_validation"
 os.makedirs(outdir, exist_ok=True)
@@ -64,44 +87,25 @@ os.makedirs(outdir, exist_ok=True)
 # ----------------------------------
 plt.figure(figsize=(6, 8))
 
-plt.plot(native_zonal_mean, lat_centers, label="Native (LAEA, no interp)", linestyle="-")
-plt.plot(interp_zonal_mean, interp_zonal_mean["lat"], label="Interpolated_original", linestyle="--")
-plt.plot(newlatlon_zonal_mean, newlatlon_zonal_mean["lat"], label="Interpolated_newlatlon", linestyle=":")
+for (label, table), linestyle in zip(results.items(), ("--", ":")):
+    bands = table.drop(index="domain")
+    plt.plot(100 * bands["relative_bias"], range(len(bands)), marker="o", linestyle=linestyle, label=label)
+plt.axvline(0, color="black", linewidth=0.8)
+plt.yticks(range(len(bands)), bands.index)
 
-
-plt.xlabel("Sea Ice Concentration (%)")
-plt.ylabel("Latitude")
-plt.title("Zonal Mean Sea Ice Concentration (1980)")
+plt.xlabel("Relative bias of the band mean (%)")
+plt.ylabel("Latitude band")
+plt.title("Interpolated - Native Sea Ice Concentration (1980)")
 
 plt.legend()
 plt.grid()
 
 plt.tight_layout()
+plt.savefig(f"{outdir}/band_bias_comparison_1980.png", dpi=300)
 plt.show()
-plt.savefig(f"{outdir}/zonal_mean_comparison_1980.png", dpi=300)
-# ----------------------------------
-# DIFFERENCE (optional)
-# ----------------------------------
-
-# Interpolate interpolated curve onto same lat bins for comparison
-interp_on_bins = interp_zonal_mean.interp(lat=lat_centers)
-
-diff = interp_on_bins - native_zonal_mean
-
-plt.figure(figsize=(6, 8))
-plt.plot(diff, lat_centers)
-plt.axvline(0, linestyle="--")
-
-plt.xlabel("Difference (%)")
-plt.ylabel("Latitude")
-plt.title("Difference (Interp - Native)")
-
-plt.grid()
-plt.tight_layout()
-plt.show()
-plt.savefig(f"{outdir}/difference_comparison.png", dpi=300)
 # ----------------------------------
 # CLEANUP
 # ----------------------------------
 ds_native.close()
-ds_interp.close()
\ No newline at end of file
+ds_interp.close()
+ds_newlatlon.close()